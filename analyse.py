@@ -0,0 +1,290 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import count
+import engine
+from board import Board
+from engine import MinMaxArg, suggest_move, analyse as analyse_lines
+from position import Position, PositionReader
+from util import cell_to_string
+
+
+# Number of positions queued per worker, bounds the memory used for results not yet written
+QUEUE_PER_WORKER = 4
+
+# Board reused by every position a worker process analyses
+worker_board = None
+
+
+def read_positions(sources, stdin=None):
+    """
+    Streams the positions of the given sources as tuples (id, position).
+
+    A source is a directory (all .board files below it, in sorted order), a .board file, a binary position file
+    (see :py:class:`position.PositionReader`), a text file with one FEN per line or "-" for FEN lines from stdin.
+    Only the position currently handed out is held in memory.
+    """
+    board = Board()
+
+    for source in sources:
+        if source == "-":
+            yield from read_fen_lines("stdin", stdin if stdin is not None else sys.stdin)
+        elif os.path.isdir(source):
+            for directory, subdirectories, files in os.walk(source):
+                subdirectories.sort()
+                for name in sorted(files):
+                    if name.endswith(".board"):
+                        path = os.path.join(directory, name)
+                        board.load_from_disk(path)
+                        yield path, Position.from_board(board)
+        elif source.endswith(".board"):
+            board.load_from_disk(source)
+            yield source, Position.from_board(board)
+        elif is_position_file(source):
+            with PositionReader(source) as reader:
+                for index in range(len(reader)):
+                    yield f"{source}:{index}", reader[index][0]
+        else:
+            with open(source, "rt") as f:
+                yield from read_fen_lines(source, f)
+
+
+def read_fen_lines(name, lines):
+    """
+    Streams the positions of a text with one FEN per line. Empty lines and lines starting with "#" are skipped,
+    invalid lines are reported on stderr and skipped as well.
+    """
+    board = Board()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        try:
+            board.load_fen(line)
+        except ValueError as error:
+            print(f"{name}:{number}: {error}", file=sys.stderr)
+            continue
+
+        yield f"{name}:{number}", Position.from_board(board)
+
+
+def is_position_file(path):
+    """
+    Returns True if the file starts with the header of a binary position file
+    """
+    with open(path, "rb") as f:
+        return f.read(4) == b"MCPF"
+
+
+def analyse_position(position, depth, multipv=1):
+    """
+    Searches one position. Runs in the worker processes.
+
+    :param multipv: Number of best moves to report. If more than one, the result holds them as "lines", each with
+                    its principal variation.
+    :return: The result as dictionary (without id)
+    """
+    global worker_board
+
+    if worker_board is None:
+        worker_board = Board()
+
+    # Start every position with empty search caches, so the memory of a worker does not grow over a long job
+    engine.eval_cache.clear()
+    worker_board.check_cache.clear()
+    board = position.to_board(worker_board)
+
+    start = time.perf_counter()
+    if multipv > 1:
+        lines = analyse_lines(board, multipv, MinMaxArg(depth=depth, playAsWhite=position.white))
+        move = lines[0] if lines else suggest_move(board, minMaxArg=MinMaxArg(depth=depth, playAsWhite=position.white))
+    else:
+        lines = None
+        move = suggest_move(board, minMaxArg=MinMaxArg(depth=depth, playAsWhite=position.white))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "fen": board.to_fen(),
+        "move": cell_to_string(move.piece.cell) + cell_to_string(move.cell) if move.piece is not None else None,
+        "score": move.score,
+        "nodes": move.stats.nodes,
+        "time": elapsed,
+    }
+
+    if lines is not None:
+        result["lines"] = [{"score": line.score, "pv": [cell_to_string(origin) + cell_to_string(target) for origin, target in line.pv]}
+                           for line in lines]
+
+    return result
+
+
+def analyse(positions, depth, workers, ordered=True, skip=lambda index: False, multipv=1):
+    """
+    Analyses a stream of positions in a process pool, keeping at most QUEUE_PER_WORKER positions per worker in flight.
+
+    :param positions: Iterable of tuples (id, position)
+    :param depth: Search depth
+    :param workers: Number of worker processes
+    :param ordered: If True, results are yielded in the order of the input. Otherwise as soon as they are done.
+    :param skip: Called with the index of every position, positions for which it returns True are not analysed
+    :param multipv: Number of best moves to report per position, see :py:func:`analyse_position`
+    :return: Generator of result dictionaries, tagged with the "index" and "id" of the position
+    """
+    pending = deque()
+    limit = max(1, workers) * QUEUE_PER_WORKER
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        def submit(index, name, position):
+            future = pool.submit(analyse_position, position, depth, multipv)
+            future.tag = {"index": index, "id": name}
+            pending.append(future)
+
+        def collect(future):
+            pending.remove(future)
+            return {**future.tag, **future.result()}
+
+        for index, (name, position) in zip(count(), positions):
+            if skip(index):
+                continue
+
+            submit(index, name, position)
+
+            # Wait for a result before queueing more positions
+            while len(pending) >= limit:
+                if ordered:
+                    yield collect(pending[0])
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in sorted(done, key=lambda future: future.tag["index"]):
+                        yield collect(future)
+
+        while pending:
+            if ordered:
+                yield collect(pending[0])
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=lambda future: future.tag["index"]):
+                    yield collect(future)
+
+
+class Checkpoint:
+    """
+    Progress of an analysis job written next to its output file, so an interrupted job can resume.
+
+    Instead of the ids of all finished positions, the checkpoint holds the number of leading positions that are all
+    finished plus the (few) finished positions after them, so its size does not grow with the job. It also records the
+    length of the output at the time it was written: output written after the last checkpoint is discarded on resume.
+    Without a checkpoint (offset None), results are appended to the output.
+    """
+    def __init__(self, path, job):
+        """
+        Constructor. Loads the checkpoint if it exists.
+
+        :param path: The checkpoint file
+        :param job: Description of the job (inputs and settings), a checkpoint of a different job is rejected
+        :raises ValueError: If the checkpoint file belongs to a different job
+        """
+        self.path = path
+        self.job = job
+        self.done = 0
+        self.finished = set()
+        self.offset = None
+
+        if os.path.exists(path):
+            with open(path, "rt") as f:
+                state = json.load(f)
+
+            if state["job"] != job:
+                raise ValueError(f"{path} belongs to a different job, use --restart to start over")
+
+            self.done = state["done"]
+            self.finished = set(state["finished"])
+            self.offset = state["offset"]
+
+    def is_finished(self, index):
+        return index < self.done or index in self.finished
+
+    def finish(self, index):
+        """
+        Marks the position with the given index as finished
+        """
+        self.finished.add(index)
+        while self.done in self.finished:
+            self.finished.remove(self.done)
+            self.done += 1
+
+    def save(self, offset):
+        """
+        Writes the checkpoint. The file is replaced atomically, so an interruption never leaves a broken checkpoint.
+
+        :param offset: Length of the output file, everything written so far is covered by this checkpoint
+        """
+        self.offset = offset
+        state = {"job": self.job, "done": self.done, "finished": sorted(self.finished), "offset": offset}
+
+        with open(self.path + ".tmp", "wt") as f:
+            json.dump(state, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def main(argv=None, stdin=None):
+    parser = argparse.ArgumentParser(prog="main.py analyse", description="Analyses a stream of positions in a process pool, writing one JSON line per position.")
+    parser.add_argument("sources", nargs="*", default=["-"], help=".board files, directories, binary position files, FEN files or - for FENs from stdin (default: -)")
+    parser.add_argument("-o", "--output", help="append the results to this file and checkpoint the progress (default: stdout, no checkpoint)")
+    parser.add_argument("-d", "--depth", type=int, default=engine.DEPTH, help=f"search depth (default: {engine.DEPTH})")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--multipv", type=int, default=1, help="report the N best moves with their lines (default: 1)")
+    parser.add_argument("--unordered", action="store_true", help="write results as soon as they are done instead of in input order")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="write the checkpoint every N results (default: 100)")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint and overwrite the output")
+    args = parser.parse_args(argv)
+
+    positions = read_positions(args.sources, stdin)
+
+    if args.output is None:
+        for result in analyse(positions, args.depth, args.workers, ordered=not args.unordered, multipv=args.multipv):
+            print(json.dumps(result), flush=True)
+        return 0
+
+    checkpoint_path = args.output + ".checkpoint"
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    job = {"sources": args.sources, "depth": args.depth}
+    if args.multipv != 1:
+        job["multipv"] = args.multipv
+    checkpoint = Checkpoint(checkpoint_path, job)
+
+    # Drop results written after the last checkpoint, those positions are analysed again
+    with open(args.output, "ab") as output:
+        if args.restart:
+            output.truncate(0)
+        elif checkpoint.offset is not None:
+            output.truncate(checkpoint.offset)
+
+    written = 0
+    with open(args.output, "at") as output:
+        try:
+            for result in analyse(positions, args.depth, args.workers, not args.unordered, checkpoint.is_finished, args.multipv):
+                output.write(json.dumps(result) + "\n")
+                checkpoint.finish(result["index"])
+                written += 1
+
+                if written % args.checkpoint_every == 0:
+                    output.flush()
+                    checkpoint.save(output.tell())
+        finally:
+            output.flush()
+            checkpoint.save(output.tell())
+
+    print(f"Analysed {written} positions, {checkpoint.done} done in total", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
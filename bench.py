@@ -0,0 +1,159 @@
+import argparse
+import json
+import sys
+import time
+import engine
+from board import Board
+from engine import MinMaxArg, suggest_move
+from util import cell_to_string
+
+
+# Positions of the benchmark, "startpos" is the default start configuration
+POSITIONS = [
+    "startpos",
+    "tests/random1.board",
+    "tests/random2.board",
+    "tests/bishop.board",
+    "tests/king.board",
+    "tests/knight.board",
+    "tests/pawn.board",
+    "tests/queen.board",
+    "tests/rook.board",
+]
+
+BASELINE_FILE = "tests/bench_baseline.json"
+
+
+def clear_caches():
+    """
+    Empties all engine caches, so every position is searched from scratch
+    """
+    engine.eval_cache.clear()
+    engine.static_eval_cache.clear()
+
+
+def bench_position(name, depth):
+    """
+    Searches one position with an empty cache and returns the measurements as dictionary
+    """
+    board = Board()
+    if name == "startpos":
+        board.reset()
+    else:
+        board.load_from_disk(name)
+
+    clear_caches()
+
+    start = time.perf_counter()
+    move = suggest_move(board, minMaxArg=MinMaxArg(depth=depth))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "position": name,
+        "move": None,
+        "score": move.score,
+        "nodes": move.stats.nodes,
+        "leaf_evaluations": move.stats.leaf_evaluations,
+        "legality_checks": move.stats.legality_checks,
+        "time": elapsed,
+        "nps": move.stats.nodes / max(elapsed, 1e-9),
+        "cache_hit_rate": move.stats.cache_hit_rate(),
+        "eval_cache_hit_rate": engine.static_eval_cache.hit_rate(),
+        "effective_branching_factor": move.stats.effective_branching_factor(),
+    }
+
+    if move.piece is not None:
+        result["move"] = cell_to_string(move.piece.cell) + cell_to_string(move.cell)
+
+    return result
+
+
+def run(depth, positions=POSITIONS):
+    """
+    Runs the benchmark on all positions
+
+    :return: Dictionary with the results per position and the totals
+    """
+    results = [bench_position(name, depth) for name in positions]
+
+    nodes = sum(result["nodes"] for result in results)
+    elapsed = sum(result["time"] for result in results)
+
+    return {
+        "depth": depth,
+        "positions": results,
+        "nodes": nodes,
+        "time": elapsed,
+        "nps": nodes / max(elapsed, 1e-9),
+        "time_per_move": elapsed / max(len(results), 1),
+    }
+
+
+def compare(report, baseline, threshold):
+    """
+    Compares a benchmark report against a baseline.
+
+    :param threshold: Allowed relative drop of nodes per second before it is reported (e.g. 0.1 for 10%)
+    :return: List of human readable problems, empty if there are none
+    """
+    problems = []
+
+    if report["depth"] != baseline["depth"]:
+        return [f"depth {report['depth']} does not match the baseline depth {baseline['depth']}"]
+
+    known = {result["position"]: result for result in baseline["positions"]}
+    for result in report["positions"]:
+        expected = known.get(result["position"])
+        if expected is None:
+            continue
+
+        if result["move"] != expected["move"] or result["score"] != expected["score"]:
+            problems.append(f"{result['position']}: move {result['move']} ({result['score']}) differs from baseline {expected['move']} ({expected['score']})")
+
+        if result["nodes"] != expected["nodes"]:
+            problems.append(f"{result['position']}: {result['nodes']} nodes differ from baseline {expected['nodes']}")
+
+    if report["nps"] < baseline["nps"] * (1.0 - threshold):
+        problems.append(f"nodes per second dropped from {baseline['nps']:.0f} to {report['nps']:.0f}")
+
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py bench", description="Benchmarks suggest_move on a fixed set of positions.")
+    parser.add_argument("-d", "--depth", type=int, default=engine.DEPTH, help=f"search depth (default: {engine.DEPTH})")
+    parser.add_argument("-o", "--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--save", action="store_true", help=f"store the report as new baseline in {BASELINE_FILE}")
+    parser.add_argument("--compare", action="store_true", help=f"compare the report against {BASELINE_FILE}")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed nodes per second drop for --compare (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    report = run(args.depth)
+    text = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "wt") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.save:
+        with open(BASELINE_FILE, "wt") as f:
+            f.write(text)
+
+    if args.compare:
+        with open(BASELINE_FILE, "rt") as f:
+            baseline = json.load(f)
+
+        problems = compare(report, baseline, args.threshold)
+        for problem in problems:
+            print("REGRESSION:", problem, file=sys.stderr)
+
+        if problems:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
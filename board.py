@@ -1,5 +1,6 @@
 from operator import is_
 import os
+import random
 import numpy as np
 from uuid import uuid4
 from pieces import Pawn, Rook, Bishop, Queen, King, Knight
@@ -9,6 +10,26 @@ from util import (
     InvalidRowException,
 )
 
+# Maps every character of the FEN piece placement field to either a (piece class, white) pair or a number of empty cells
+FEN_TABLE = {
+    "P": (Pawn, True), "R": (Rook, True), "N": (Knight, True), "B": (Bishop, True), "Q": (Queen, True), "K": (King, True),
+    "p": (Pawn, False), "r": (Rook, False), "n": (Knight, False), "b": (Bishop, False), "q": (Queen, False), "k": (King, False),
+    "1": 1, "2": 2, "3": 3, "4": 4, "5": 5, "6": 6, "7": 7, "8": 8,
+}
+
+# Maps the piece classes to their (WHITE) FEN character
+FEN_CHARACTERS = {Pawn: "P", Rook: "R", Knight: "N", Bishop: "B", Queen: "Q", King: "K"}
+
+# FEN of the default start configuration
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Random 64 bit numbers of every (piece class, white) pair on every cell (row * 8 + col). The Zobrist key of a board is
+# the XOR of the numbers of all its pieces, so placing or removing a piece updates it with a single XOR.
+_zobrist_random = random.Random(0x5A0B)
+ZOBRIST_KEYS = {(pieceClass, white): tuple(_zobrist_random.getrandbits(64) for _ in range(64))
+                for pieceClass in FEN_CHARACTERS for white in (True, False)}
+
+
 class BoardBase:
     """
     Base Class for the Chess Board.
@@ -20,7 +41,21 @@ class BoardBase:
         Start with empty cells
         """
         self.cells = [[None for _ in range(8)] for _ in range(8)]
+        self.zobrist = 0
         self.check_cache = {}
+        self.stats = None
+
+        self.reset_game_state()
+
+    def __getstate__(self):
+        """
+        Leaves the check cache out when the board is pickled, it can grow large and is rebuilt on demand.
+        Use :py:class:`position.Position` to send positions to other processes in an even more compact way.
+        """
+        state = self.__dict__.copy()
+        state["check_cache"] = {}
+        state["stats"] = None
+        return state
 
     def __str__(self):
         """
@@ -46,6 +81,31 @@ class BoardBase:
             ]
         )
     
+    def rehash(self):
+        """
+        Recomputes :py:attr:`zobrist`, the 64 bit Zobrist key of the piece placement. :py:meth:`set_cell` keeps the key
+        up to date, this is only needed after :py:attr:`cells` was replaced as a whole.
+        """
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.cells[row][col]
+                if piece is not None:
+                    key ^= ZOBRIST_KEYS[piece.__class__, piece.white][row * 8 + col]
+        self.zobrist = key
+
+    def reset_game_state(self, castling="-"):
+        """
+        Resets the game state beyond the piece placement (as carried by FEN): WHITE to move, no en passant cell, first move
+
+        :param castling: The castling rights in FEN notation, "-" for none
+        """
+        self.white_to_move = True
+        self.castling = castling
+        self.en_passant = "-"
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+
     def save_to_disk(self, fname = None):
         """
         Saves current board configuration to disk.
@@ -66,6 +126,7 @@ class BoardBase:
         Clears to board, deleting all pieces currently placed on it
         """
         self.cells = [[None for _ in range(8)] for _ in range(8)]
+        self.zobrist = 0
 
 
     def load_from_memory(self, configString):
@@ -75,6 +136,10 @@ class BoardBase:
         :param name: Filename to use. 
         """       
         self.cells = [[None for _ in range(8)] for _ in range(8)]
+        self.zobrist = 0
+
+        # This format only holds the pieces
+        self.reset_game_state()
 
         for row, line in enumerate(configString.split("\n")):
               line = line.strip()
@@ -104,6 +169,109 @@ class BoardBase:
 
                 self.set_cell(np.array([7-row, col]), piece)
 
+    @classmethod
+    def from_fen(cls, fen):
+        """
+        Creates a new board holding the position given in Forsyth-Edwards Notation
+
+        :param fen: The FEN string. Only the piece placement is required, the remaining fields default to "w - - 0 1"
+        """
+        board = cls()
+        board.load_fen(fen)
+        return board
+
+    def load_fen(self, fen):
+        """
+        Reads a position given in Forsyth-Edwards Notation, replacing all pieces currently placed on the board.
+        The piece placement is parsed in a single pass over the string, looking up every character in :py:data:`FEN_TABLE`.
+        Side to move, castling rights, en passant cell and move counters are kept, so :py:meth:`to_fen` returns the same string.
+
+        :param fen: The FEN string. Only the piece placement is required, the remaining fields default to "w - - 0 1"
+        :raises ValueError: If the string is not a valid FEN
+        """
+        fields = fen.split()
+        if not 1 <= len(fields) <= 6:
+            raise ValueError(f"Invalid FEN: {fen!r}")
+
+        cells = [[None] * 8 for _ in range(8)]
+        row, col = 7, 0
+
+        for character in fields[0]:
+            if character == "/":
+                # A rank is complete only once all eight cells are accounted for
+                if col != 8 or row == 0:
+                    raise ValueError(f"Invalid piece placement in FEN: {fen!r}")
+                row -= 1
+                col = 0
+                continue
+
+            entry = FEN_TABLE.get(character)
+            if entry is None:
+                raise ValueError(f"Invalid character {character!r} in FEN: {fen!r}")
+
+            if entry.__class__ is int:
+                col += entry
+                if col > 8:
+                    raise ValueError(f"Invalid piece placement in FEN: {fen!r}")
+                continue
+
+            if col >= 8:
+                raise ValueError(f"Invalid piece placement in FEN: {fen!r}")
+
+            # Place the piece directly, set_cell would look for a previous cell and allocate an array
+            pieceClass, white = entry
+            piece = pieceClass(self, white)
+            piece.cell = (row, col)
+            cells[row][col] = piece
+            col += 1
+
+        if row != 0 or col != 8:
+            raise ValueError(f"Invalid piece placement in FEN: {fen!r}")
+
+        fields += ["w", "-", "-", "0", "1"][len(fields) - 1:]
+        if fields[1] not in ("w", "b"):
+            raise ValueError(f"Invalid side to move in FEN: {fen!r}")
+
+        try:
+            halfmove_clock, fullmove_number = int(fields[4]), int(fields[5])
+        except ValueError:
+            raise ValueError(f"Invalid move counters in FEN: {fen!r}") from None
+
+        self.cells = cells
+        self.rehash()
+        self.white_to_move = fields[1] == "w"
+        self.castling = fields[2]
+        self.en_passant = fields[3]
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+
+    def to_fen(self):
+        """
+        Returns the current board configuration in Forsyth-Edwards Notation, including side to move
+        """
+        ranks = []
+        for row in reversed(self.cells):
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece is None:
+                    empty += 1
+                    continue
+
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+
+                character = FEN_CHARACTERS[piece.__class__]
+                rank += character if piece.white else character.lower()
+
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+
+        return (f"{'/'.join(ranks)} {'w' if self.white_to_move else 'b'} {self.castling} {self.en_passant} "
+                f"{self.halfmove_clock} {self.fullmove_number}")
+
     def load_from_disk(self, fname):
         """
         Read previously stored configuration from disk
@@ -119,8 +287,12 @@ class BoardBase:
         """
         Calls is_king_check for board configurations not yet known. Caches the result for later look-up.
         """
+        # Count the check if a search is collecting statistics on this board
+        if self.stats is not None:
+            self.stats.legality_checks += 1
+
         # Calculate hash and see if current position is in the cache
-        hash = self.hash() + "-w" if white else "-b"
+        hash = self.hash() + ("-w" if white else "-b")
         if hash in self.check_cache:
             return self.check_cache[hash]
 
@@ -168,7 +340,13 @@ class BoardBase:
             # Update the pieces cell
             piece.cell = np.array([row, col])
 
-        # Update the cell on the board
+        # Update the cell on the board and its Zobrist key
+        index = row * 8 + col
+        previous = self.cells[row][col]
+        if previous is not None:
+            self.zobrist ^= ZOBRIST_KEYS[previous.__class__, previous.white][index]
+        if piece is not None:
+            self.zobrist ^= ZOBRIST_KEYS[piece.__class__, piece.white][index]
         self.cells[row][col] = piece
 
     def reset(self):
@@ -177,6 +355,7 @@ class BoardBase:
         """
         # Start with all empty cells
         self.cells = [[None for _ in range(8)] for _ in range(8)]
+        self.zobrist = 0
 
         # Pawns
         for col in range(8):
@@ -209,6 +388,9 @@ class BoardBase:
         self.set_cell(np.array([0, 4]), King(self, True))
         self.set_cell(np.array([7, 4]), King(self, False))
 
+        # WHITE starts, all castling rights are still available
+        self.reset_game_state("KQkq")
+
         #self.save_to_disk()
 
 
@@ -291,6 +473,10 @@ class Board(BoardBase):
         # Finds the king of a given color (white=True or False)
         position_king = self.find_king(white)
 
+        # Without a king on the board, there is nothing to check
+        if position_king is None:
+            return False
+
         # Unpack the tuple of the kings cell
         king_row, king_col = position_king.cell
 
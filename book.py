@@ -0,0 +1,255 @@
+import argparse
+import mmap
+import os
+import sys
+import time
+from struct import Struct
+from board import Board, START_FEN
+from pgn import open_pgn, read_games, play_move, IllegalMoveError
+from position import Position
+from util import cell_to_string
+
+
+# Number of moves (plies) of every game that are added to the book by default
+BOOK_PLIES = 16
+
+# Environment variable naming a book file to load at startup, see engine.enable_book
+BOOK_ENV = "MCHESS_BOOK"
+
+
+class BookFile:
+    """
+    Layout of opening book files: a header followed by fixed-width records sorted by position key, so the moves of a
+    position are found by binary search.
+
+    Every record holds the 64 bit :py:attr:`key <position.Position.key>` of a position, a move encoded as
+    origin cell index << 6 | target cell index (as :py:func:`engine.encode_move`) and the weight of the move. The
+    records of one position are sorted by decreasing weight.
+    """
+    MAGIC = b"MCOB"
+    VERSION = 1
+    HEADER = Struct("<4sHH")
+    RECORD = Struct("<QHH")
+
+    # Weights are stored as 16 bit numbers
+    MAX_WEIGHT = 0xFFFF
+
+
+def encode_move(origin, target):
+    return (origin[0] * 8 + origin[1]) << 6 | (target[0] * 8 + target[1])
+
+
+def decode_move(code):
+    """
+    :return: Tuple (origin, target) of the cells of an encoded move
+    """
+    origin, target = code >> 6, code & 63
+    return (origin // 8, origin % 8), (target // 8, target % 8)
+
+
+def collect_moves(games, plies=BOOK_PLIES, errors=None, counts=None):
+    """
+    Counts how often every move was played in every position within the first plies of the given games.
+
+    :param games: Iterable of :py:class:`pgn.Game`, e.g. from :py:func:`pgn.read_games`
+    :param plies: Number of moves of every game to count
+    :param errors: Optional list, games with an illegal move are appended as tuples (game, error) instead of raising.
+                   The moves before the illegal one are counted.
+    :param counts: Dictionary to add the counts to, e.g. from a previous call. If None, a new one is created.
+    :return: Dictionary mapping (key, encoded move) to the number of games the move was played in
+    """
+    if counts is None:
+        counts = {}
+    board = Board()
+
+    for game in games:
+        board.load_fen(game.headers.get("FEN", START_FEN))
+        board.check_cache.clear()
+
+        for san in game.moves[:plies]:
+            key = Position.from_board(board).key
+            try:
+                origin, target = play_move(board, san)
+            except IllegalMoveError as error:
+                if errors is None:
+                    raise
+                errors.append((game, error))
+                break
+
+            entry = key, encode_move(origin, target)
+            counts[entry] = counts.get(entry, 0) + 1
+
+    return counts
+
+
+def write_book(path, counts, min_count=1):
+    """
+    Writes an opening book file
+
+    :param path: The file to write, an existing file is replaced
+    :param counts: Dictionary mapping (key, encoded move) to its weight, see :py:func:`collect_moves`
+    :param min_count: Moves played less often are left out
+    :return: Number of records written
+    """
+    records = sorted(((key, -min(count, BookFile.MAX_WEIGHT), move) for (key, move), count in counts.items() if count >= min_count))
+
+    # Write to a temporary file first, so a process reading the old book never sees a partial file
+    with open(path + ".tmp", "wb") as f:
+        f.write(BookFile.HEADER.pack(BookFile.MAGIC, BookFile.VERSION, BookFile.RECORD.size))
+        f.write(b"".join(BookFile.RECORD.pack(key, move, -weight) for key, weight, move in records))
+    os.replace(path + ".tmp", path)
+
+    return len(records)
+
+
+class OpeningBook:
+    """
+    Reads an opening book file through a memory map. A lookup is a binary search over the records,
+    so only the few pages it touches are loaded from disk and probing costs microseconds.
+    """
+    def __init__(self, path):
+        """
+        Constructor. Maps the file into memory and verifies its header.
+
+        :param path: The book file
+        :raises ValueError: If the file is not an opening book of this version
+        """
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        if size < BookFile.HEADER.size:
+            self.close()
+            raise ValueError(f"{path} is not an opening book")
+
+        magic, version, record_size = BookFile.HEADER.unpack_from(self.map)
+        if magic != BookFile.MAGIC or version != BookFile.VERSION or record_size != BookFile.RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not an opening book of version {BookFile.VERSION}")
+
+        self.count = (size - BookFile.HEADER.size) // BookFile.RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index):
+        """
+        Returns record *index* as tuple (key, encoded move, weight)
+        """
+        return BookFile.RECORD.unpack_from(self.map, BookFile.HEADER.size + index * BookFile.RECORD.size)
+
+    def lookup(self, key):
+        """
+        Returns the book moves of a position
+
+        :param key: The :py:attr:`key <position.Position.key>` of the position
+        :return: List of tuples (origin, target, weight), the most played move first. Empty if the position is unknown.
+        """
+        # Find the first record of the key
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.record(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        moves = []
+        for index in range(low, self.count):
+            recordKey, code, weight = self.record(index)
+            if recordKey != key:
+                break
+            moves.append((*decode_move(code), weight))
+
+        return moves
+
+    def choose(self, board, white=None, rng=None):
+        """
+        Picks a book move for a board. Moves that are not legal on the board (a key collision) are skipped.
+
+        :param board: The board to move on
+        :param white: True if WHITE is to move. If None, the side to move of the board is used.
+        :param rng: Optional :py:class:`random.Random`. If given, a move is drawn with a chance proportional to its
+                    weight, otherwise the most played move is taken.
+        :return: Tuple (piece, target cell) or None if the position is not in the book
+        """
+        if white is None:
+            white = board.white_to_move
+
+        moves = []
+        for origin, target, weight in self.lookup(Position.from_board(board, white).key):
+            piece = board.get_cell(origin)
+            if piece is not None and piece.white == white and target in piece.get_valid_cells():
+                moves.append((piece, target, weight))
+
+        if not moves:
+            return None
+
+        if rng is not None:
+            piece, target, _ = rng.choices(moves, weights=[weight for _, _, weight in moves])[0]
+        else:
+            piece, target, _ = moves[0]
+
+        return piece, target
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds and probes opening books.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("files", nargs="+", help="PGN files, .gz or .bz2 compressed, - for stdin")
+    build.add_argument("-o", "--output", required=True, help="the book file to write")
+    build.add_argument("--plies", type=int, default=BOOK_PLIES, help=f"number of moves of every game to add (default: {BOOK_PLIES})")
+    build.add_argument("--min-count", type=int, default=1, help="leave out moves played less often (default: 1)")
+
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book", help="the book file")
+    probe.add_argument("fen", nargs="*", help="the position (default: start position)")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        errors = []
+        counts = {}
+        start = time.perf_counter()
+
+        for path in args.files:
+            with open_pgn(path) as f:
+                collect_moves(read_games(f), args.plies, errors, counts)
+
+        for game, error in errors:
+            print(f"{game.headers.get('White', '?')} - {game.headers.get('Black', '?')}: {error}", file=sys.stderr)
+
+        records = write_book(args.output, counts, args.min_count)
+        print(f"{records} moves written to {args.output} in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+        return 0
+
+    board = Board.from_fen(" ".join(args.fen)) if args.fen else Board.from_fen(START_FEN)
+    with OpeningBook(args.book) as book:
+        start = time.perf_counter()
+        moves = book.lookup(Position.from_board(board).key)
+        elapsed = time.perf_counter() - start
+
+    for origin, target, weight in moves:
+        print(f"{cell_to_string(origin)}{cell_to_string(target)} {weight}")
+    print(f"{len(moves)} moves in {1e6 * elapsed:.1f}us", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+from hashlib import blake2b
+from multiprocessing.shared_memory import SharedMemory
+from struct import Struct
+
+
+class HashTable:
+    """
+    Small fixed-size hash table used to cache values keyed by a board position.
+
+    Unlike a plain dictionary this table never grows: every key maps to exactly one slot
+    and a newer entry simply replaces whatever was stored in that slot before (always-replace scheme).
+    This keeps the memory footprint constant, no matter how many positions a search visits.
+
+    The table counts its probes, hits and stores, so the effectiveness of the cache can be reported.
+    """
+    def __init__(self, size=2**16):
+        """
+        Constructor. Creates an empty table.
+
+        :param size: Number of slots. Must be a power of two.
+        """
+        if size <= 0 or size & (size - 1) != 0:
+            raise ValueError("HashTable size must be a power of two")
+
+        self.size = size
+        self.mask = size - 1
+        self.slots = [None] * size
+        self.filled = 0
+        self.reset_counters()
+
+    def reset_counters(self):
+        """
+        Resets the probe, hit and store counters without touching the stored entries.
+        """
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def clear(self):
+        """
+        Removes all entries from the table and resets the counters.
+        """
+        self.slots = [None] * self.size
+        self.filled = 0
+        self.reset_counters()
+
+    def get(self, key):
+        """
+        Looks up the value stored for the given key.
+
+        :param key: The (hashable) key to look up, e.g. the result of :py:meth:`hash <board.BoardBase.hash>`
+        :return: The stored value or None if the key is not in the table
+        """
+        self.probes += 1
+
+        # Only one slot can hold the key, make sure it was not overwritten by another key in the meantime
+        entry = self.slots[hash(key) & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+
+        return None
+
+    def put(self, key, value):
+        """
+        Stores a value for the given key, replacing any entry currently placed in the same slot.
+        """
+        self.stores += 1
+
+        index = hash(key) & self.mask
+        if self.slots[index] is None:
+            self.filled += 1
+        self.slots[index] = (key, value)
+
+    def occupancy(self):
+        """
+        Returns the fraction of slots currently holding an entry (between 0.0 and 1.0)
+        """
+        return self.filled / self.size
+
+    def hit_rate(self):
+        """
+        Returns the fraction of probes answered from the table (between 0.0 and 1.0)
+        """
+        if self.probes == 0:
+            return 0.0
+
+        return self.hits / self.probes
+
+    def __str__(self):
+        return f"{self.hits}/{self.probes} hits ({100.0 * self.hit_rate():.1f}%), {self.stores} stores"
+
+
+def position_key(text):
+    """
+    Turns a position hash string (e.g. the result of :py:meth:`hash <board.BoardBase.hash>`) into a 64 bit integer key.
+    Unlike python's built-in hash() this key is the same in every process, so it can be shared between them.
+    """
+    return int.from_bytes(blake2b(text.encode("ascii"), digest_size=8).digest(), "little")
+
+
+class SharedTranspositionTable:
+    """
+    Transposition table placed in a shared memory buffer, so several worker processes can use the same table.
+
+    Every slot is a fixed-width record of a check word, the score and an encoded move. The check word is the key
+    XOR-ed with the data words. Writes are done without any locking: if two processes write the same slot at the
+    same time, the record may end up mixed, but then the check word no longer verifies and the probe is a miss.
+    """
+    ENTRY = Struct("<QdI4x")
+
+    def __init__(self, entries=2**20, name=None):
+        """
+        Constructor. Creates a new shared table or attaches to an existing one.
+
+        :param entries: Number of slots. Must be a power of two and the same in all processes.
+        :param name: Name of the shared memory block to attach to. If None, a new (zeroed) block is created.
+        """
+        if entries <= 0 or entries & (entries - 1) != 0:
+            raise ValueError("SharedTranspositionTable size must be a power of two")
+
+        self.entries = entries
+        self.mask = entries - 1
+        self.owner = name is None
+
+        if self.owner:
+            self.memory = SharedMemory(create=True, size=entries * self.ENTRY.size)
+        else:
+            self.memory = SharedMemory(name=name)
+
+        self.name = self.memory.name
+        self.buffer = self.memory.buf
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def get(self, key):
+        """
+        Looks up an entry.
+
+        :param key: 64 bit key, see :py:func:`position_key`
+        :return: Tuple (score, move) or None if the key is not in the table
+        """
+        self.probes += 1
+
+        check, score, move = self.ENTRY.unpack_from(self.buffer, (key & self.mask) * self.ENTRY.size)
+        if check ^ double_bits(score) ^ move != key:
+            return None
+
+        self.hits += 1
+        return score, move
+
+    def put(self, key, score, move):
+        """
+        Stores an entry, replacing whatever is placed in the same slot.
+
+        :param key: 64 bit key, see :py:func:`position_key`
+        :param score: The score to store
+        :param move: The move to store, encoded as a 32 bit unsigned integer
+        """
+        self.stores += 1
+        check = key ^ double_bits(score) ^ move
+        self.ENTRY.pack_into(self.buffer, (key & self.mask) * self.ENTRY.size, check, score, move)
+
+    def close(self):
+        """
+        Detaches from the shared memory. The creating process also frees the memory block.
+        """
+        if self.buffer is None:
+            return
+
+        self.buffer = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def double_bits(value):
+    """
+    Returns the bit pattern of a float as 64 bit unsigned integer
+    """
+    return DOUBLE_BITS.unpack(DOUBLE.pack(value))[0]
+
+
+DOUBLE = Struct("<d")
+DOUBLE_BITS = Struct("<Q")
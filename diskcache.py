@@ -0,0 +1,194 @@
+import argparse
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+from struct import Struct
+
+
+# Environment variable naming the file search results are kept in across sessions, see engine.enable_disk_cache
+DISK_CACHE_ENV = "MCHESS_CACHE"
+
+# The search does not prune, so every stored score is exact. The bound is stored for searches that will.
+BOUND_EXACT = 0
+
+# Encoded move of results without a move
+NO_MOVE = 0xFFFF
+
+# Most results written at once, a batch is also written once it is full
+MAX_BATCH = 4096
+
+
+class DiskCacheFile:
+    """
+    Layout of disk cache files: a header followed by fixed-width records, appended in the order they were found.
+    A key may appear more than once, the last record wins.
+
+    The header holds the version of the search (see :py:func:`engine.search_version`), a file of a different version
+    is discarded. Every record holds the 64 bit key of a search result (position, color to move and depth), the depth,
+    the bound, the encoded best move (origin cell index << 6 | target cell index) and the score.
+    """
+    MAGIC = b"MCSC"
+    VERSION = 1
+    HEADER = Struct("<4sHxxQ")
+    RECORD = Struct("<QBBHd")
+
+
+class DiskCache:
+    """
+    Search results kept in an append-only file, so a new session starts with the results of the previous ones.
+
+    A background thread first loads the file into a dictionary, then appends new results in batches. Lookups never
+    wait for the disk: until the file is loaded they simply miss.
+    """
+    def __init__(self, path, version, min_depth=2, flush_interval=1.0):
+        """
+        Constructor. Starts the background thread.
+
+        :param path: The cache file, created if it does not exist
+        :param version: Version of the search, results of a file with another version are never served
+        :param min_depth: Results of shallower searches are not stored, they are cheaper to repeat than to keep
+        :param flush_interval: Maximum number of seconds a new result waits before it is written
+        """
+        self.path = path
+        self.version = version
+        self.min_depth = min_depth
+        self.flush_interval = flush_interval
+        self.entries = {}
+        self.loaded = threading.Event()
+        self.queue = queue.SimpleQueue()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def get(self, key):
+        """
+        Returns the stored result of a key as tuple (score, encoded move), or None
+        """
+        if not self.loaded.is_set():
+            return None
+
+        return self.entries.get(key)
+
+    def put(self, key, depth, score, move):
+        """
+        Stores a result
+
+        :param key: 64 bit key of the position, color to move and depth
+        :param depth: The search depth
+        :param score: The exact score
+        :param move: The encoded best move, NO_MOVE if there is none
+        """
+        if depth < self.min_depth or self.closed or self.entries.get(key) == (score, move):
+            return
+
+        self.entries[key] = (score, move)
+        self.queue.put(DiskCacheFile.RECORD.pack(key, depth, BOUND_EXACT, move, score))
+
+    def load(self):
+        """
+        Reads the file into :py:attr:`entries`. A missing file, or one of another version, is replaced by an empty one.
+        """
+        header = DiskCacheFile.HEADER.pack(DiskCacheFile.MAGIC, DiskCacheFile.VERSION, self.version)
+        data = b""
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                data = f.read()
+
+        if data[:DiskCacheFile.HEADER.size] != header:
+            with open(self.path, "wb") as f:
+                f.write(header)
+            return
+
+        # A partially written last record is ignored
+        end = DiskCacheFile.HEADER.size + (len(data) - DiskCacheFile.HEADER.size) // DiskCacheFile.RECORD.size * DiskCacheFile.RECORD.size
+        for key, depth, bound, move, score in DiskCacheFile.RECORD.iter_unpack(data[DiskCacheFile.HEADER.size:end]):
+            if bound == BOUND_EXACT:
+                self.entries[key] = (score, move)
+
+        if end != len(data):
+            with open(self.path, "ab") as f:
+                f.truncate(end)
+
+    def run(self):
+        try:
+            self.load()
+        finally:
+            self.loaded.set()
+
+        with open(self.path, "ab") as f:
+            running = True
+            while running:
+                # Wait for the first record, then collect everything that arrives until the next flush
+                batch = [self.queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while batch[-1] is not None and len(batch) < MAX_BATCH:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(self.queue.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+
+                if batch[-1] is None:
+                    running = False
+                    batch.pop()
+
+                f.write(b"".join(batch))
+                f.flush()
+
+    def close(self):
+        """
+        Writes all queued results and stops the background thread
+        """
+        if self.closed:
+            return
+
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+
+def compact(path):
+    """
+    Rewrites a cache file with only the last record of every key
+
+    :return: Tuple (records before, records after)
+    """
+    with open(path, "rb") as f:
+        header = f.read(DiskCacheFile.HEADER.size)
+        data = f.read()
+
+    magic, version, _ = DiskCacheFile.HEADER.unpack(header)
+    if magic != DiskCacheFile.MAGIC or version != DiskCacheFile.VERSION:
+        raise ValueError(f"{path} is not a disk cache of version {DiskCacheFile.VERSION}")
+
+    records = {}
+    end = len(data) // DiskCacheFile.RECORD.size * DiskCacheFile.RECORD.size
+    for record in DiskCacheFile.RECORD.iter_unpack(data[:end]):
+        records[record[0]] = record
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(header)
+        f.write(b"".join(DiskCacheFile.RECORD.pack(*record) for record in records.values()))
+    os.replace(path + ".tmp", path)
+
+    return end // DiskCacheFile.RECORD.size, len(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compacts the search results kept on disk.")
+    parser.add_argument("file", help="the cache file")
+    args = parser.parse_args(argv)
+
+    before, after = compact(args.file)
+    print(f"{before} records compacted to {after}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
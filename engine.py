@@ -1,10 +1,33 @@
+import atexit
+import inspect
+import math
+import os
 import random
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from hashlib import blake2b
 from tqdm import tqdm
 from util import map_piece_to_character, cell_to_string
+from cache import HashTable, SharedTranspositionTable, position_key
+from position import Position
+import profiling
+import tracing
+from telemetry import TelemetryWriter, TELEMETRY_ENV
+from book import OpeningBook, BOOK_ENV
+from tablebase import Tablebases, TABLEBASE_ENV, TABLEBASE_WIN, MAX_PIECES
+from diskcache import DiskCache, DISK_CACHE_ENV
+import diskcache
+import pieces
+from board import Board
 
 
 DEPTH = 3
 
+# Score of a position in which the color to move has no moves left, negative if WHITE is the one without moves
+MATE_SCORE = 100000
+
 
 class MinMaxArg:
     """ Helper Class for the MinMax Algorithm.
@@ -12,18 +35,124 @@ class MinMaxArg:
 
     Note: You don´t need to implement anything in this case, you can use it in the MinMax Algorithm as you seem fit. 
     """
-    def __init__(self, depth=DEPTH, playAsWhite=True):
+    def __init__(self, depth=DEPTH, playAsWhite=True, stop=None, stats=None, alpha=-math.inf, beta=math.inf, profile=None, tracer=None, max_nodes=None):
         """
         Initializes the class using the provided parameters
+
+        :param stop: Optional threading.Event. Once it is set, the search is aborted with a :py:class:`SearchCancelled` exception.
+        :param stats: The :py:class:`SearchStats` of the search. If None, a new record is created.
+        :param alpha: Best score WHITE is already guaranteed further up in the search tree
+        :param beta: Best score BLACK is already guaranteed further up in the search tree
+        :param profile: Directory to write a profile of the search to, see :py:mod:`profiling`. Only used by :py:func:`suggest_move`
+                        searching in the current process (without workers).
+        :param tracer: Optional :py:class:`tracing.SearchTracer` recording every node of the search
+        :param max_nodes: Optional node limit. Once the search visited more nodes, it is aborted with a :py:class:`SearchCancelled` exception.
         """
         self.depth = depth
         self.playAsWhite = playAsWhite
+        self.stop = stop
+        self.stats = stats if stats is not None else SearchStats()
+        self.alpha = alpha
+        self.beta = beta
+        self.profile = profile
+        self.tracer = tracer
+        self.max_nodes = max_nodes
 
-    def next(self):
+    def next(self, alpha=-math.inf, beta=math.inf):
         """ 
         Provides the next stage of the MinMax Algorithm by reducing the depth by one and toggling playAsWhite
         """
-        return MinMaxArg(self.depth - 1, not self.playAsWhite)
+        return MinMaxArg(self.depth - 1, not self.playAsWhite, self.stop, self.stats, alpha, beta, self.profile, self.tracer, self.max_nodes)
+
+
+class SearchStats:
+    """
+    Statistics of a single search. A new record is created for every search, see :py:attr:`Move.stats`.
+
+    The search itself does not prune. A cutoff is counted at the move index where an alpha-beta search
+    would have stopped looking at further moves, which shows how well the moves are ordered.
+    """
+    def __init__(self):
+        self.nodes = 0
+        self.leaf_evaluations = 0
+        self.cache_probes = 0
+        self.cache_hits = 0
+        self.cache_stores = 0
+        self.cutoffs = {}
+        self.legality_checks = 0
+        self.book_hits = 0
+        self.tablebase_hits = 0
+        self.disk_hits = 0
+        self.nodes_per_depth = {}
+        self.time_per_depth = {}
+        self.time = 0.0
+
+    def merge(self, other):
+        """
+        Adds the counters of another record (e.g. from a worker process) to this one
+        """
+        self.nodes += other.nodes
+        self.leaf_evaluations += other.leaf_evaluations
+        self.cache_probes += other.cache_probes
+        self.cache_hits += other.cache_hits
+        self.cache_stores += other.cache_stores
+        self.legality_checks += other.legality_checks
+        self.book_hits += other.book_hits
+        self.tablebase_hits += other.tablebase_hits
+        self.disk_hits += other.disk_hits
+
+        for index, count in other.cutoffs.items():
+            self.cutoffs[index] = self.cutoffs.get(index, 0) + count
+        for depth, count in other.nodes_per_depth.items():
+            self.nodes_per_depth[depth] = self.nodes_per_depth.get(depth, 0) + count
+        for depth, seconds in other.time_per_depth.items():
+            self.time_per_depth[depth] = self.time_per_depth.get(depth, 0.0) + seconds
+
+    def cache_hit_rate(self):
+        if self.cache_probes == 0:
+            return 0.0
+
+        return self.cache_hits / self.cache_probes
+
+    def effective_branching_factor(self):
+        """
+        Average number of nodes searched per node one ply above, or None if the search had a single ply only
+        """
+        if len(self.nodes_per_depth) < 2:
+            return None
+
+        top, bottom = max(self.nodes_per_depth), min(self.nodes_per_depth)
+        return (self.nodes_per_depth[bottom] / self.nodes_per_depth[top]) ** (1.0 / (top - bottom))
+
+    def to_dict(self):
+        return {
+            "nodes": self.nodes,
+            "leaf_evaluations": self.leaf_evaluations,
+            "cache_probes": self.cache_probes,
+            "cache_hits": self.cache_hits,
+            "cache_stores": self.cache_stores,
+            "cache_hit_rate": self.cache_hit_rate(),
+            "cutoffs": {str(index): count for index, count in sorted(self.cutoffs.items())},
+            "legality_checks": self.legality_checks,
+            "book_hits": self.book_hits,
+            "tablebase_hits": self.tablebase_hits,
+            "disk_hits": self.disk_hits,
+            "nodes_per_depth": {str(depth): count for depth, count in sorted(self.nodes_per_depth.items())},
+            "time_per_depth": {str(depth): seconds for depth, seconds in sorted(self.time_per_depth.items())},
+            "effective_branching_factor": self.effective_branching_factor(),
+            "time": self.time,
+        }
+
+    def __str__(self):
+        return (f"{self.nodes} nodes, {self.leaf_evaluations} evaluations, {self.legality_checks} legality checks, "
+                f"{self.cache_hits}/{self.cache_probes} cache hits, {self.time:.3f}s")
+
+
+class SearchCancelled(Exception):
+    """
+    Raised inside the search once the stop event of the :py:class:`MinMaxArg` is set.
+    """
+    pass
 
 
 class Move:
@@ -41,6 +170,8 @@ class Move:
         self.piece = piece
         self.cell = cell
         self.score = score
+        self.stats = None
+        self.pv = None
 
     def __str__(self):
         """
@@ -111,7 +242,8 @@ def evaluate_all_possible_moves(board, minMaxArg, maximumNumberOfMoves = 10):
             # place our piece in the cell 
             board.set_cell(valid_move, piece)
             # Evaluate after our move
-            score_after_move = board.evaluate()
+            score_after_move = evaluate_cached(board)
+            minMaxArg.stats.leaf_evaluations += 1
             # Safe the move we did in a varaible
             move = Move(piece, valid_move, score_after_move)
             # add the move to the list
@@ -129,7 +261,24 @@ def evaluate_all_possible_moves(board, minMaxArg, maximumNumberOfMoves = 10):
 
 
 
-def minMax(board, minMaxArg):
+def order_pv_first(moves, line):
+    """
+    Returns the moves with the first move of the expected line in front, or None if the line is empty or its first
+    move is not among the moves
+    """
+    if not line:
+        return None
+
+    origin, target = line[0]
+    for index, move in enumerate(moves):
+        if move.piece is not None and (int(move.piece.cell[0]), int(move.piece.cell[1])) == origin \
+                and (int(move.cell[0]), int(move.cell[1])) == target:
+            return [move] + moves[:index] + moves[index + 1:]
+
+    return None
+
+
+def minMax(board, minMaxArg, on_progress=None):
     """
     **TODO**:
     This method implement the core mini-max search algorithm.
@@ -192,10 +341,29 @@ def minMax(board, minMaxArg):
     :type board: :py:class:`board.Board`
     :param minMaxArg: The combined arguments for the mini-max search algorithm.
     :type minMaxArg: :py:class:`MinMaxArg`
+    :param on_progress: Optional callback on_progress(bestMove, searchedMoves, totalMoves), called after each move
+                        of this position has been searched, see :py:func:`minMax_progress`
     :return: Return the best move to make in the current situation.
     :rtype: :py:class:`Move`
     """
     # TODO: Implement the Mini-Max algorithm
+    stats = minMaxArg.stats
+    stats.nodes += 1
+    stats.nodes_per_depth[minMaxArg.depth] = stats.nodes_per_depth.get(minMaxArg.depth, 0) + 1
+    start = time.perf_counter()
+
+    # Abort the search if it was cancelled from the outside
+    if minMaxArg.stop is not None and minMaxArg.stop.is_set():
+        raise SearchCancelled()
+    if minMaxArg.max_nodes is not None and stats.nodes > minMaxArg.max_nodes:
+        raise SearchCancelled()
+
+    # Endings with few pieces are looked up in the tablebases instead of evaluated or searched
+    if tablebases is not None and 64 - sum(row.count(None) for row in board.cells) <= MAX_PIECES:
+        probed = tablebases.probe_move(board, minMaxArg.playAsWhite)
+        if probed is not None:
+            stats.tablebase_hits += 1
+            return Move(*probed)
 
     # List with the 10 best moves for the given color
     best_moves_of_the_given_color = evaluate_all_possible_moves(board, minMaxArg)
@@ -204,15 +372,25 @@ def minMax(board, minMaxArg):
     if best_moves_of_the_given_color == []:
         # In case of the white side
         if minMaxArg.playAsWhite:
-            return Move(piece=None, cell= (0,0), score= -100000)
+            return Move(piece=None, cell= (0,0), score= -MATE_SCORE)
         # In case of the black side
         else:
-            return Move(piece=None, cell= (0,0), score= 100000)
+            return Move(piece=None, cell= (0,0), score= MATE_SCORE)
+
+    # Record the statically evaluated moves as leaves of the trace
+    tracer = minMaxArg.tracer
+    if tracer is not None and minMaxArg.depth == 1:
+        for move in best_moves_of_the_given_color:
+            tracer.record(0, tracing.encode_move(move.piece, move.cell), minMaxArg.alpha, minMaxArg.beta, move.score, tracing.LEAF)
     
     # we check if the level 1 is reached
     if minMaxArg.depth > 1:
+        # Best scores guaranteed so far for white (alpha) and black (beta), only used for the statistics
+        alpha, beta = minMaxArg.alpha, minMaxArg.beta
+        cutoff = False
+
         # Iterate through the best 10 moves of a given color
-        for move in best_moves_of_the_given_color:
+        for index, move in enumerate(best_moves_of_the_given_color):
             # Save the cell we move the to
             target_cell = move.cell
             # Save the conten in the cell we move into
@@ -225,17 +403,40 @@ def minMax(board, minMaxArg):
             board.set_cell(target_cell, piece)
 
             # Evaluate and return the best move of the opposing color
-            enemys_best_move = minMax_cached(board, minMaxArg=minMaxArg.next())
+            window = alpha, beta
+            hits = stats.cache_hits
+            try:
+                enemys_best_move = minMax_cached(board, minMaxArg=minMaxArg.next(alpha, beta))
+            finally:
+                # Return the board to it's original state, also when the search is cancelled
+                board.set_cell(current_cell, piece)
+                board.set_cell(target_cell, content_cell)
             # overwrite the current score with the score if the enemy played it's best move
             move.score = enemys_best_move.score
 
-            # Return the board to it's original state
-            board.set_cell(current_cell, piece)
-            board.set_cell(target_cell, content_cell)
+            # The opposing color would never allow this line, an alpha-beta search could skip the remaining moves
+            if minMaxArg.playAsWhite:
+                alpha = max(alpha, move.score)
+            else:
+                beta = min(beta, move.score)
+            cutoff_here = not cutoff and alpha >= beta
+            if cutoff_here:
+                cutoff = True
+                stats.cutoffs[index] = stats.cutoffs.get(index, 0) + 1
+
+            if tracer is not None:
+                flags = (tracing.CUTOFF if cutoff_here else 0) | (tracing.CACHE_HIT if stats.cache_hits != hits else 0)
+                tracer.record(minMaxArg.depth - 1, tracing.encode_move(piece, target_cell), window[0], window[1], move.score, flags)
+
+            if on_progress is not None:
+                searched = sorted(best_moves_of_the_given_color[:index + 1], reverse=minMaxArg.playAsWhite, key=lambda x: x.score)
+                on_progress(searched[0], index + 1, len(best_moves_of_the_given_color))
             
     # Sorted list with the new scores after enemy's best move has been taken into account
     sorted_list = sorted(best_moves_of_the_given_color, reverse=minMaxArg.playAsWhite, key=lambda x: x.score)
 
+    stats.time_per_depth[minMaxArg.depth] = stats.time_per_depth.get(minMaxArg.depth, 0.0) + time.perf_counter() - start
+
     # return the best Move
     return sorted_list[0]
     
@@ -279,36 +480,873 @@ def suggest_random_move(board):
 
 
 
-def suggest_move(board):
+def suggest_move(board, workers=None, minMaxArg=None):
     """
     Helper function to start the mini-max algorithm.
+
+    :param board: Reference to the board we need to play on
+    :param workers: Number of worker processes to search with. If None or 1, the search runs in the current process.
+    :param minMaxArg: Arguments of the search. If None, the defaults of :py:class:`MinMaxArg` are used.
+    :raises ValueError: If the search is profiled (see :py:attr:`MinMaxArg.profile`) and runs in worker processes
+    """
+    if minMaxArg is None:
+        minMaxArg = MinMaxArg()
+
+    # Only pay for profiling when it was asked for
+    directory = profiling.profile_directory(minMaxArg)
+    if directory:
+        # The profile only covers the current process, it would show nothing but the wait for the workers
+        if workers is not None and workers > 1:
+            raise ValueError("Profiling covers searches in the current process only, search without workers to profile")
+
+        with profiling.profile_search(directory):
+            return search_move(board, workers, minMaxArg)
+
+    return search_move(board, workers, minMaxArg)
+
+
+def search_move(board, workers, minMaxArg):
+    """
+    Runs the search for :py:func:`suggest_move` and collects its statistics
+    """
+    global last_stats
+
+    # Every search gets its own statistics
+    stats = SearchStats()
+    tracer = minMaxArg.tracer
+    minMaxArg = MinMaxArg(minMaxArg.depth, minMaxArg.playAsWhite, minMaxArg.stop, stats, tracer=tracer, max_nodes=minMaxArg.max_nodes)
+    board.stats = stats
+    start = time.perf_counter()
+
+    if tracer is not None:
+        tracer.begin(minMaxArg.depth)
+
+    # Positions of the opening book are played without searching
+    bookMove = opening_book.choose(board, minMaxArg.playAsWhite) if opening_book is not None else None
+
+    try:
+        if bookMove is not None:
+            stats.book_hits += 1
+            bestMove = Move(bookMove[0], bookMove[1], 0.0)
+        elif workers is None or workers <= 1:
+            bestMove = minMax_cached(board, minMaxArg)
+        else:
+            bestMove = minMax_parallel(board, minMaxArg, workers)
+    finally:
+        board.stats = None
+        stats.time = time.perf_counter() - start
+
+    if tracer is not None:
+        tracer.record(minMaxArg.depth, tracing.encode_move(bestMove.piece, bestMove.cell), -math.inf, math.inf, bestMove.score)
+
+    # Cached moves are shared between searches, so the statistics go to a copy
+    result = Move(bestMove.piece, bestMove.cell, bestMove.score)
+    result.stats = stats
+    result.pv = search_pv(board, minMaxArg, result)
+    remember_pv(board, minMaxArg.playAsWhite, result.pv)
+    last_stats = stats
+
+    if telemetry_writer is not None:
+        record_telemetry(board, result, minMaxArg)
+
+    return result
+
+
+def analyse(board, multipv=1, minMaxArg=None):
+    """
+    Searches the given position and returns its best moves, each with its principal variation.
+
+    The search does not prune, so the score of every root move is exact and a single search yields all of them:
+    asking for more lines costs no more than asking for one. The lines are read from :py:data:`eval_cache`,
+    see :py:func:`principal_variation`.
+
+    :param board: The board to analyse, it is left unchanged
+    :param multipv: Number of best moves to return
+    :param minMaxArg: Depth and color to move of the search. If None, the defaults of :py:class:`MinMaxArg` are used.
+    :return: List of at most multipv :py:class:`Move` instances, best first. Their :py:attr:`pv` holds the line as
+             tuples (origin, target) of cells starting with the move itself, their :py:attr:`stats` the statistics
+             of the whole search.
+    """
+    if minMaxArg is None:
+        minMaxArg = MinMaxArg()
+
+    stats = SearchStats()
+    minMaxArg = MinMaxArg(minMaxArg.depth, minMaxArg.playAsWhite, minMaxArg.stop, stats, max_nodes=minMaxArg.max_nodes)
+    board.stats = stats
+    start = time.perf_counter()
+
+    try:
+        stats.nodes += 1
+
+        # The search considers the 10 best moves of every position, more are only examined at the root if asked for
+        moves = evaluate_all_possible_moves(board, minMaxArg, max(10, multipv))
+
+        for move in moves:
+            piece = move.piece
+            current_cell = piece.cell
+            content_cell = board.get_cell(move.cell)
+            origin = (int(current_cell[0]), int(current_cell[1]))
+            move.pv = [(origin, (int(move.cell[0]), int(move.cell[1])))]
+            if minMaxArg.depth <= 1:
+                continue
+
+            board.set_cell(move.cell, piece)
+            try:
+                move.score = minMax_cached(board, minMaxArg.next()).score
+                move.pv += principal_variation(board, minMaxArg.next())
+            finally:
+                # Return the board to it's original state, also when the search is cancelled
+                board.set_cell(current_cell, piece)
+                board.set_cell(move.cell, content_cell)
+    finally:
+        board.stats = None
+        stats.time = time.perf_counter() - start
+
+    moves.sort(reverse=minMaxArg.playAsWhite, key=lambda x: x.score)
+
+    # The best move is the result of a regular search as well, unless moves beyond the usual 10 were examined
+    if moves and multipv <= 10:
+        eval_cache[cache_key(board, minMaxArg)] = Move(moves[0].piece, moves[0].cell, moves[0].score)
+
+    for move in moves:
+        move.stats = stats
+
+    return moves[:multipv]
+
+
+def search_pv(board, minMaxArg, move):
+    """
+    Returns the principal variation of a finished search, see :py:func:`principal_variation`. If the line is not in
+    :py:data:`eval_cache` (e.g. a book move or a parallel search), it holds the best move only.
+    """
+    if move.piece is None:
+        return []
+
+    first = ((int(move.piece.cell[0]), int(move.piece.cell[1])), (int(move.cell[0]), int(move.cell[1])))
+    line = principal_variation(board, minMaxArg)
+    return line if line and line[0] == first else [first]
+
+
+def mate_plies(score, line):
+    """
+    Returns the number of plies until the game ends as predicted by a search, or None if its score is not a mate.
+
+    A position without moves is scored :py:data:`MATE_SCORE` and a captured king is worth more than that, so the end
+    of the principal variation is the end of the game. Positions found in the tablebases are scored
+    TABLEBASE_WIN minus the plies to mate from there, and the line ends at the probed position.
+
+    :param score: Score of the search, from WHITE's point of view
+    :param line: The principal variation of the search, see :py:func:`search_pv`
+    """
+    score = abs(score)
+    if score > MATE_SCORE:
+        # The king is captured with the last move of the line, the game ended one ply before
+        return max(len(line) - 1, 1)
+
+    if score == MATE_SCORE:
+        return len(line)
+
+    if score > TABLEBASE_WIN - 256:
+        return len(line) - 1 + int(round(TABLEBASE_WIN - score))
+
+    return None
+
+
+def remember_pv(board, white, line):
+    """
+    Replaces :py:data:`pv_table` with the positions along the given line, each mapped to the rest of the line
+
+    :param board: The board the line starts on, it is left unchanged
+    :param white: True if WHITE is to move on the board
+    :param line: List of tuples (origin, target) of cells
+    """
+    global pv_table
+
+    table = {}
+    undo = []
+    for index, (origin, target) in enumerate(line):
+        table[Position.from_board(board, white).key] = line[index:]
+        piece = board.get_cell(origin)
+        undo.append((piece, origin, target, board.get_cell(target)))
+        board.set_cell(target, piece)
+        white = not white
+
+    # Return the board to it's original state
+    for piece, origin, target, content in reversed(undo):
+        board.set_cell(origin, piece)
+        board.set_cell(target, content)
+
+    pv_table = table
+
+
+# Statistics of the most recent search started with suggest_move
+last_stats = None
+
+# Principal variation of the most recent search: the key of every position along the line (including the color to
+# move) mapped to the moves expected from there on. A Ponderer searches the predicted answer of the opponent first.
+pv_table = {}
+
+# Writer of the per move telemetry, see enable_telemetry
+telemetry_writer = None
+
+# Opening book consulted before every search, see enable_book
+opening_book = None
+
+# Endgame tables probed by the search, see enable_tablebases
+tablebases = None
+
+# Search results kept across sessions, see enable_disk_cache
+disk_cache = None
+
+
+def enable_telemetry(path):
+    """
+    Appends one JSON line per :py:func:`suggest_move` call to the given file from now on.
+    Telemetry is also enabled at startup if the MCHESS_TELEMETRY environment variable names a file.
+    See :py:mod:`telemetry` for the exporter.
+    """
+    global telemetry_writer
+
+    if telemetry_writer is not None:
+        telemetry_writer.close()
+
+    telemetry_writer = TelemetryWriter(path)
+
+
+def enable_book(path):
+    """
+    Plays the moves of the given opening book (see :py:mod:`book`) instead of searching from now on, as long as the
+    position is in the book. The book is also enabled at startup if the MCHESS_BOOK environment variable names a file.
+
+    :param path: The book file. If None, the book is disabled.
+    """
+    global opening_book
+
+    if opening_book is not None:
+        opening_book.close()
+
+    opening_book = OpeningBook(path) if path is not None else None
+
+
+def enable_tablebases(directory):
+    """
+    Looks up positions with at most MAX_PIECES pieces in the endgame tables of the given directory (see
+    :py:mod:`tablebase`) from now on, instead of searching them. The tables are also enabled at startup if the
+    MCHESS_TABLEBASES environment variable names a directory.
+
+    :param directory: The directory with the table files. If None, the tables are disabled.
+    """
+    global tablebases
+
+    if tablebases is not None:
+        tablebases.close()
+
+    tablebases = Tablebases(directory) if directory is not None else None
+
+    # Results stored with other tables are not served any more
+    if disk_cache is not None:
+        enable_disk_cache(disk_cache.path)
+
+
+def search_version():
+    """
+    Returns a 64 bit version of the search, derived from the source code of the modules the search depends on (move
+    generation and legality, evaluation, search, tablebase probing) and from the endgame tables in use. Any change
+    to them yields a new version, so results stored by an older version are never served.
+    """
+    # Whole modules are hashed, a list of single functions misses the helpers they call
+    digest = blake2b(digest_size=8)
+    for module in (pieces.__name__, Board.__module__, Tablebases.__module__, __name__):
+        digest.update(inspect.getsource(sys.modules[module]).encode("utf-8"))
+
+    # Positions found in the tables are scored by them instead of the search
+    digest.update(repr((MAX_PIECES, tablebases.materials()) if tablebases is not None else None).encode("utf-8"))
+
+    return int.from_bytes(digest.digest(), "little")
+
+
+def enable_disk_cache(path):
+    """
+    Keeps the results of searches of depth 2 and more in the given file from now on (see :py:mod:`diskcache`), and
+    serves the results stored there by earlier sessions. The file is loaded and written in the background.
+    The cache is also enabled at startup if the MCHESS_CACHE environment variable names a file.
+
+    :param path: The cache file. If None, the cache is disabled.
+    """
+    global disk_cache
+
+    if disk_cache is not None:
+        disk_cache.close()
+
+    disk_cache = DiskCache(path, search_version()) if path is not None else None
+
+
+def record_telemetry(board, move, minMaxArg):
+    """
+    Hands the telemetry of a finished search to the telemetry writer
+    """
+    stats = move.stats
+    telemetry_writer.record({
+        "timestamp": time.time(),
+        "position": f"{Position.from_board(board, minMaxArg.playAsWhite).key:016x}",
+        "depth": minMaxArg.depth,
+        "nodes": stats.nodes,
+        "time": stats.time,
+        "score": move.score,
+        "cache_hits": stats.cache_hits,
+        "cache_probes": stats.cache_probes,
+        "cache_entries": len(eval_cache),
+        "eval_cache_occupancy": static_eval_cache.occupancy(),
+    })
+
+
+
+# Worker processes are kept alive between searches, so process startup is only paid once.
+# All workers share one transposition table placed in shared memory, which stays warm from one move to the next.
+# A forked process inherits these globals, but the pool belongs to the process that created it.
+executor = None
+executor_workers = 0
+executor_table = None
+executor_pid = None
+
+# Number of slots of the shared transposition table (24 bytes each)
+SHARED_TABLE_ENTRIES = 2**20
+
+
+def get_executor(workers):
+    """
+    Returns the process pool for parallel searches, (re-)creating it if the number of workers changed.
+    """
+    global executor, executor_workers, executor_table, executor_pid
+
+    if executor is None or executor_workers != workers or executor_pid != os.getpid():
+        shutdown_executor()
+
+        executor_table = SharedTranspositionTable(SHARED_TABLE_ENTRIES)
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=attach_shared_table,
+            initargs=(executor_table.name, executor_table.entries),
+        )
+        executor_workers = workers
+        executor_pid = os.getpid()
+        atexit.register(executor_table.close)
+
+    return executor
+
+
+def shutdown_executor():
     """
-    return minMax_cached(board, MinMaxArg())
+    Stops the worker processes of parallel searches and frees the shared transposition table, if any.
+    The next parallel search starts a new pool.
+
+    A process started by :py:mod:`multiprocessing` waits for its child processes when it exits,
+    so it must call this after its last parallel search.
+    """
+    global executor, executor_workers, executor_table, executor_pid
+
+    # A pool inherited from the parent process is left alone, only forgotten
+    if executor is not None and executor_pid == os.getpid():
+        executor.shutdown()
+        executor_table.close()
+
+    executor = executor_table = executor_pid = None
+    executor_workers = 0
+
+
+def attach_shared_table(name, entries):
+    """
+    Initializer of the worker processes. From now on :py:func:`minMax_cached` uses the shared transposition table.
+    """
+    global shared_table
+    shared_table = SharedTranspositionTable(entries, name=name)
+
+
+def search_line(snapshot, line, depth, playAsWhite):
+    """
+    Worker entry point for :py:func:`minMax_parallel`. Plays the given line of moves on the board and
+    runs the mini-max search in the resulting position.
+
+    :param snapshot: The :py:class:`position.Position` at the root
+    :param line: List of (fromCell, toCell) tuples to play in order before searching
+    :return: Tuple of the score and the :py:class:`SearchStats` of the search
+    """
+    board = snapshot.to_board()
+
+    for fromCell, toCell in line:
+        board.set_cell(toCell, board.get_cell(fromCell))
+
+    minMaxArg = MinMaxArg(depth, playAsWhite)
+    board.stats = minMaxArg.stats
+    return minMax_cached(board, minMaxArg).score, minMaxArg.stats
+
+
+def minMax_parallel(board, minMaxArg, workers):
+    """
+    Parallel version of :py:func:`minMax`. The moves at the root are split across a pool of worker processes.
+    If there are fewer root moves than workers, the answering moves are split as well, so all workers stay busy.
+
+    The combination of the results follows exactly the scheme of :py:func:`minMax` (same move lists, same stable sorting),
+    so the returned move is the same as in a single process search.
+    """
+    moves = evaluate_all_possible_moves(board, minMaxArg)
+
+    # Nothing to split, the sequential algorithm handles these cases right away
+    if not moves or minMaxArg.depth <= 1:
+        return minMax(board, minMaxArg)
+
+    pool = get_executor(workers)
+
+    # Arguments are pickled in the background by the pool, so the board must not be handed over while
+    # moves are being tried on it below. Take one (cheap to pickle) snapshot of the root position instead.
+    snapshot = Position.from_board(board, minMaxArg.playAsWhite)
+    split_replies = len(moves) < workers and minMaxArg.depth > 2
+    nextArg = minMaxArg.next()
+
+    # For each root move, keep the submitted jobs (and the replies they belong to)
+    jobs = []
+    for move in moves:
+        piece = move.piece
+        current_cell = piece.cell
+        line = [((int(current_cell[0]), int(current_cell[1])), move.cell)]
+
+        if not split_replies:
+            jobs.append((None, pool.submit(search_line, snapshot, line, nextArg.depth, nextArg.playAsWhite)))
+            continue
+
+        # Play the move to find the answering moves of the opposing color
+        content_cell = board.get_cell(move.cell)
+        board.set_cell(move.cell, piece)
+        replies = evaluate_all_possible_moves(board, nextArg)
+
+        if not replies:
+            # No answer possible, minMax scores this position without any recursion
+            move.score = minMax(board, nextArg).score
+            jobs.append((None, None))
+        else:
+            reply_jobs = []
+            for reply in replies:
+                reply_line = line + [((int(reply.piece.cell[0]), int(reply.piece.cell[1])), reply.cell)]
+                reply_jobs.append(pool.submit(search_line, snapshot, reply_line, nextArg.depth - 1, not nextArg.playAsWhite))
+            jobs.append((replies, reply_jobs))
+
+        # Return the board to it's original state
+        board.set_cell(current_cell, piece)
+        board.set_cell(move.cell, content_cell)
+
+    # Collect the results in the original order of the moves
+    for move, (replies, job) in zip(moves, jobs):
+        if job is None:
+            continue
+
+        if replies is None:
+            move.score, stats = job.result()
+            minMaxArg.stats.merge(stats)
+            continue
+
+        for reply, reply_job in zip(replies, job):
+            reply.score, stats = reply_job.result()
+            minMaxArg.stats.merge(stats)
+
+        # The opposing color picks its best answer, just like minMax does one level deeper
+        move.score = sorted(replies, reverse=nextArg.playAsWhite, key=lambda x: x.score)[0].score
+
+    sorted_list = sorted(moves, reverse=minMaxArg.playAsWhite, key=lambda x: x.score)
+    return sorted_list[0]
+
+
+def minMax_progress(board, minMaxArg, on_progress):
+    """
+    Same as :py:func:`minMax_cached`, but reports the best move found so far after every move at the root.
+    The root goes through the same caches, tablebase probe and statistics as any other node, so the result and the
+    statistics are the ones of :py:func:`suggest_move`.
+
+    :param on_progress: Called as on_progress(bestMove, searchedMoves, totalMoves) after each root move
+    """
+    return minMax_cached(board, minMaxArg, on_progress)
+
+
+class SearchHandle:
+    """
+    Handle of a search running in the background, see :py:func:`start_search`.
+
+    The search runs on a private copy of the board. All moves reported by this handle are translated back
+    to the pieces of the board the search was started on, so they can be applied to it right away.
+    """
+    def __init__(self, board, on_progress=None):
+        self.board = board
+        self.future = Future()
+        self.stop = threading.Event()
+        self.on_progress = on_progress
+        self.best_move = None
+        self.searched_moves = 0
+        self.total_moves = 0
+
+    def translate(self, move):
+        """
+        Returns the given move of the private board as a move on the board the search was started on
+        """
+        if move.piece is None:
+            return Move(None, move.cell, move.score)
+
+        return Move(self.board.get_cell(move.piece.cell), move.cell, move.score)
+
+    def report(self, move, searched, total):
+        self.best_move = self.translate(move)
+        self.searched_moves = searched
+        self.total_moves = total
+        if self.on_progress is not None:
+            self.on_progress(self.best_move, searched, total)
+
+    def run(self, position, minMaxArg, after=None):
+        # From here on the future can not be cancelled any more, only the stop event ends the search
+        if not self.future.set_running_or_notify_cancel():
+            return
+
+        try:
+            # Wait for a search on the same position (e.g. by a Ponderer) to end, its result is then in the cache
+            if after is not None:
+                after.wait()
+
+            result = self.search(position, minMaxArg)
+        except BaseException as exception:
+            self.future.set_exception(exception)
+        else:
+            self.future.set_result(result)
+
+    def search(self, position, minMaxArg):
+        """
+        Runs the search on a private board and returns the best move translated to the board of the handle
+        """
+        if self.stop.is_set():
+            raise SearchCancelled()
+
+        board = position.to_board()
+        board.stats = minMaxArg.stats
+        start = time.perf_counter()
+
+        tracer = minMaxArg.tracer
+        if tracer is not None:
+            tracer.begin(minMaxArg.depth)
+
+        # Positions of the opening book are played without searching, as in search_move
+        bookMove = opening_book.choose(board, minMaxArg.playAsWhite) if opening_book is not None else None
+        if bookMove is not None:
+            minMaxArg.stats.book_hits += 1
+            move = Move(bookMove[0], bookMove[1], 0.0)
+        else:
+            move = minMax_progress(board, minMaxArg, self.report)
+
+        minMaxArg.stats.time = time.perf_counter() - start
+        if tracer is not None:
+            tracer.record(minMaxArg.depth, tracing.encode_move(move.piece, move.cell), -math.inf, math.inf, move.score)
+
+        result = self.translate(move)
+        result.stats = minMaxArg.stats
+        result.pv = search_pv(board, minMaxArg, move)
+        remember_pv(board, position.white, result.pv)
+        return result
+
+    def done(self):
+        """
+        Returns True once the search finished or was cancelled
+        """
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """
+        Waits for the search to finish and returns the best :py:class:`Move`
+        """
+        return self.future.result(timeout)
+
+    def cancel(self):
+        """
+        Aborts the search. The handle is done as soon as the search noticed, :py:meth:`result` then raises
+        :py:class:`SearchCancelled`.
+        """
+        self.stop.set()
+
+
+def start_search(board, minMaxArg=None, on_progress=None, after=None):
+    """
+    Starts the mini-max algorithm in a background thread and returns immediately.
+    The board may be drawn (but not changed) while the search is running.
+
+    :param board: Reference to the board we need to play on
+    :param minMaxArg: Arguments of the search. If None, the defaults of :py:class:`MinMaxArg` are used. Its stop event
+                      is replaced by the one of the handle, all other arguments are kept.
+    :param on_progress: Optional callback on_progress(bestMove, searchedMoves, totalMoves), called from the search thread
+    :param after: Optional threading.Event the search waits for before it starts
+    :return: A :py:class:`SearchHandle` to poll, wait for or cancel the search
+    """
+    if minMaxArg is None:
+        minMaxArg = MinMaxArg()
+
+    handle = SearchHandle(board, on_progress)
+    minMaxArg = MinMaxArg(minMaxArg.depth, minMaxArg.playAsWhite, handle.stop, minMaxArg.stats, minMaxArg.alpha, minMaxArg.beta,
+                          minMaxArg.profile, minMaxArg.tracer, minMaxArg.max_nodes)
+    position = Position.from_board(board, minMaxArg.playAsWhite)
+
+    threading.Thread(target=handle.run, args=(position, minMaxArg, after), daemon=True).start()
+    return handle
+
+
+class Ponderer:
+    """
+    Searches on the opponent's time. While the opponent thinks about its move, all of its possible answers
+    are searched in the background, the answer predicted by our last search (see :py:data:`pv_table`) first, then
+    the best evaluated ones. The results end up in
+    :py:data:`eval_cache`, so once the opponent moved, the search for the reply is answered from the cache.
+    """
+    def __init__(self, board, minMaxArg=None):
+        """
+        Starts pondering right away.
+
+        :param board: The board after our move. It is not touched, the pondering runs on a private copy.
+        :param minMaxArg: Arguments of our next search. If None, the defaults of :py:class:`MinMaxArg` are used.
+        """
+        if minMaxArg is None:
+            minMaxArg = MinMaxArg()
+
+        self.minMaxArg = minMaxArg
+        self.stop = threading.Event()
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        self.current = None
+        self.keep_current = False
+        self.pondered = 0
+
+        position = Position.from_board(board, not minMaxArg.playAsWhite)
+        threading.Thread(target=self.run, args=(position,), daemon=True).start()
+
+    def run(self, position):
+        board = position.to_board()
+        minMaxArg = MinMaxArg(self.minMaxArg.depth, self.minMaxArg.playAsWhite, self.stop)
+
+        # All answers of the opponent, the one predicted by our last search first, then the best ones for the opponent
+        answers = evaluate_all_possible_moves(board, minMaxArg.next(), maximumNumberOfMoves=None)
+        answers = order_pv_first(answers, pv_table.get(position.key)) or answers
+
+        try:
+            for answer in answers:
+                piece = answer.piece
+                current_cell = piece.cell
+                content_cell = board.get_cell(answer.cell)
+                board.set_cell(answer.cell, piece)
+
+                with self.lock:
+                    if self.stop.is_set():
+                        break
+                    self.current = board.hash()
+
+                # Exactly the search that will be requested once the opponent played this answer
+                minMax_cached(board, minMaxArg)
+
+                with self.lock:
+                    self.current = None
+                    self.pondered += 1
+                    if self.keep_current:
+                        break
+
+                # Return the board to it's original state
+                board.set_cell(current_cell, piece)
+                board.set_cell(answer.cell, content_cell)
+        except SearchCancelled:
+            pass
+        finally:
+            self.finished.set()
+
+    def search(self, board):
+        """
+        Stops pondering and starts the search for the given board (after the opponent's move).
+        If that position is being pondered right now, the running search is completed instead of restarted.
+
+        :return: A :py:class:`SearchHandle`, see :py:func:`start_search`
+        """
+        with self.lock:
+            if self.current is not None and self.current == board.hash():
+                self.keep_current = True
+            else:
+                self.stop.set()
+
+        return start_search(board, self.minMaxArg, after=self.finished)
+
+    def cancel(self):
+        """
+        Stops pondering without starting a search
+        """
+        self.stop.set()
+
 
 eval_cache = {}
-total_hits = 0
 
 
-def minMax_cached(board, minMaxArg):
+def minMax_cached(board, minMaxArg, on_progress=None):
     """
     A cached version of the minMax method. This methods caches results
     based on its parameters. If called again with a known board configuration
     and minMaxArgs, the result is taken from the cache instead of repeating
     the mini-max algorithm again. This can save computation time as
     it avoid to repeat evaluations over and over again. 
+
+    :param on_progress: Optional callback passed on to :py:func:`minMax` if the position is searched
     """
-    global eval_cache, total_hits
+    global eval_cache
+
+    # Calculate a unique hash code for the current board position, color to move and search depth
+    hash = cache_key(board, minMaxArg)
+    minMaxArg.stats.cache_probes += 1
+
+    # Inside the workers of a parallel search, the table in shared memory is used instead of eval_cache
+    if shared_table is not None:
+        return minMax_shared(board, minMaxArg, position_key(hash))
 
-    # Calculate a unique hash code for the current board position and search depth
-    hash = str(minMaxArg.depth) + board.hash()
     if hash in eval_cache:
-        total_hits += 1
-        # print(f"Cache hit! Cache has {len(eval_cache.keys())} entries with {total_hits} hits so far")
+        minMaxArg.stats.cache_hits += 1
         return eval_cache[hash]
 
+    # Results of earlier sessions are kept on disk
+    if disk_cache is not None:
+        key = position_key(hash)
+        entry = disk_cache.get(key)
+        if entry is not None:
+            minMaxArg.stats.disk_hits += 1
+            score, code = entry
+            bestMove = decode_move(board, NO_MOVE if code == diskcache.NO_MOVE else code, score)
+            eval_cache[hash] = bestMove
+            return bestMove
+
     # Its not the cache so do the actual evaluation
-    bestMove = minMax(board, minMaxArg)
+    bestMove = minMax(board, minMaxArg, on_progress)
 
     # Cache it for later
     eval_cache[hash] = bestMove
+    minMaxArg.stats.cache_stores += 1
+
+    if disk_cache is not None:
+        code = encode_move(bestMove)
+        disk_cache.put(key, minMaxArg.depth, bestMove.score, diskcache.NO_MOVE if code == NO_MOVE else code)
+
+    return bestMove
+
+
+def cache_key(board, minMaxArg):
+    """
+    Returns the key of a search result in :py:data:`eval_cache`: the search depth, the board position and the color to move
+    """
+    return str(minMaxArg.depth) + board.hash() + ("-w" if minMaxArg.playAsWhite else "-b")
+
+
+def principal_variation(board, minMaxArg):
+    """
+    Returns the line of best moves found by the last search of the given position, read from :py:data:`eval_cache`.
+    The walk follows the cached best move of every position down to depth 1 and ends early at positions no longer
+    in the cache or whose cached move was found on another board.
+
+    :param board: The board the search was run on, it is left unchanged
+    :param minMaxArg: Depth and color to move of the search
+    :return: List of tuples (origin, target) of cells
+    """
+    line = []
+    undo = []
+
+    while minMaxArg.depth >= 1:
+        move = eval_cache.get(cache_key(board, minMaxArg))
+        if move is None or move.piece is None or move.piece.board is not board or board.get_cell(move.piece.cell) is not move.piece:
+            break
+
+        piece = move.piece
+        origin = (int(piece.cell[0]), int(piece.cell[1]))
+        target = (int(move.cell[0]), int(move.cell[1]))
+        undo.append((piece, origin, target, board.get_cell(target)))
+        line.append((origin, target))
+        board.set_cell(target, piece)
+        minMaxArg = minMaxArg.next()
+
+    # Return the board to it's original state
+    for piece, origin, target, content in reversed(undo):
+        board.set_cell(origin, piece)
+        board.set_cell(target, content)
+
+    return line
+
+
+# Shared transposition table, only set in worker processes of a parallel search (see attach_shared_table)
+shared_table = None
+
+# Encoded move for results without a move (the game is lost)
+NO_MOVE = 0xFFFFFFFF
+
+
+def encode_move(move):
+    """
+    Encodes a move into an integer for the shared transposition table (origin cell index << 6 | target cell index)
+    """
+    if move.piece is None:
+        return NO_MOVE
+
+    row, col = move.piece.cell
+    targetRow, targetCol = move.cell
+    return int(row * 8 + col) << 6 | int(targetRow * 8 + targetCol)
+
+
+def decode_move(board, code, score):
+    """
+    Turns an encoded move (see :py:func:`encode_move`) back into a :py:class:`Move` on the given board
+    """
+    if code == NO_MOVE:
+        return Move(piece=None, cell=(0, 0), score=score)
+
+    origin, target = code >> 6, code & 63
+    return Move(board.get_cell((origin // 8, origin % 8)), (target // 8, target % 8), score)
+
+
+def minMax_shared(board, minMaxArg, key):
+    """
+    Same as :py:func:`minMax_cached`, but results are looked up in and stored to the shared transposition table.
+    """
+    entry = shared_table.get(key)
+    if entry is not None:
+        minMaxArg.stats.cache_hits += 1
+        score, code = entry
+        return decode_move(board, code, score)
+
+    bestMove = minMax(board, minMaxArg)
+    shared_table.put(key, bestMove.score, encode_move(bestMove))
+    minMaxArg.stats.cache_stores += 1
     return bestMove
+
+
+# Static evaluations only depend on the placement of the pieces, so they are cached separately from
+# the minimax results above. The table has a fixed size, so it can never outgrow the memory.
+static_eval_cache = HashTable(2**16)
+
+
+def evaluate_cached(board):
+    """
+    A cached version of :py:meth:`evaluate <board.Board.evaluate>`. Leaf positions are reached by many
+    different move orders, so their static score is looked up in :py:data:`static_eval_cache` first
+    and only computed if the position is not known yet.
+    """
+    # The evaluation does not depend on the search depth, so the Zobrist key of the placement is the key. Building the
+    # string of board.hash() would cost half an evaluation, the key is kept up to date by set_cell instead.
+    score = static_eval_cache.get(board.zobrist)
+    if score is not None:
+        return score
+
+    score = board.evaluate()
+    static_eval_cache.put(board.zobrist, score)
+    return score
+
+
+if os.environ.get(TELEMETRY_ENV):
+    enable_telemetry(os.environ[TELEMETRY_ENV])
+
+if os.environ.get(BOOK_ENV):
+    enable_book(os.environ[BOOK_ENV])
+
+if os.environ.get(TABLEBASE_ENV):
+    enable_tablebases(os.environ[TABLEBASE_ENV])
+
+if os.environ.get(DISK_CACHE_ENV):
+    enable_disk_cache(os.environ[DISK_CACHE_ENV])
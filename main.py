@@ -1,4 +1,3 @@
-from ui import run_game
 from board import Board
 import sys
 import tests 
@@ -16,20 +15,45 @@ def run_tests():
     else:
         sys.exit(1)
 
+def run_bench(argv):
+    import bench
+    sys.exit(bench.main(argv))
+
+def run_analyse(argv):
+    import analyse
+    sys.exit(analyse.main(argv))
+
+def run_uci():
+    import uci
+    sys.exit(uci.main())
+
+def run_service(argv):
+    import service
+    sys.exit(service.main(argv))
+
 def main():  
-    args = "manual"
+    args = sys.argv[1] if len(sys.argv) > 1 else "manual"
 
     if args == "manual":
+        from ui import run_game
         board = Board()
         board.reset()
         run_game(board, True)
     elif args == "ai":
+        from ui import run_game
         board = Board()
         board.reset()
         run_game(board, False)
     elif args == "test":
         run_tests()
+    elif args == "bench":
+        run_bench(sys.argv[2:])
+    elif args == "analyse":
+        run_analyse(sys.argv[2:])
+    elif args == "uci":
+        run_uci()
+    elif args == "service":
+        run_service(sys.argv[2:])
 
 if __name__ == "__main__":
     main()
- 
\ No newline at end of file
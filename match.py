@@ -0,0 +1,342 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import engine
+from board import Board, START_FEN
+from engine import MinMaxArg, SearchCancelled, suggest_move
+from pgn import apply_move
+from pieces import King
+from position import Position
+from util import cell_to_string
+
+
+# Balanced positions after the first moves of common openings, every opening is played once with each color
+OPENINGS = [
+    START_FEN,
+    "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/pppp1ppp/8/4p3/2P5/8/PP1PPPPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/ppp1pppp/8/3p4/8/5N2/PPPPPPPP/RNBQKB1R w KQkq - 0 2",
+]
+
+# Settings of an engine that can be given as "name=value" on the command line: the search depth, a node limit per
+# move and the number of worker processes of a parallel search
+ENGINE_SETTINGS = {"depth": int, "max_nodes": int, "workers": int}
+
+
+class Adjudication:
+    """
+    Rules to end decided games early, scores are from WHITE's perspective as returned by the search.
+
+    A game is won once both engines agree on a score of at least resign_score for the same side for resign_moves
+    consecutive moves each. A game is drawn once the scores of both engines stay within draw_score of zero for
+    draw_moves consecutive moves each, but not before ply draw_after.
+    """
+    def __init__(self, resign_score=20.0, resign_moves=3, draw_score=0.5, draw_moves=10, draw_after=40, max_plies=300):
+        self.resign_score = resign_score
+        self.resign_moves = resign_moves
+        self.draw_score = draw_score
+        self.draw_moves = draw_moves
+        self.draw_after = draw_after
+        self.max_plies = max_plies
+
+    def judge(self, scores, ply):
+        """
+        Returns the adjudicated result ("1-0", "0-1" or "1/2-1/2") or None if the game goes on
+
+        :param scores: The search scores of all moves played so far
+        :param ply: Number of moves played so far
+        """
+        recent = scores[-2 * self.resign_moves:]
+        if len(recent) == 2 * self.resign_moves:
+            if all(score >= self.resign_score for score in recent):
+                return "1-0"
+            if all(score <= -self.resign_score for score in recent):
+                return "0-1"
+
+        recent = scores[-2 * self.draw_moves:]
+        if ply >= self.draw_after and len(recent) == 2 * self.draw_moves and all(abs(score) <= self.draw_score for score in recent):
+            return "1/2-1/2"
+
+        if ply >= self.max_plies:
+            return "1/2-1/2"
+
+        return None
+
+
+def parse_engine(text):
+    """
+    Parses an engine configuration given as comma separated "name=value" settings, e.g. "depth=3" or
+    "depth=5,max_nodes=2000,workers=4"
+
+    :return: Dictionary of the settings, see :py:func:`engine_move`
+    """
+    config = {}
+    for item in filter(None, text.split(",")):
+        name, _, value = item.partition("=")
+        if name not in ENGINE_SETTINGS:
+            raise ValueError(f"unknown engine setting {name!r}, expected one of {', '.join(ENGINE_SETTINGS)}")
+        config[name] = ENGINE_SETTINGS[name](value)
+
+    return config
+
+
+def only_kings_left(board):
+    """
+    Returns True if neither side has any material but its king (the game can only end in a draw)
+    """
+    return all(piece is None or isinstance(piece, King) for row in board.cells for piece in row)
+
+
+def engine_move(board, config):
+    """
+    Searches the move of an engine configuration for the side to move.
+
+    Without a node limit this is a single search of the configured depth. With a node limit the depths are searched
+    one after the other, as the UCI engine does, and the move of the deepest search that finished within the limit
+    is played; the depth setting is then the deepest search tried.
+
+    :param board: The board to move on, it is left unchanged
+    :param config: Settings of the engine, see :py:func:`parse_engine`
+    :return: The :py:class:`engine.Move`
+    """
+    settings = dict(config)
+    workers = settings.pop("workers", None)
+    max_nodes = settings.pop("max_nodes", None)
+
+    if max_nodes is None:
+        return suggest_move(board, workers, MinMaxArg(playAsWhite=board.white_to_move, **settings))
+
+    best = None
+    nodes = 0
+    for depth in range(1, settings.get("depth", engine.DEPTH) + 1):
+        try:
+            move = suggest_move(board, workers, MinMaxArg(depth, board.white_to_move, max_nodes=max_nodes - nodes))
+        except SearchCancelled:
+            break
+
+        # Parallel searches do not stop at the limit, a result found with too many nodes is not used either
+        nodes += move.stats.nodes
+        if nodes > max_nodes:
+            break
+
+        best = move
+        if nodes >= max_nodes or move.piece is None:
+            break
+
+    # Even the shallowest search needs more nodes than allowed, the engine still has to move
+    if best is None:
+        best = suggest_move(board, workers, MinMaxArg(1, board.white_to_move))
+
+    return best
+
+
+def play_game(opening, white, black, adjudication):
+    """
+    Plays one game between two engine configurations. Runs in the worker processes.
+
+    :param opening: FEN of the start position
+    :param white: Settings of the engine playing WHITE, see :py:func:`parse_engine`
+    :param black: Settings of the engine playing BLACK
+    :param adjudication: The :py:class:`Adjudication` rules
+    :return: Dictionary with the result, the reason the game ended, the moves and the time spent per side
+    """
+    board = Board.from_fen(opening)
+    white_starts = board.white_to_move
+
+    # Keep the memory of a worker bounded over many games
+    engine.eval_cache.clear()
+
+    moves, scores = [], []
+    times = {"white": 0.0, "black": 0.0}
+    repetitions = {Position.from_board(board): 1}
+    result = reason = None
+
+    while result is None:
+        side = "white" if board.white_to_move else "black"
+        config = white if board.white_to_move else black
+
+        start = time.perf_counter()
+        move = engine_move(board, config)
+        times[side] += time.perf_counter() - start
+
+        if move.piece is None:
+            if board.is_king_check(board.white_to_move):
+                result, reason = ("0-1" if board.white_to_move else "1-0"), "checkmate"
+            else:
+                result, reason = "1/2-1/2", "stalemate"
+            break
+
+        moves.append(cell_to_string(move.piece.cell) + cell_to_string(move.cell))
+        scores.append(move.score)
+        if apply_move(board, (int(move.piece.cell[0]), int(move.piece.cell[1])), (int(move.cell[0]), int(move.cell[1]))):
+            repetitions.clear()
+            board.check_cache.clear()
+
+        position = Position.from_board(board)
+        repetitions[position] = repetitions.get(position, 0) + 1
+
+        if repetitions[position] >= 3:
+            result, reason = "1/2-1/2", "repetition"
+        elif board.halfmove_clock >= 100:
+            result, reason = "1/2-1/2", "fifty moves"
+        elif only_kings_left(board):
+            result, reason = "1/2-1/2", "insufficient material"
+        else:
+            result = adjudication.judge(scores, len(moves))
+            reason = "adjudication" if result is not None else None
+
+    # The pool of a parallel search would keep the worker from exiting, and each game starts with a fresh table
+    engine.shutdown_executor()
+
+    return {"opening": opening, "result": result, "reason": reason, "moves": moves, "times": times,
+            "white_moves": (len(moves) + 1) // 2 if white_starts else len(moves) // 2}
+
+
+def elo_difference(score):
+    """
+    Returns the Elo difference matching an expected score between 0 and 1
+    """
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+
+def summarize(games, elapsed):
+    """
+    Sums up the games from the view of engine A
+
+    :param games: Result dictionaries of :py:func:`play_game`, tagged with "a_white"
+    :param elapsed: Wall clock time of the match in seconds
+    :return: Dictionary with wins, draws, losses, score, Elo difference with 95% error bars, games per minute and
+             average time per move of both engines
+    """
+    points = []
+    time_a = time_b = 0.0
+    moves_a = moves_b = 0
+
+    for game in games:
+        white_points = {"1-0": 1.0, "0-1": 0.0}.get(game["result"], 0.5)
+        points.append(white_points if game["a_white"] else 1.0 - white_points)
+
+        black_moves = len(game["moves"]) - game["white_moves"]
+        if game["a_white"]:
+            time_a, time_b = time_a + game["times"]["white"], time_b + game["times"]["black"]
+            moves_a, moves_b = moves_a + game["white_moves"], moves_b + black_moves
+        else:
+            time_a, time_b = time_a + game["times"]["black"], time_b + game["times"]["white"]
+            moves_a, moves_b = moves_a + black_moves, moves_b + game["white_moves"]
+
+    count = len(points)
+    score = sum(points) / count if count else 0.5
+    deviation = math.sqrt(sum((p - score) ** 2 for p in points) / count) if count else 0.0
+    margin = 1.96 * deviation / math.sqrt(count) if count else 0.0
+
+    return {
+        "games": count,
+        "wins": points.count(1.0),
+        "draws": points.count(0.5),
+        "losses": points.count(0.0),
+        "score": score,
+        "elo": elo_difference(score),
+        "elo_low": elo_difference(score - margin),
+        "elo_high": elo_difference(score + margin),
+        "games_per_minute": 60.0 * count / max(elapsed, 1e-9),
+        "time_per_move_a": time_a / max(moves_a, 1),
+        "time_per_move_b": time_b / max(moves_b, 1),
+    }
+
+
+def run_match(a, b, openings=OPENINGS, workers=None, adjudication=None, on_game=None):
+    """
+    Plays every opening twice, once with each engine as WHITE, in a process pool.
+
+    :param a: Settings of engine A, see :py:func:`parse_engine`
+    :param b: Settings of engine B
+    :param openings: FEN strings of the start positions
+    :param workers: Number of worker processes. If None, the number of CPUs is used.
+    :param adjudication: The :py:class:`Adjudication` rules. If None, the defaults are used.
+    :param on_game: Called with the result dictionary of every finished game
+    :return: Tuple of the summary (see :py:func:`summarize`) and the list of game results
+    """
+    adjudication = adjudication or Adjudication()
+    games = []
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {}
+        for opening in openings:
+            futures[pool.submit(play_game, opening, a, b, adjudication)] = True
+            futures[pool.submit(play_game, opening, b, a, adjudication)] = False
+
+        for future in as_completed(futures):
+            game = {**future.result(), "a_white": futures[future]}
+            games.append(game)
+            if on_game is not None:
+                on_game(game)
+
+    return summarize(games, time.perf_counter() - start), games
+
+
+def load_openings(path):
+    """
+    Reads the start positions of a match: one FEN per line, or the final positions of the games of a .pgn file
+    """
+    if path.endswith(".pgn"):
+        import pgn
+        openings = []
+        board = Board()
+        with pgn.open_pgn(path) as f:
+            for game in pgn.read_games(f):
+                board.load_fen(game.headers.get("FEN", START_FEN))
+                for san in game.moves:
+                    pgn.play_move(board, san)
+                openings.append(board.to_fen())
+        return openings
+
+    with open(path, "rt") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plays a headless engine-vs-engine match and reports the Elo difference.")
+    parser.add_argument("-a", "--engine-a", default=f"depth={engine.DEPTH}", help=f"settings of engine A, e.g. depth=3 or depth=5,max_nodes=2000,workers=4 (default: depth={engine.DEPTH})")
+    parser.add_argument("-b", "--engine-b", default=f"depth={engine.DEPTH - 1}", help=f"settings of engine B (default: depth={engine.DEPTH - 1})")
+    parser.add_argument("--openings", help="file with one FEN per line or a .pgn file (default: built-in set)")
+    parser.add_argument("-w", "--workers", type=int, help="number of games played at once (default: number of CPUs)")
+    parser.add_argument("--max-plies", type=int, default=300, help="adjudicate a draw after this many plies (default: 300)")
+    parser.add_argument("--resign-score", type=float, default=20.0, help="score adjudicated as win (default: 20)")
+    parser.add_argument("-o", "--output", help="write one JSON line per game to this file")
+    args = parser.parse_args(argv)
+
+    a, b = parse_engine(args.engine_a), parse_engine(args.engine_b)
+    openings = load_openings(args.openings) if args.openings else OPENINGS
+    adjudication = Adjudication(resign_score=args.resign_score, max_plies=args.max_plies)
+
+    output = open(args.output, "wt") if args.output else None
+
+    def on_game(game):
+        print(f"{'A' if game['a_white'] else 'B'}-{'B' if game['a_white'] else 'A'} {game['result']} "
+              f"({game['reason']}, {len(game['moves'])} plies)", file=sys.stderr)
+        if output is not None:
+            output.write(json.dumps(game) + "\n")
+
+    try:
+        summary, _ = run_match(a, b, openings, args.workers, adjudication, on_game)
+    finally:
+        if output is not None:
+            output.close()
+
+    print(f"A ({args.engine_a}) vs B ({args.engine_b}): +{summary['wins']} ={summary['draws']} -{summary['losses']}, "
+          f"score {summary['score']:.3f}, Elo {summary['elo']:+.0f} [{summary['elo_low']:+.0f}, {summary['elo_high']:+.0f}], "
+          f"{summary['games_per_minute']:.1f} games/min, {1000 * summary['time_per_move_a']:.1f}/"
+          f"{1000 * summary['time_per_move_b']:.1f} ms per move")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from board import Board
+from pieces import Pawn, Rook, Bishop, Queen, King, Knight
+
+
+HISTORY_FILE = "microbench_history.jsonl"
+
+# Positions the primitives are timed on, "startpos" is the default start configuration
+POSITIONS = ["startpos", "tests/random1.board", "tests/random2.board"]
+
+# All cells of the board plus a ring of invalid cells around it
+CELLS = [(row, col) for row in range(8) for col in range(8)]
+CELLS_WITH_INVALID = [(row, col) for row in range(-1, 9) for col in range(-1, 9)]
+
+
+def load_boards():
+    boards = []
+    for name in POSITIONS:
+        board = Board()
+        if name == "startpos":
+            board.reset()
+        else:
+            board.load_from_disk(name)
+        boards.append(board)
+
+    return boards
+
+
+def pieces_of(boards, pieceClass):
+    return [piece for board in boards for row in board.cells for piece in row if isinstance(piece, pieceClass)]
+
+
+def make_benchmarks(boards):
+    """
+    Creates the benchmarks. Each benchmark is a tuple (name, function, calls), where function runs
+    the primitive *calls* times on the representative positions.
+    """
+    benchmarks = []
+
+    # Move one piece to an empty cell and back again, so the positions stay intact
+    movers = []
+    for board in boards:
+        piece = next(board.iterate_cells_with_pieces(True))
+        target = next(cell for cell in CELLS if board.get_cell(cell) is None)
+        movers.append((board, piece, (int(piece.cell[0]), int(piece.cell[1])), target))
+
+    def bench_set_cell():
+        for board, piece, origin, target in movers:
+            board.set_cell(target, piece)
+            board.set_cell(origin, piece)
+
+    benchmarks.append(("BoardBase.set_cell", bench_set_cell, 2 * len(movers)))
+
+    def bench_get_cell():
+        for board in boards:
+            for cell in CELLS:
+                board.get_cell(cell)
+
+    benchmarks.append(("BoardBase.get_cell", bench_get_cell, len(boards) * len(CELLS)))
+
+    def bench_is_valid_cell():
+        for board in boards:
+            for cell in CELLS_WITH_INVALID:
+                board.is_valid_cell(cell)
+
+    benchmarks.append(("Board.is_valid_cell", bench_is_valid_cell, len(boards) * len(CELLS_WITH_INVALID)))
+
+    def bench_cell_is_valid_and_empty():
+        for board in boards:
+            for cell in CELLS_WITH_INVALID:
+                board.cell_is_valid_and_empty(cell)
+
+    benchmarks.append(("Board.cell_is_valid_and_empty", bench_cell_is_valid_and_empty, len(boards) * len(CELLS_WITH_INVALID)))
+
+    hitters = [(board, board.find_king(True) or next(board.iterate_cells_with_pieces(True))) for board in boards]
+
+    def bench_piece_can_hit_on_cell():
+        for board, piece in hitters:
+            for cell in CELLS_WITH_INVALID:
+                board.piece_can_hit_on_cell(piece, cell)
+
+    benchmarks.append(("Board.piece_can_hit_on_cell", bench_piece_can_hit_on_cell, len(hitters) * len(CELLS_WITH_INVALID)))
+
+    def bench_hash():
+        for board in boards:
+            board.hash()
+
+    benchmarks.append(("BoardBase.hash", bench_hash, len(boards)))
+
+    fens = [board.to_fen() for board in boards]
+    loader = Board()
+
+    def bench_load_fen():
+        for fen in fens:
+            loader.load_fen(fen)
+
+    benchmarks.append(("BoardBase.load_fen", bench_load_fen, len(fens)))
+
+    def bench_to_fen():
+        for board in boards:
+            board.to_fen()
+
+    benchmarks.append(("BoardBase.to_fen", bench_to_fen, len(boards)))
+
+    for pieceClass in [Pawn, Rook, Knight, Bishop, Queen, King]:
+        pieces = pieces_of(boards, pieceClass)
+
+        def bench_reachable(pieces=pieces):
+            for piece in pieces:
+                piece.get_reachable_cells()
+
+        benchmarks.append((f"{pieceClass.__name__}.get_reachable_cells", bench_reachable, len(pieces)))
+
+    return benchmarks
+
+
+def measure(function, calls, repeat, warmup, minimum_time):
+    """
+    Times a benchmark function.
+
+    :param calls: Number of primitive calls per run of the function
+    :param repeat: Number of timed samples
+    :param warmup: Number of untimed runs before sampling
+    :param minimum_time: Each sample loops the function until at least this many seconds passed
+    :return: Dictionary of statistics in nanoseconds per primitive call
+    """
+    for _ in range(warmup):
+        function()
+
+    # Find the number of loops per sample, so timer resolution does not matter
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        if time.perf_counter() - start >= minimum_time:
+            break
+        loops *= 2
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        samples.append((time.perf_counter() - start) / (loops * calls) * 1e9)
+
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "repeat": repeat,
+        "loops": loops,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(repeat=7, warmup=3, minimum_time=0.02, only=None):
+    """
+    Runs all micro benchmarks (or only those whose name contains *only*)
+
+    :return: One history record (dictionary)
+    """
+    results = {}
+    for name, function, calls in make_benchmarks(load_boards()):
+        if only is not None and only not in name:
+            continue
+        if calls == 0:
+            continue
+
+        results[name] = measure(function, calls, repeat, warmup, minimum_time)
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+
+
+def load_history(path):
+    try:
+        with open(path, "rt") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def compare(old, new, threshold):
+    """
+    Compares two history records by their fastest samples. Noise from other processes only ever makes
+    samples slower, so the minimum is the most stable figure to compare.
+
+    :param threshold: Relative slowdown that is flagged (e.g. 0.1 for 10%)
+    :return: List of tuples (name, old time, new time, relative change, flagged)
+    """
+    rows = []
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+
+        before = old["results"][name]["min"]
+        after = result["min"]
+        change = after / before - 1.0
+        rows.append((name, before, after, change, change > threshold))
+
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro benchmarks of the board primitives.")
+    parser.add_argument("--history", default=HISTORY_FILE, help=f"history file (default: {HISTORY_FILE})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    runParser = commands.add_parser("run", help="time all primitives and append the results to the history")
+    runParser.add_argument("--repeat", type=int, default=7, help="number of timed samples (default: 7)")
+    runParser.add_argument("--warmup", type=int, default=3, help="number of untimed warmup runs (default: 3)")
+    runParser.add_argument("--filter", help="only run benchmarks whose name contains this text")
+    runParser.add_argument("--no-save", action="store_true", help="do not append the results to the history")
+
+    compareParser = commands.add_parser("compare", help="compare two runs of the history")
+    compareParser.add_argument("--threshold", type=float, default=0.1, help="flag slowdowns beyond this fraction (default: 0.1)")
+    compareParser.add_argument("--base", type=int, default=-2, help="index of the base run in the history (default: -2, the one before the latest)")
+    compareParser.add_argument("--head", type=int, default=-1, help="index of the compared run in the history (default: -1, the latest)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        record = run(args.repeat, args.warmup, only=args.filter)
+        for name, result in record["results"].items():
+            print(f"{name:32s} {result['median']:10.1f} ns/call (min {result['min']:.1f}, stdev {result['stdev']:.1f})")
+
+        if not args.no_save:
+            with open(args.history, "at") as f:
+                f.write(json.dumps(record) + "\n")
+        return 0
+
+    history = load_history(args.history)
+    if len(history) < 2:
+        print(f"Need at least two runs in {args.history} to compare", file=sys.stderr)
+        return 2
+
+    old, new = history[args.base], history[args.head]
+    print(f"Comparing {old['timestamp']} ({old['revision']}) -> {new['timestamp']} ({new['revision']})")
+
+    slower = False
+    for name, before, after, change, flagged in compare(old, new, args.threshold):
+        marker = "  SLOWER" if flagged else ""
+        print(f"{name:32s} {before:10.1f} -> {after:10.1f} ns/call ({100.0 * change:+.1f}%){marker}")
+        slower = slower or flagged
+
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import argparse
+import glob
+import importlib
+import json
+import os
+import sys
+import time
+from util import cell_to_string
+
+
+# Reference leaf counts, see --check and --update
+REFERENCE_FILE = "tests/perft.json"
+
+# Name of the default start position in the reference file
+STARTPOS = "startpos"
+
+
+def perft(board, depth, white):
+    """
+    Counts the leaf nodes of the move tree up to the given depth (performance test of the move generator).
+    Moves are generated with :py:meth:`get_valid_cells <pieces.Piece.get_valid_cells>`, so the count verifies the
+    movability rules and the legality check at the same time.
+
+    :param board: The board to count on. It is restored before this function returns.
+    :param depth: Number of plies to play
+    :param white: True if WHITE is to move, False otherwise
+    :return: Number of leaf nodes
+    """
+    if depth == 0:
+        return 1
+
+    nodes = 0
+
+    # Collect the pieces first, the board changes while the moves are played
+    for piece in list(board.iterate_cells_with_pieces(white)):
+        valid_cells = piece.get_valid_cells()
+
+        # Bulk counting: on the last ply the moves do not need to be played
+        if depth == 1:
+            nodes += len(valid_cells)
+            continue
+
+        current_cell = piece.cell
+        for cell in valid_cells:
+            content_cell = board.get_cell(cell)
+            board.set_cell(cell, piece)
+
+            nodes += perft(board, depth - 1, not white)
+
+            # Return the board to it's original state
+            board.set_cell(current_cell, piece)
+            board.set_cell(cell, content_cell)
+
+    return nodes
+
+
+def divide(board, depth, white):
+    """
+    Same as :py:func:`perft`, but returns the leaf count per root move. Useful to find the move where
+    two move generators disagree.
+
+    :return: Dictionary of move (e.g. "e2e4") to number of leaf nodes
+    """
+    result = {}
+
+    for piece in list(board.iterate_cells_with_pieces(white)):
+        current_cell = piece.cell
+        origin = cell_to_string(current_cell)
+
+        for cell in piece.get_valid_cells():
+            content_cell = board.get_cell(cell)
+            board.set_cell(cell, piece)
+
+            result[origin + cell_to_string(cell)] = perft(board, depth - 1, not white)
+
+            # Return the board to it's original state
+            board.set_cell(current_cell, piece)
+            board.set_cell(cell, content_cell)
+
+    return result
+
+
+def load_position(boardClass, name):
+    """
+    Creates a board of the given class holding the named position (a .board file, a FEN string or "startpos")
+    """
+    board = boardClass()
+    if name == STARTPOS:
+        board.reset()
+    elif os.path.isfile(name):
+        board.load_from_disk(name)
+    else:
+        board.load_fen(name)
+
+    return board
+
+
+def load_board_class(path):
+    """
+    Imports a board implementation given as "module.Class"
+    """
+    module, name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Counts move tree leaves (perft) and measures move generator speed.")
+    parser.add_argument("positions", nargs="*", help=f".board files or FEN strings to run on (default: {STARTPOS} and tests/*.board)")
+    parser.add_argument("-d", "--depth", type=int, default=3, help="search depth in plies (default: 3)")
+    parser.add_argument("--black", action="store_true", help="BLACK is to move (default: WHITE)")
+    parser.add_argument("--divide", action="store_true", help="print the leaf count per root move")
+    parser.add_argument("--board", default="board.Board", help="board implementation to test (default: board.Board)")
+    parser.add_argument("--check", action="store_true", help=f"compare the counts against {REFERENCE_FILE}")
+    parser.add_argument("--update", action="store_true", help=f"store the counts in {REFERENCE_FILE}")
+    args = parser.parse_args(argv)
+
+    boardClass = load_board_class(args.board)
+    positions = args.positions or [STARTPOS] + sorted(glob.glob("tests/*.board"))
+    white = not args.black
+    side = "w" if white else "b"
+
+    try:
+        with open(REFERENCE_FILE, "rt") as f:
+            reference = json.load(f)
+    except FileNotFoundError:
+        reference = {}
+
+    failed = False
+    totalNodes = 0
+    totalTime = 0.0
+
+    for name in positions:
+        board = load_position(boardClass, name)
+
+        start = time.perf_counter()
+        if args.divide:
+            counts = divide(board, args.depth, white)
+            nodes = sum(counts.values())
+        else:
+            nodes = perft(board, args.depth, white)
+        elapsed = time.perf_counter() - start
+
+        totalNodes += nodes
+        totalTime += elapsed
+
+        if args.divide:
+            for move, count in sorted(counts.items()):
+                print(f"  {move}: {count}")
+
+        status = ""
+        key = f"{name} {side} {args.depth}"
+        if args.check and key in reference:
+            if reference[key] == nodes:
+                status = " OK"
+            else:
+                status = f" MISMATCH (expected {reference[key]})"
+                failed = True
+
+        if args.update:
+            reference[key] = nodes
+
+        print(f"{name} depth {args.depth}: {nodes} nodes in {elapsed:.3f}s ({nodes / max(elapsed, 1e-9):.0f} nps){status}")
+
+    print(f"Total: {totalNodes} nodes in {totalTime:.3f}s ({totalNodes / max(totalTime, 1e-9):.0f} nps)")
+
+    if args.update:
+        with open(REFERENCE_FILE, "wt") as f:
+            json.dump(reference, f, indent=2, sort_keys=True)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+import argparse
+import bz2
+import gzip
+import re
+import sys
+import time
+from typing import NamedTuple
+from board import Board, START_FEN
+from pieces import Pawn, Rook, Bishop, Queen, King, Knight
+from position import Position, PositionWriter
+from util import cell_to_string
+
+
+# Maps the piece letters of SAN to the piece classes, pawn moves have no letter
+SAN_PIECES = {"": Pawn, "R": Rook, "N": Knight, "B": Bishop, "Q": Queen, "K": King}
+
+# One SAN move: piece, origin file, origin rank, capture, target cell, promotion, check marks and annotations
+SAN = re.compile(r"^([RNBQK]?)([a-h]?)([1-8]?)(x?)([a-h][1-8])(?:=?([RNBQ]))?(?:e\.p\.)?[+#]?[!?]*$")
+CASTLING = re.compile(r"^([O0]-[O0](-[O0])?)[+#]?[!?]*$")
+
+HEADER = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+COMMENT = re.compile(r"\{[^}]*\}|;[^\n]*")
+VARIATION = re.compile(r"\([^()]*\)")
+MOVE_NUMBER = re.compile(r"\d+\.+")
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+
+# Cells of the kings and rooks in the start position with the castling rights lost once they are left or captured on
+CASTLING_CELLS = (((0, 4), "KQ"), ((0, 0), "Q"), ((0, 7), "K"), ((7, 4), "kq"), ((7, 0), "q"), ((7, 7), "k"))
+
+
+class IllegalMoveError(ValueError):
+    """
+    Raised if a SAN move does not describe exactly one legal move in the current position
+    """
+    def __init__(self, san, board):
+        super().__init__(f"illegal or ambiguous move {san!r} in {board.to_fen()}")
+        self.san = san
+
+
+class Game(NamedTuple):
+    """
+    One game of a PGN file: the tag pairs, the moves in SAN (without comments and variations) and the result
+    """
+    headers: dict
+    moves: list
+    result: str
+
+
+def open_pgn(path):
+    """
+    Opens a PGN file for reading as text, .gz and .bz2 files are decompressed on the fly
+    """
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8", errors="replace")
+
+    return open(path, "rt", encoding="utf-8", errors="replace")
+
+
+def read_games(lines):
+    """
+    Streams the games of a PGN text. Only the game currently being read is held in memory.
+
+    :param lines: Iterable of lines, e.g. an open file
+    :return: Generator of :py:class:`Game`
+    """
+    headers = {}
+    movetext = []
+
+    for line in lines:
+        match = HEADER.match(line) if line.startswith("[") else None
+        if match is not None:
+            # The tag pairs of a game follow the moves of the previous one
+            if movetext:
+                yield parse_game(headers, movetext)
+                headers, movetext = {}, []
+
+            headers[match.group(1)] = match.group(2)
+        elif line.strip():
+            movetext.append(line)
+
+    if headers or movetext:
+        yield parse_game(headers, movetext)
+
+
+def parse_game(headers, movetext):
+    """
+    Splits the movetext of a game into SAN moves, dropping comments, variations, move numbers and annotation glyphs
+    """
+    text = COMMENT.sub(" ", "".join(movetext))
+
+    # Variations may be nested, remove them from the inside out
+    while "(" in text:
+        stripped = VARIATION.sub(" ", text)
+        if stripped == text:
+            break
+        text = stripped
+
+    moves = []
+    result = headers.get("Result", "*")
+    for token in MOVE_NUMBER.sub(" ", text).split():
+        if token in RESULTS:
+            result = token
+        elif not token.startswith("$"):
+            moves.append(token)
+
+    return Game(headers, moves, result)
+
+
+def find_origin(board, pieceClass, white, target, file, rank):
+    """
+    Finds the piece moving to the target cell.
+    Candidates that can reach the target are checked with :py:meth:`get_valid_cells <pieces.Piece.get_valid_cells>` only
+    if there is more than one, e.g. to rule out a pinned piece.
+
+    :return: The piece or None if no piece or more than one piece of the given class can move there
+    """
+    candidates = []
+    for piece in board.iterate_cells_with_pieces(white):
+        if piece.__class__ is not pieceClass:
+            continue
+
+        row, col = piece.cell
+        if (file is not None and col != file) or (rank is not None and row != rank):
+            continue
+
+        if target in piece.get_reachable_cells():
+            candidates.append(piece)
+
+    if len(candidates) > 1:
+        candidates = [piece for piece in candidates if target in piece.get_valid_cells()]
+
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def play_move(board, san):
+    """
+    Plays a SAN move for the side to move, see :py:func:`apply_move`.
+
+    :param board: The board to play the move on
+    :param san: The move in standard algebraic notation, e.g. "Nxe5", "exd6", "O-O" or "e8=Q+"
+    :return: Tuple (origin, target) of the cells the moving piece left and entered
+    :raises IllegalMoveError: If the move can not be played in the current position
+    """
+    white = board.white_to_move
+    home = 0 if white else 7
+
+    castling = CASTLING.match(san)
+    if castling is not None:
+        long = castling.group(2) is not None
+        king, rook = board.get_cell((home, 4)), board.get_cell((home, 0 if long else 7))
+        right = ("Q" if long else "K") if white else ("q" if long else "k")
+
+        if (right not in board.castling or not isinstance(king, King) or not isinstance(rook, Rook)
+                or any(board.get_cell((home, col)) is not None for col in ((1, 2, 3) if long else (5, 6)))):
+            raise IllegalMoveError(san, board)
+
+        apply_move(board, (home, 4), (home, 2 if long else 6))
+        return (home, 4), (home, 2 if long else 6)
+
+    match = SAN.match(san)
+    if match is None:
+        raise IllegalMoveError(san, board)
+
+    letter, file, rank, capture, square, promotion = match.groups()
+    target = (int(square[1]) - 1, ord(square[0]) - ord("a"))
+    file = ord(file) - ord("a") if file else None
+    rank = int(rank) - 1 if rank else None
+    pieceClass = SAN_PIECES[letter]
+    captured = board.get_cell(target)
+
+    if pieceClass is Pawn and capture and captured is None and square == board.en_passant and file is not None:
+        # The move generator does not know en passant, the capturing pawn stands next to the cell behind the target
+        piece = board.get_cell((target[0] - (1 if white else -1), file))
+        if not isinstance(piece, Pawn) or piece.white != white:
+            raise IllegalMoveError(san, board)
+    else:
+        piece = find_origin(board, pieceClass, white, target, file, rank)
+        if piece is None or (captured is not None) != bool(capture):
+            raise IllegalMoveError(san, board)
+
+    if promotion and (pieceClass is not Pawn or target[0] != 7 - home):
+        raise IllegalMoveError(san, board)
+
+    origin = (int(piece.cell[0]), int(piece.cell[1]))
+    apply_move(board, origin, target, SAN_PIECES[promotion] if promotion else None)
+    return origin, target
+
+
+def apply_move(board, origin, target, promotion=None):
+    """
+    Moves the piece on the origin cell to the target cell, including castling (the king moves two cells),
+    en passant (a pawn moves diagonally onto an empty cell) and promotion, which the move generator does not know.
+    The move is not checked for legality. Updates the game state of the board (side to move, castling rights,
+    en passant cell, move counters), so :py:meth:`to_fen <board.BoardBase.to_fen>` stays correct.
+
+    :param board: The board to play the move on
+    :param origin: Cell (row, col) of the piece to move
+    :param target: Cell (row, col) to move the piece to
+    :param promotion: Piece class a pawn reaching the last row turns into. If None, it becomes a queen.
+    :return: True if the move can never be undone (a capture or a pawn move)
+    """
+    piece = board.get_cell(origin)
+    white = piece.white
+    captured = board.get_cell(target)
+    irreversible = captured is not None or isinstance(piece, Pawn)
+    en_passant = "-"
+
+    if isinstance(piece, King) and abs(target[1] - origin[1]) == 2:
+        # Castling, the rook jumps over the king
+        rook = board.get_cell((origin[0], 0 if target[1] < origin[1] else 7))
+        board.set_cell((origin[0], (origin[1] + target[1]) // 2), rook)
+    elif isinstance(piece, Pawn):
+        if target[1] != origin[1] and captured is None:
+            board.set_cell((origin[0], target[1]), None)
+        elif abs(target[0] - origin[0]) == 2:
+            en_passant = cell_to_string(((origin[0] + target[0]) // 2, origin[1]))
+
+    board.set_cell(target, piece)
+
+    if isinstance(piece, Pawn) and target[0] == (7 if white else 0):
+        board.set_cell(target, (promotion or Queen)(board, white))
+
+    board.halfmove_clock = 0 if irreversible else board.halfmove_clock + 1
+
+    # Moving the king or a rook, or capturing a rook on its home cell, loses the castling right
+    for cell, rights in CASTLING_CELLS:
+        if cell == origin or cell == target:
+            board.castling = "".join(right for right in board.castling if right not in rights) or "-"
+
+    board.en_passant = en_passant
+    board.white_to_move = not white
+    if not white:
+        board.fullmove_number += 1
+
+    return irreversible
+
+
+def replay(games, board=None, errors=None):
+    """
+    Replays games on one reused board and streams every position reached, starting with the initial one.
+
+    :param games: Iterable of :py:class:`Game`, e.g. from :py:func:`read_games`
+    :param board: The board to reuse. If None, a new board is created.
+    :param errors: Optional list, games with an illegal move are appended as tuples (game, error) instead of raising
+    :return: Generator of tuples (game, ply, position), position being a :py:class:`position.Position` snapshot
+    """
+    if board is None:
+        board = Board()
+
+    for game in games:
+        board.load_fen(game.headers.get("FEN", START_FEN))
+
+        # The check cache is only useful within a game, clearing it keeps the memory bounded
+        board.check_cache.clear()
+
+        yield game, 0, Position.from_board(board)
+        for ply, san in enumerate(game.moves, 1):
+            try:
+                play_move(board, san)
+            except IllegalMoveError as error:
+                if errors is None:
+                    raise
+                errors.append((game, error))
+                break
+
+            yield game, ply, Position.from_board(board)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replays the games of PGN files and reports the replay speed.")
+    parser.add_argument("files", nargs="*", default=["-"], help="PGN files, .gz or .bz2 compressed, - for stdin (default: -)")
+    parser.add_argument("-o", "--output", help="append every position to this binary position file")
+    parser.add_argument("--fen", action="store_true", help="print every position as FEN to stdout")
+    args = parser.parse_args(argv)
+
+    writer = PositionWriter(args.output) if args.output else None
+    board = Board()
+    errors = []
+    games = positions = 0
+    start = time.perf_counter()
+
+    try:
+        for path in args.files:
+            with open_pgn(path) as f:
+                for game, ply, position in replay(read_games(f), board, errors):
+                    positions += 1
+                    if ply == 0:
+                        games += 1
+                    if writer is not None:
+                        writer.write(position)
+                    if args.fen:
+                        print(board.to_fen())
+    finally:
+        if writer is not None:
+            writer.close()
+
+    for game, error in errors:
+        print(f"{game.headers.get('White', '?')} - {game.headers.get('Black', '?')}: {error}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print(f"{games} games, {positions} positions, {len(errors)} errors in {elapsed:.2f}s "
+          f"({games / max(elapsed, 1e-9):.1f} games/s, {positions / max(elapsed, 1e-9):.0f} positions/s)", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
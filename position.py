@@ -0,0 +1,306 @@
+import math
+import mmap
+import os
+from struct import Struct
+from typing import NamedTuple
+from board import Board
+from pieces import Pawn, Rook, Bishop, Queen, King, Knight
+from cache import position_key
+
+
+# Maps the piece characters of the board hash to the piece classes
+PIECE_CLASSES = {
+    "P": Pawn,
+    "R": Rook,
+    "N": Knight,
+    "B": Bishop,
+    "Q": Queen,
+    "K": King,
+}
+
+
+class Position(NamedTuple):
+    """
+    Immutable snapshot of a board configuration together with the color to move.
+
+    The pieces are stored as 64 piece characters in the order of :py:meth:`hash <board.BoardBase.hash>`
+    (row 8 first, "." for empty cells). Unlike a :py:class:`board.Board`, a position holds no piece objects and no caches,
+    so it is hashable, can be used as a dictionary key and is tiny to pickle when sent to other processes.
+    """
+    cells: bytes
+    white: bool = True
+
+    @classmethod
+    def from_board(cls, board, white=None):
+        """
+        Takes a snapshot of the given board.
+
+        :param board: The board to take the snapshot from
+        :param white: True if WHITE is to move in this position, False otherwise. If None, the side to move of the board is used.
+        """
+        if white is None:
+            white = board.white_to_move
+
+        return cls(board.hash().encode("ascii"), white)
+
+    def to_board(self, board=None):
+        """
+        Places the pieces of this position on a board.
+
+        :param board: The board to reuse. All pieces currently placed on it are removed. If None, a new board is created.
+        :return: The board holding this position
+        """
+        if board is None:
+            board = Board()
+
+        board.clear_board()
+
+        for index, code in enumerate(self.cells.decode("ascii")):
+            if code == ".":
+                continue
+
+            piece = PIECE_CLASSES[code.upper()](board, code.isupper())
+            board.set_cell((7 - index // 8, index % 8), piece)
+
+        board.reset_game_state()
+        board.white_to_move = self.white
+        return board
+
+    @property
+    def key(self):
+        """
+        64 bit key of this position including the color to move, the same in every process.
+        """
+        return position_key(self.cells.decode("ascii") + ("-w" if self.white else "-b"))
+
+    def __str__(self):
+        text = self.cells.decode("ascii")
+        return "\n".join(" ".join(text[row * 8:row * 8 + 8]) for row in range(8))
+
+
+# Piece codes of the binary position records, 0 is an empty cell, BLACK pieces have bit 3 set
+PIECE_CODES = {".": 0, "P": 1, "R": 2, "N": 3, "B": 4, "Q": 5, "K": 6, "p": 9, "r": 10, "n": 11, "b": 12, "q": 13, "k": 14}
+
+# Translates the piece characters of a position into their piece codes and back
+ENCODE_TABLE = bytes.maketrans("".join(PIECE_CODES).encode("ascii"), bytes(PIECE_CODES.values()))
+DECODE_CHARACTERS = bytes.maketrans(bytes(PIECE_CODES.values()), "".join(PIECE_CODES).encode("ascii"))
+
+# Maps the piece codes to the (piece class, white) pair to create, None for empty cells
+DECODE_TABLE = {value: (PIECE_CLASSES[code.upper()], code.isupper()) if value else None for code, value in PIECE_CODES.items()}
+
+# Flags of the binary position records
+WHITE_TO_MOVE = 1
+HAS_SCORE = 2
+
+
+class PositionFile:
+    """
+    Layout of binary position files: a header followed by fixed-width records, so record N starts at a known offset.
+
+    Every record holds the 64 cells as 4 bit piece codes (two cells per byte, in the order of
+    :py:meth:`hash <board.BoardBase.hash>`), a flags byte (side to move, whether a score is present) and a score.
+    """
+    MAGIC = b"MCPF"
+    VERSION = 1
+    HEADER = Struct("<4sHH")
+    RECORD = Struct("<32sB7xd")
+
+    @classmethod
+    def encode(cls, position, score=None):
+        """
+        Packs a position into a record
+
+        :param position: The :py:class:`Position` to pack
+        :param score: Optional score to store with the position
+        :return: The record as bytes
+        """
+        codes = position.cells.translate(ENCODE_TABLE)
+        cells = bytes(high << 4 | low for high, low in zip(codes[0::2], codes[1::2]))
+        flags = (WHITE_TO_MOVE if position.white else 0) | (HAS_SCORE if score is not None else 0)
+        return cls.RECORD.pack(cells, flags, math.nan if score is None else score)
+
+    @classmethod
+    def decode(cls, record):
+        """
+        Unpacks a record
+
+        :param record: The record, any bytes-like object of :py:attr:`RECORD` size
+        :return: Tuple (position, score), score is None if the record holds none
+        """
+        cells, flags, score = cls.RECORD.unpack(record)
+        text = bytearray(64)
+        text[0::2] = (code >> 4 for code in cells)
+        text[1::2] = (code & 15 for code in cells)
+        position = Position(bytes(text.translate(DECODE_CHARACTERS)), bool(flags & WHITE_TO_MOVE))
+        return position, score if flags & HAS_SCORE else None
+
+
+class PositionWriter:
+    """
+    Appends positions to a binary position file. Records are collected in memory and written in batches.
+    Use it as a context manager, or call :py:meth:`close` to write the last batch.
+    """
+    def __init__(self, path, batch_size=4096):
+        """
+        Constructor. Opens the file for appending, a new file starts with the header.
+
+        :param path: The file to write to
+        :param batch_size: Number of records collected before they are written to the file
+        """
+        self.file = open(path, "ab")
+        self.batch_size = batch_size
+        self.batch = []
+        self.count = 0
+
+        if self.file.tell() == 0:
+            self.file.write(PositionFile.HEADER.pack(PositionFile.MAGIC, PositionFile.VERSION, PositionFile.RECORD.size))
+
+    def write(self, position, score=None):
+        """
+        Appends a position
+
+        :param position: The :py:class:`Position` or a :py:class:`board.Board` (its side to move is stored)
+        :param score: Optional score to store with the position
+        """
+        if not isinstance(position, Position):
+            position = Position.from_board(position)
+
+        self.batch.append(PositionFile.encode(position, score))
+        self.count += 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all collected records to the file
+        """
+        self.file.write(b"".join(self.batch))
+        self.batch.clear()
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PositionReader:
+    """
+    Reads a binary position file through a memory map, so only the records actually accessed are loaded from disk.
+    Records are accessed by index like a list; :py:meth:`record` returns a view into the map without copying.
+    """
+    def __init__(self, path):
+        """
+        Constructor. Maps the file into memory and verifies its header.
+
+        :param path: The file to read
+        :raises ValueError: If the file is not a binary position file of this version
+        """
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.view = memoryview(self.map)
+
+        if size < PositionFile.HEADER.size:
+            self.close()
+            raise ValueError(f"{path} is not a position file")
+
+        magic, version, record_size = PositionFile.HEADER.unpack_from(self.view)
+        if magic != PositionFile.MAGIC or version != PositionFile.VERSION or record_size != PositionFile.RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not a position file of version {PositionFile.VERSION}")
+
+        # A partially written last record is ignored
+        self.count = (size - PositionFile.HEADER.size) // PositionFile.RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index):
+        """
+        Returns record *index* as a memoryview into the file, without copying.
+        The view stays valid as long as it is referenced, also after the reader was closed: the map is only released
+        once the last view is gone. Copy the record with bytes() to keep it without holding on to the map.
+        """
+        if not 0 <= index < self.count:
+            raise IndexError(f"record {index} out of range")
+
+        offset = PositionFile.HEADER.size + index * PositionFile.RECORD.size
+        return self.view[offset:offset + PositionFile.RECORD.size]
+
+    def __getitem__(self, index):
+        """
+        Returns record *index* decoded into a tuple (position, score)
+        """
+        if index < 0:
+            index += self.count
+
+        return PositionFile.decode(self.record(index))
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield PositionFile.decode(self.record(index))
+
+    def board(self, index, board=None):
+        """
+        Decodes record *index* straight into a board, without the intermediate :py:class:`Position`.
+
+        :param index: The record to decode
+        :param board: The board to reuse. All pieces currently placed on it are removed. If None, a new board is created.
+        :return: The board holding the position, its side to move is set from the record
+        """
+        if board is None:
+            board = Board()
+
+        cells, flags, _ = PositionFile.RECORD.unpack(self.record(index))
+        codes = bytearray(64)
+        codes[0::2] = (code >> 4 for code in cells)
+        codes[1::2] = (code & 15 for code in cells)
+        rows = [[None] * 8 for _ in range(8)]
+
+        # Place the pieces directly, as Board.load_fen does
+        for offset, code in enumerate(codes):
+            if code:
+                pieceClass, white = DECODE_TABLE[code]
+                row, col = 7 - (offset >> 3), offset & 7
+                piece = pieceClass(board, white)
+                piece.cell = (row, col)
+                rows[row][col] = piece
+
+        board.cells = rows
+        board.rehash()
+        board.reset_game_state()
+        board.white_to_move = bool(flags & WHITE_TO_MOVE)
+        return board
+
+    def close(self):
+        """
+        Unmaps and closes the file. If views returned by :py:meth:`record` are still referenced, the map is left to
+        the garbage collector, which releases it once the last of them is gone.
+        """
+        if self.file.closed:
+            return
+
+        try:
+            self.view.release()
+            if isinstance(self.map, mmap.mmap):
+                self.map.close()
+        except BufferError:
+            pass
+        finally:
+            self.view = self.map = None
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,137 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import engine
+from board import BoardBase, Board
+from cache import HashTable
+from pieces import Pawn, Rook, Bishop, Queen, King, Knight
+
+
+# Environment variable holding the directory profiles are written to. Profiling is off if it is not set.
+PROFILE_ENV = "MCHESS_PROFILE"
+
+
+class SectionTimer:
+    """
+    Measures the time spent in named sections of the engine.
+
+    Sections may call each other (e.g. the legality check generates moves of the opposing pieces).
+    The time of a nested section is only counted for the innermost section, so the totals add up to the search time.
+    Only the thread that created the timer is measured, calls from other threads (e.g. a background search or a
+    Ponderer) run the original functions.
+    """
+    def __init__(self):
+        self.totals = {}
+        self.calls = {}
+        self.stack = []
+        self.thread = threading.get_ident()
+
+    def wrap(self, name, function):
+        """
+        Returns a wrapper of the function that counts its time towards the given section
+        """
+        self.totals.setdefault(name, 0.0)
+        self.calls.setdefault(name, 0)
+
+        def timed(*args, **kwargs):
+            if threading.get_ident() != self.thread:
+                return function(*args, **kwargs)
+
+            self.stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = self.stack.pop()
+                self.totals[name] += elapsed - nested
+                self.calls[name] += 1
+                if self.stack:
+                    self.stack[-1] += elapsed
+
+        return timed
+
+    def to_dict(self):
+        return {name: {"seconds": self.totals[name], "calls": self.calls[name]} for name in self.totals}
+
+
+def instrumented_functions():
+    """
+    Returns the functions to time as list of (section name, owner, attribute name)
+    """
+    functions = [("move_generation", pieceClass, "get_reachable_cells") for pieceClass in [Pawn, Rook, Knight, Bishop, Queen, King]]
+    functions += [
+        ("legality_check", BoardBase, "is_king_check_cached"),
+        ("evaluation", Board, "evaluate"),
+        ("hashing", BoardBase, "hash"),
+        ("cache_access", HashTable, "get"),
+        ("cache_access", HashTable, "put"),
+        ("cache_access", engine, "minMax_cached"),
+        ("search", engine, "minMax"),
+    ]
+    return functions
+
+
+# Held while the hot paths are replaced, so profiles of searches in different threads are taken one after the other
+# and every context restores the functions it found
+instrument_lock = threading.Lock()
+
+
+@contextmanager
+def instrument(timer):
+    """
+    Replaces the engine hot paths with timed wrappers while the context is active.
+    Nothing is replaced outside of the context, so there is no cost at all when profiling is off.
+    """
+    with instrument_lock:
+        originals = []
+        for name, owner, attribute in instrumented_functions():
+            original = owner.__dict__[attribute]
+            originals.append((owner, attribute, original))
+            setattr(owner, attribute, timer.wrap(name, original))
+
+        try:
+            yield timer
+        finally:
+            for owner, attribute, original in reversed(originals):
+                setattr(owner, attribute, original)
+
+
+def profile_directory(minMaxArg):
+    """
+    Returns the directory to write the profile of a search to, or None if profiling is off
+    """
+    return minMaxArg.profile or os.environ.get(PROFILE_ENV)
+
+
+searches = 0
+
+
+@contextmanager
+def profile_search(directory):
+    """
+    Profiles the search inside the context with cProfile and the section timer. Writes a .pstats file
+    (readable with pstats, snakeviz or flameprof) and a .sections.json file per search into the directory.
+    """
+    global searches
+    searches += 1
+
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"search-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{searches}")
+
+    timer = SectionTimer()
+    profiler = cProfile.Profile()
+
+    with instrument(timer):
+        profiler.enable()
+        try:
+            yield timer
+        finally:
+            profiler.disable()
+
+    profiler.dump_stats(base + ".pstats")
+    with open(base + ".sections.json", "wt") as f:
+        json.dump(timer.to_dict(), f, indent=2)
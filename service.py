@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import engine
+from board import Board, START_FEN
+from engine import MinMaxArg, SearchCancelled, suggest_move
+from position import Position
+from util import cell_to_string
+
+
+# Deepest search a client may request, the search has no pruning and deeper searches take minutes
+MAX_DEPTH = 4
+
+# The check cache of a worker's board is cleared once it holds more entries
+CHECK_CACHE_LIMIT = 100000
+
+# Board reused by every request a worker process analyses
+worker_board = None
+
+
+class Busy(Exception):
+    """
+    Raised if the service can not accept another request because its queue is full
+    """
+
+
+class BadRequest(ValueError):
+    """
+    Raised for malformed requests
+    """
+
+
+def parse_request(request):
+    """
+    Validates an analysis request {"fen": FEN, "depth": N, "nodes": N}, only "fen" is required.
+
+    :return: Tuple (key, normalized request). Requests with the same key have the same result.
+    :raises BadRequest: If the request is malformed
+    """
+    if not isinstance(request, dict) or not isinstance(request.get("fen"), str):
+        raise BadRequest("request must be an object with a \"fen\" string")
+
+    try:
+        board = Board.from_fen(request["fen"])
+    except ValueError as error:
+        raise BadRequest(str(error)) from None
+
+    depth = request.get("depth", engine.DEPTH)
+    nodes = request.get("nodes")
+    if not isinstance(depth, int) or not 1 <= depth <= MAX_DEPTH:
+        raise BadRequest(f"depth must be between 1 and {MAX_DEPTH}")
+    if nodes is not None and (not isinstance(nodes, int) or nodes < 1):
+        raise BadRequest("nodes must be a positive integer")
+
+    # Move counters do not change the result, so they are not part of the key
+    key = (Position.from_board(board).key, depth, nodes)
+    return key, {"fen": board.to_fen(), "depth": depth, "nodes": nodes}
+
+
+def analyse_batch(requests):
+    """
+    Searches a batch of normalized requests. Runs in the worker processes, which keep their caches between batches:
+    the search results go to the shared transposition table of the pool (see :py:func:`engine.get_executor`),
+    the static evaluations to the fixed-size :py:data:`engine.static_eval_cache`.
+
+    :return: List of result dictionaries in the order of the requests
+    """
+    global worker_board
+
+    if worker_board is None:
+        worker_board = Board()
+
+    return [analyse_request(worker_board, request) for request in requests]
+
+
+def analyse_request(board, request):
+    """
+    Searches one request. With a node limit, the depths up to the requested one are searched in turn and the result of
+    the deepest search finished within the limit is returned.
+    """
+    if len(board.check_cache) > CHECK_CACHE_LIMIT:
+        board.check_cache.clear()
+
+    board.load_fen(request["fen"])
+    depths = range(1, request["depth"] + 1) if request["nodes"] is not None else [request["depth"]]
+    result = {"fen": request["fen"], "move": None, "score": None, "depth": 0, "nodes": 0}
+    start = time.perf_counter()
+
+    for depth in depths:
+        try:
+            move = suggest_move(board, minMaxArg=MinMaxArg(depth, board.white_to_move, max_nodes=request["nodes"]))
+        except SearchCancelled:
+            break
+
+        result["move"] = cell_to_string(move.piece.cell) + cell_to_string(move.cell) if move.piece is not None else None
+        result["score"] = move.score
+        result["depth"] = depth
+        result["nodes"] += move.stats.nodes
+
+    result["time"] = time.perf_counter() - start
+    return result
+
+
+class AnalysisService:
+    """
+    Answers analysis requests from a pool of warm worker processes.
+
+    Identical requests that are queued or running at the same time are searched only once. Requests are collected
+    into batches of up to batch_size positions (waiting at most batch_delay seconds for more), so a worker gets several
+    positions per round trip. At most two batches per worker are in flight; while they are, requests pile up in a
+    queue of max_pending entries and, once it is full, new requests are rejected with :py:class:`Busy`.
+    """
+    def __init__(self, workers=None, batch_size=16, batch_delay=0.002, max_pending=256):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.queue = None
+        self.pending = {}
+        self.slots = None
+        self.tasks = set()
+        self.counters = {"requests": 0, "deduplicated": 0, "rejected": 0, "errors": 0, "batches": 0, "searched": 0}
+
+    async def start(self):
+        """
+        Starts the worker processes and the batching task
+        """
+        self.queue = asyncio.Queue(self.max_pending)
+        self.slots = asyncio.Semaphore(2 * self.workers)
+        self.executor = engine.get_executor(self.workers)
+
+        # Warm up every worker, so the first requests do not pay for starting the processes
+        warmup = {"fen": START_FEN, "depth": 1, "nodes": None}
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, analyse_batch, [warmup]) for _ in range(self.workers)))
+
+        self.batcher = asyncio.create_task(self.collect_batches())
+
+    async def stop(self):
+        self.batcher.cancel()
+        await asyncio.gather(self.batcher, *self.tasks, return_exceptions=True)
+
+    async def analyse(self, request):
+        """
+        Analyses one request
+
+        :return: The result dictionary
+        :raises BadRequest: If the request is malformed
+        :raises Busy: If the queue is full
+        """
+        self.counters["requests"] += 1
+        key, request = parse_request(request)
+
+        future = self.pending.get(key)
+        if future is not None:
+            self.counters["deduplicated"] += 1
+            return await asyncio.shield(future)
+
+        if self.queue.full():
+            self.counters["rejected"] += 1
+            raise Busy()
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        self.queue.put_nowait((key, request))
+        return await asyncio.shield(future)
+
+    async def collect_batches(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_delay
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Wait for a free worker, meanwhile new requests stay in the queue
+            await self.slots.acquire()
+            task = asyncio.create_task(self.run_batch(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, batch):
+        self.counters["batches"] += 1
+        self.counters["searched"] += len(batch)
+
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, analyse_batch, [request for _, request in batch])
+        except Exception as exception:
+            self.counters["errors"] += 1
+            for key, _ in batch:
+                self.pending.pop(key).set_exception(exception)
+        else:
+            for (key, _), result in zip(batch, results):
+                self.pending.pop(key).set_result(result)
+        finally:
+            self.slots.release()
+
+    def stats(self):
+        counters = dict(self.counters)
+        counters["queued"] = self.queue.qsize()
+        counters["workers"] = self.workers
+        counters["batch_size"] = counters["searched"] / counters["batches"] if counters["batches"] else 0.0
+        return counters
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves one HTTP/1.1 connection: "POST /analyse" with a request object (or a list of them) and "GET /stats"
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                method, path, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self.route(method, path, body)
+
+                data = json.dumps(payload).encode("utf-8")
+                close = headers.get("connection", "").lower() == "close"
+                lines = [f"HTTP/1.1 {status}", "Content-Type: application/json", f"Content-Length: {len(data)}",
+                         "Connection: close" if close else "Connection: keep-alive"]
+                if status.startswith("503"):
+                    lines.append("Retry-After: 1")
+
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        """
+        Answers one HTTP request
+
+        :return: Tuple (status line, JSON payload)
+        """
+        if method == "GET" and path == "/stats":
+            return "200 OK", self.stats()
+
+        if method != "POST" or path != "/analyse":
+            return "404 Not Found", {"error": "use POST /analyse or GET /stats"}
+
+        try:
+            request = json.loads(body)
+            if isinstance(request, list):
+                return "200 OK", list(await asyncio.gather(*(self.analyse(item) for item in request)))
+            return "200 OK", await self.analyse(request)
+        except (BadRequest, json.JSONDecodeError) as error:
+            return "400 Bad Request", {"error": str(error)}
+        except Busy:
+            return "503 Service Unavailable", {"error": "too many pending requests"}
+
+
+async def serve(service, host="127.0.0.1", port=8765, unix=None):
+    await service.start()
+
+    if unix is not None:
+        server = await asyncio.start_unix_server(service.handle_connection, unix)
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+
+    print(f"Serving on {unix or '%s:%d' % (host, port)} with {service.workers} workers", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+async def load_test(host, port, unix, requests, connections, fens, depth):
+    """
+    Sends requests over several keep-alive connections and measures the latency of every request
+
+    :return: Dictionary with the request rate, latency percentiles and the number of answers per status code
+    """
+    latencies = []
+    statuses = {}
+    counter = iter(range(requests))
+
+    async def client():
+        if unix is not None:
+            reader, writer = await asyncio.open_unix_connection(unix)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+
+        for index in counter:
+            body = json.dumps({"fen": fens[index % len(fens)], "depth": depth}).encode("utf-8")
+            start = time.perf_counter()
+            writer.write(f"POST /analyse HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+
+            status = (await reader.readline()).decode("latin-1").split(" ")[1]
+            length = 0
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b""):
+                    break
+                if header.lower().startswith(b"content-length:"):
+                    length = int(header.split(b":")[1])
+            await reader.readexactly(length)
+
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "requests_per_second": len(latencies) / elapsed,
+        "latency_p50": statistics.median(latencies),
+        "latency_p99": latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))],
+        "statuses": statuses,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local JSON analysis service with a pool of warm engine workers.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on / connect to (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on / connect to (default: 8765)")
+    parser.add_argument("--unix", help="use this Unix socket instead of TCP")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="run the service")
+    serve_parser.add_argument("-w", "--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    serve_parser.add_argument("--batch-size", type=int, default=16, help="positions per batch (default: 16)")
+    serve_parser.add_argument("--batch-delay", type=float, default=2.0, help="milliseconds to wait for a batch to fill (default: 2)")
+    serve_parser.add_argument("--max-pending", type=int, default=256, help="queued requests before new ones are rejected (default: 256)")
+
+    test_parser = commands.add_parser("loadtest", help="send requests to a running service and report the throughput")
+    test_parser.add_argument("-n", "--requests", type=int, default=1000, help="number of requests (default: 1000)")
+    test_parser.add_argument("-c", "--connections", type=int, default=32, help="concurrent connections (default: 32)")
+    test_parser.add_argument("-d", "--depth", type=int, default=2, help="search depth (default: 2)")
+    test_parser.add_argument("--fens", help="file with one FEN per line (default: the start position)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        service = AnalysisService(args.workers, args.batch_size, args.batch_delay / 1000.0, args.max_pending)
+        try:
+            asyncio.run(serve(service, args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    fens = [START_FEN]
+    if args.fens:
+        with open(args.fens, "rt") as f:
+            fens = [line.strip() for line in f if line.strip()]
+
+    report = asyncio.run(load_test(args.host, args.port, args.unix, args.requests, args.connections, fens, args.depth))
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
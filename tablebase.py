@@ -0,0 +1,413 @@
+import argparse
+import mmap
+import os
+import sys
+import time
+from struct import Struct
+import numpy as np
+from board import Board
+from pieces import Pawn, Rook, Queen, King
+from util import cell_to_string
+
+
+# Material sets with tables, generated in this order since KPK promotes into KQK and KRK.
+# The first letter after the strong king is the only other piece, the weak side has its king only.
+MATERIALS = ("KQK", "KRK", "KPK")
+
+# Most pieces on a board that can be looked up
+MAX_PIECES = 3
+
+# Environment variable naming the directory with the table files to load at startup, see engine.enable_tablebases
+TABLEBASE_ENV = "MCHESS_TABLEBASES"
+
+# Score of a won position, reduced by the number of plies to mate so the shortest mate is preferred
+TABLEBASE_WIN = 50000.0
+
+# Number of positions of one side to move: strong king, strong piece and weak king on any of the 64 squares
+SIZE = 64 ** 3
+
+# Piece letters of the tables by piece class, a pawn on its last row is looked up as the queen it becomes
+TABLE_PIECES = {Queen: "Q", Rook: "R", Pawn: "P"}
+
+KING_STEPS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+SLIDER_STEPS = {"Q": KING_STEPS, "R": ((-1, 0), (0, -1), (0, 1), (1, 0))}
+
+
+class TablebaseFile:
+    """
+    Layout of tablebase files: a header followed by one byte per position.
+
+    Position *index* is side to move * SIZE + strong king square * 4096 + strong piece square * 64 + weak king square,
+    squares counted as row * 8 + col from the strong side's point of view (side to move 0 is the strong side).
+    A byte holds the number of plies to mate plus one, or 0 for draws and illegal positions. An odd number of plies
+    to mate means the side to move wins, an even number that it is mated.
+    """
+    MAGIC = b"MCTB"
+    VERSION = 1
+    HEADER = Struct("<4sH3sx")
+
+
+def table_path(directory, material):
+    return os.path.join(directory, material + ".mctb")
+
+
+def line_tables():
+    """
+    Returns the square relations the generator needs as 64x64 arrays: whether two squares are adjacent, on a common
+    rank or file, on a common diagonal, and the squares strictly between them as bit mask
+    """
+    adjacent = np.zeros((64, 64), bool)
+    straight = np.zeros((64, 64), bool)
+    diagonal = np.zeros((64, 64), bool)
+    between = np.zeros((64, 64), np.uint64)
+
+    for a in range(64):
+        for b in range(64):
+            rowA, colA, rowB, colB = a >> 3, a & 7, b >> 3, b & 7
+            dr, dc = rowB - rowA, colB - colA
+            if a == b:
+                continue
+
+            adjacent[a, b] = max(abs(dr), abs(dc)) == 1
+            straight[a, b] = dr == 0 or dc == 0
+            diagonal[a, b] = abs(dr) == abs(dc)
+            if straight[a, b] or diagonal[a, b]:
+                stepRow, stepCol = (dr > 0) - (dr < 0), (dc > 0) - (dc < 0)
+                mask = 0
+                for k in range(1, max(abs(dr), abs(dc))):
+                    mask |= 1 << ((rowA + k * stepRow) * 8 + colA + k * stepCol)
+                between[a, b] = mask
+
+    return adjacent, straight, diagonal, between
+
+
+def generate(material, tables=None):
+    """
+    Computes the table of a material set by retrograde analysis.
+
+    All positions are generated at once and their moves collected as edges between position numbers. Starting from
+    the mates, positions are then resolved ply by ply: a position wins in n plies if a move leads to a position lost in
+    n - 1 plies, and it is lost in n plies once all its moves lead to won positions, the longest win taking n - 1 plies.
+    Positions never resolved are draws.
+
+    :param material: One of :py:data:`MATERIALS`
+    :param tables: Dictionary of the tables generated before, KPK needs KQK and KRK for the promotions
+    :return: The table as uint8 array of 2 * SIZE entries, see :py:class:`TablebaseFile`
+    """
+    kind = material[1]
+    adjacent, straight, diagonal, between = line_tables()
+    index = np.arange(SIZE)
+    king, piece, other = index >> 12, (index >> 6) & 63, index & 63
+    pieceRow, pieceCol = piece >> 3, piece & 7
+
+    # The strong piece attacks the weak king, the strong king may block the line
+    blocked = ((between[piece, other] >> king.astype(np.uint64)) & np.uint64(1)).astype(bool)
+    if kind == "Q":
+        check = (straight[piece, other] | diagonal[piece, other]) & ~blocked
+    elif kind == "R":
+        check = straight[piece, other] & ~blocked
+    else:
+        check = (other == piece + 9) & (pieceCol < 7) | (other == piece + 7) & (pieceCol > 0)
+
+    legal = (king != piece) & (king != other) & (piece != other) & ~adjacent[king, other]
+    if kind == "P":
+        legal &= (pieceRow > 0) & (pieceRow < 7)
+
+    # The weak king may not be in check while the strong side is to move
+    legalStrong = legal & ~check
+    legalWeak = legal
+
+    draw = 2 * SIZE
+    external = {}
+    offset = draw + 1
+    for promotion in ("Q", "R") if kind == "P" else ():
+        external[promotion] = offset
+        offset += 2 * SIZE
+
+    sources, targets = [], []
+
+    def add(mask, target):
+        sources.append(index[mask])
+        targets.append(target[mask])
+
+    # Moves of the strong king
+    for dr, dc in KING_STEPS:
+        row, col = (king >> 3) + dr, (king & 7) + dc
+        to = row * 8 + col
+        mask = legalStrong & (row >= 0) & (row < 8) & (col >= 0) & (col < 8) & (to != piece)
+        moved = np.where(mask, to, 0) * 4096 + piece * 64 + other
+        add(mask & legalWeak[moved], SIZE + moved)
+
+    # Moves of the strong piece, it never captures since the weak side has nothing but its king
+    if kind == "P":
+        push = piece + 8
+        open = legalStrong & (push != king) & (push != other)
+        promotes = open & (pieceRow == 6)
+        add(open & ~promotes, SIZE + king * 4096 + push * 64 + other)
+        for promotion, start in external.items():
+            add(promotes, start + SIZE + king * 4096 + push * 64 + other)
+
+        double = piece + 16
+        add(open & (pieceRow == 1) & (double != king) & (double != other), SIZE + king * 4096 + double * 64 + other)
+    else:
+        for dr, dc in SLIDER_STEPS[kind]:
+            open = legalStrong
+            for k in range(1, 8):
+                row, col = pieceRow + k * dr, pieceCol + k * dc
+                to = row * 8 + col
+                open = open & (row >= 0) & (row < 8) & (col >= 0) & (col < 8) & (to != king) & (to != other)
+                if not open.any():
+                    break
+                add(open, SIZE + king * 4096 + np.where(open, to, 0) * 64 + other)
+
+    # Moves of the weak king, capturing the strong piece leaves two kings, a draw
+    for dr, dc in KING_STEPS:
+        row, col = (other >> 3) + dr, (other & 7) + dc
+        to = np.where((row >= 0) & (row < 8) & (col >= 0) & (col < 8), row * 8 + col, 0)
+        mask = legalWeak & (row >= 0) & (row < 8) & (col >= 0) & (col < 8) & ~adjacent[king, to]
+        captures = mask & (to == piece)
+        moved = king * 4096 + piece * 64 + to
+        sources.append(SIZE + index[captures])
+        targets.append(np.full(np.count_nonzero(captures), draw))
+        mask &= ~captures & legalStrong[moved]
+        sources.append(SIZE + index[mask])
+        targets.append(moved[mask])
+
+    source, target = np.concatenate(sources), np.concatenate(targets)
+
+    # Plies to mate of every position, -1 while unresolved and -2 for draws and illegal positions
+    plies = np.full(offset, -1, np.int16)
+    plies[draw] = -2
+    plies[:SIZE][~legalStrong] = -2
+    plies[SIZE:draw][~legalWeak] = -2
+    for promotion, start in external.items():
+        values = tables[material.replace("P", promotion)].astype(np.int16)
+        plies[start:start + 2 * SIZE] = np.where(values > 0, values - 1, -2)
+
+    # Without moves the weak side is mated if in check, any other side is stalemated
+    remaining = np.bincount(source, minlength=draw)
+    stuck = (remaining == 0) & (plies[:draw] == -1)
+    mated = stuck.copy()
+    mated[:SIZE] = False
+    mated[SIZE:] &= check
+    plies[:draw][stuck] = -2
+    plies[:draw][mated] = 0
+
+    n = 1
+    while n - 1 <= plies.max():
+        reached = source[plies[target] == n - 1]
+        if n % 2 == 1:
+            # A move into a lost position wins
+            reached = reached[plies[reached] == -1]
+            plies[reached] = n
+        else:
+            # All moves lead into won positions
+            remaining -= np.bincount(reached, minlength=draw)
+            plies[:draw][(remaining == 0) & (plies[:draw] == -1)] = n
+        n += 1
+
+    plies = plies[:draw]
+    return np.where(plies >= 0, plies + 1, 0).astype(np.uint8)
+
+
+def write_table(path, material, table):
+    """
+    Writes a table file, the file is replaced atomically
+    """
+    with open(path + ".tmp", "wb") as f:
+        f.write(TablebaseFile.HEADER.pack(TablebaseFile.MAGIC, TablebaseFile.VERSION, material.encode("ascii")))
+        f.write(table.tobytes())
+    os.replace(path + ".tmp", path)
+
+
+def generate_all(directory, materials=MATERIALS, on_table=None):
+    """
+    Generates the tables of the given material sets into a directory, tables a set depends on are generated as well
+
+    :param on_table: Called with the material and the seconds it took after every table
+    """
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+
+    needed = set(materials)
+    if "KPK" in needed:
+        needed.update(("KQK", "KRK"))
+
+    for material in MATERIALS:
+        if material not in needed:
+            continue
+
+        start = time.perf_counter()
+        tables[material] = generate(material, tables)
+        write_table(table_path(directory, material), material, tables[material])
+        if on_table is not None:
+            on_table(material, time.perf_counter() - start)
+
+
+class Tablebases:
+    """
+    Looks up positions in the table files of a directory. The files are memory-mapped when first needed,
+    so a probe only loads the page holding its byte from disk.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        self.files = []
+
+    def table(self, material):
+        """
+        Returns the mapped table of a material set or None if there is no file for it
+        """
+        if material in self.tables:
+            return self.tables[material]
+
+        table = None
+        path = table_path(self.directory, material)
+        if os.path.exists(path):
+            f = open(path, "rb")
+            table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.files.append(f)
+
+            magic, version, name = TablebaseFile.HEADER.unpack_from(table)
+            if (magic, version, name) != (TablebaseFile.MAGIC, TablebaseFile.VERSION, material.encode("ascii")) \
+                    or len(table) != TablebaseFile.HEADER.size + 2 * SIZE:
+                raise ValueError(f"{path} is not a {material} table of version {TablebaseFile.VERSION}")
+
+        self.tables[material] = table
+        return table
+
+    def materials(self):
+        """
+        Returns the material sets that have a table file in the directory
+        """
+        return [material for material in MATERIALS if os.path.exists(table_path(self.directory, material))]
+
+    def probe(self, board, white):
+        """
+        Looks up the position on the board
+
+        :param board: The board, it may hold at most MAX_PIECES pieces
+        :param white: True if WHITE is to move
+        :return: The score from WHITE's perspective (0 for draws, about TABLEBASE_WIN for wins), or None if the
+                 material is not covered
+        """
+        kings = {}
+        strong = None
+        for row in board.cells:
+            for piece in row:
+                if piece is None:
+                    continue
+                if isinstance(piece, King):
+                    kings[piece.white] = piece
+                elif strong is not None:
+                    return None
+                else:
+                    strong = piece
+
+        if len(kings) != 2:
+            return None
+
+        # Two kings, or a king with a knight or bishop against a king, can never mate
+        if strong is None or strong.__class__ not in TABLE_PIECES:
+            return 0.0
+
+        # The tables are stored with the strong side as WHITE, mirror the rows otherwise
+        flip = 0 if strong.white else 7
+        kind = TABLE_PIECES[strong.__class__]
+        pieceRow = int(strong.cell[0]) ^ flip
+        if kind == "P" and pieceRow == 7:
+            kind = "Q"
+        elif kind == "P" and pieceRow == 0:
+            return None
+
+        table = self.table("K" + kind + "K")
+        if table is None:
+            return None
+
+        def square(piece):
+            return (int(piece.cell[0]) ^ flip) * 8 + int(piece.cell[1])
+
+        strongToMove = white == strong.white
+        index = (0 if strongToMove else SIZE) + square(kings[strong.white]) * 4096 + square(strong) * 64 + square(kings[not strong.white])
+        value = table[TablebaseFile.HEADER.size + index]
+        if value == 0:
+            return 0.0
+
+        plies = value - 1
+        score = TABLEBASE_WIN - plies if plies % 2 == 1 else plies - TABLEBASE_WIN
+        return score if white else -score
+
+    def probe_move(self, board, white):
+        """
+        Finds the best move by looking up the position after every legal move
+
+        :param board: The board, it may hold at most MAX_PIECES pieces
+        :param white: True if WHITE is to move
+        :return: Tuple (piece, target cell, score) with the score from WHITE's perspective, or None if the material
+                 is not covered or there is no legal move
+        """
+        best = None
+        for piece in list(board.iterate_cells_with_pieces(white)):
+            origin = piece.cell
+            for cell in piece.get_valid_cells():
+                captured = board.get_cell(cell)
+                board.set_cell(cell, piece)
+                try:
+                    score = self.probe(board, not white)
+                finally:
+                    board.set_cell(origin, piece)
+                    board.set_cell(cell, captured)
+
+                if score is None:
+                    return None
+                if best is None or (score > best[2] if white else score < best[2]):
+                    best = (piece, cell, score)
+
+        return best
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        for f in self.files:
+            f.close()
+        self.tables.clear()
+        self.files.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates and probes endgame tablebases.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("generate", help="generate the table files")
+    build.add_argument("directory", help="directory to write the tables to")
+    build.add_argument("materials", nargs="*", default=list(MATERIALS), help=f"material sets (default: {' '.join(MATERIALS)})")
+
+    probe = commands.add_parser("probe", help="look up a position and its best move")
+    probe.add_argument("directory", help="directory with the tables")
+    probe.add_argument("fen", nargs="+", help="the position")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        unknown = set(args.materials) - set(MATERIALS)
+        if unknown:
+            parser.error(f"unknown material {', '.join(sorted(unknown))}, expected one of {', '.join(MATERIALS)}")
+
+        generate_all(args.directory, args.materials, lambda material, seconds: print(f"{material} generated in {seconds:.1f}s", file=sys.stderr))
+        return 0
+
+    board = Board.from_fen(" ".join(args.fen))
+    tablebases = Tablebases(args.directory)
+    score = tablebases.probe(board, board.white_to_move)
+    if score is None:
+        print("position not covered by the tables", file=sys.stderr)
+        return 1
+
+    best = tablebases.probe_move(board, board.white_to_move)
+    move = f", best move {cell_to_string(best[0].cell)}{cell_to_string(best[1])}" if best is not None else ""
+    print(f"score {score:+.0f}{move}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+import argparse
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
+
+
+# Environment variable holding the file telemetry is appended to. Telemetry is off if it is not set.
+TELEMETRY_ENV = "MCHESS_TELEMETRY"
+
+
+class TelemetryWriter:
+    """
+    Appends one JSON line per record to a file.
+
+    Records are handed to a background thread, which writes them in batches. Recording a search therefore
+    only costs putting a dictionary into a queue and never waits for the disk.
+    """
+    def __init__(self, path, flush_interval=1.0):
+        """
+        Constructor. Starts the background thread.
+
+        :param path: File to append the JSON lines to
+        :param flush_interval: Maximum number of seconds a record waits before it is written
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def record(self, data):
+        """
+        Queues a record (dictionary) for writing
+        """
+        if not self.closed:
+            self.queue.put(data)
+
+    def run(self):
+        with open(self.path, "at") as f:
+            running = True
+            while running:
+                # Wait for the first record, then collect everything that arrives until the next flush
+                batch = [self.queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while batch[-1] is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(self.queue.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+
+                if batch[-1] is None:
+                    running = False
+                    batch.pop()
+
+                f.write("".join(json.dumps(data) + "\n" for data in batch))
+                f.flush()
+
+    def close(self):
+        """
+        Writes all queued records and stops the background thread
+        """
+        if self.closed:
+            return
+
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+
+def read_records(path):
+    with open(path, "rt") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def quantile(values, q):
+    """
+    Returns the q-quantile (0.0 to 1.0) of a sorted list, using the nearest rank
+    """
+    index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[index]
+
+
+def to_prometheus(records):
+    """
+    Aggregates telemetry records into the Prometheus text exposition format
+    """
+    times = []
+    nodes = 0
+    depth = 0
+    cache_entries = 0
+    eval_cache_occupancy = 0.0
+    hits = 0
+    probes = 0
+
+    for data in records:
+        times.append(data["time"])
+        nodes += data["nodes"]
+        depth = data["depth"]
+        cache_entries = data["cache_entries"]
+        eval_cache_occupancy = data["eval_cache_occupancy"]
+        hits += data["cache_hits"]
+        probes += data["cache_probes"]
+
+    times.sort()
+    total = sum(times)
+
+    lines = [
+        "# HELP mchess_moves_total Number of moves searched by the engine.",
+        "# TYPE mchess_moves_total counter",
+        f"mchess_moves_total {len(times)}",
+        "# HELP mchess_move_seconds Time spent searching a move.",
+        "# TYPE mchess_move_seconds summary",
+    ]
+    if times:
+        for q in [0.5, 0.9, 0.99]:
+            lines.append(f'mchess_move_seconds{{quantile="{q}"}} {quantile(times, q)}')
+    lines += [
+        f"mchess_move_seconds_sum {total}",
+        f"mchess_move_seconds_count {len(times)}",
+        "# HELP mchess_nodes_total Number of nodes searched by the engine.",
+        "# TYPE mchess_nodes_total counter",
+        f"mchess_nodes_total {nodes}",
+        "# HELP mchess_nodes_per_second Average search speed.",
+        "# TYPE mchess_nodes_per_second gauge",
+        f"mchess_nodes_per_second {nodes / total if total > 0 else 0.0}",
+        "# HELP mchess_cache_hit_ratio Fraction of cache probes answered from the cache.",
+        "# TYPE mchess_cache_hit_ratio gauge",
+        f"mchess_cache_hit_ratio {hits / probes if probes > 0 else 0.0}",
+        "# HELP mchess_search_depth Depth of the most recent search.",
+        "# TYPE mchess_search_depth gauge",
+        f"mchess_search_depth {depth}",
+        "# HELP mchess_cache_entries Entries in the search cache after the most recent search.",
+        "# TYPE mchess_cache_entries gauge",
+        f"mchess_cache_entries {cache_entries}",
+        "# HELP mchess_eval_cache_occupancy Fraction of used evaluation cache slots after the most recent search.",
+        "# TYPE mchess_eval_cache_occupancy gauge",
+        f"mchess_eval_cache_occupancy {eval_cache_occupancy}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exports engine telemetry (JSON lines) in Prometheus text format.")
+    parser.add_argument("file", help="telemetry file written by the engine")
+    parser.add_argument("-o", "--output", help="write to this file instead of stdout (e.g. for the node exporter textfile collector)")
+    args = parser.parse_args(argv)
+
+    text = to_prometheus(read_records(args.file))
+
+    if args.output:
+        with open(args.output, "wt") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,39 @@
 import unittest
+import unittest.mock
 import json
+import pickle
+import os
+import tempfile
+import threading
+import time
 from unittest_prettify.colorize import (
     colorize,
     RED,
 )
-from board import Board, InvalidRowException, InvalidColumnException
+from board import Board, InvalidRowException, InvalidColumnException, START_FEN
 from pieces import Pawn, Queen, Pawn, Rook, Knight, Bishop, King
 from util import cell_to_string, map_piece_to_character, map_piece_to_fullname
 
-from engine import evaluate_all_possible_moves, MinMaxArg
+from engine import evaluate_all_possible_moves, MinMaxArg, analyse as analyse_lines, evaluate_cached, static_eval_cache, suggest_move, eval_cache, start_search, Ponderer
+from cache import HashTable, SharedTranspositionTable, position_key, double_bits
+from position import Position, PositionWriter, PositionReader, PositionFile
+from perft import perft, divide
+import bench
+import analyse
+import pgn
+import match
+import uci
+import service
+import book
+import tablebase
+import diskcache
+import engine
+import asyncio
+import io
+import microbench
+import profiling
+from telemetry import TelemetryWriter, read_records, to_prometheus
+from tracing import SearchTracer, load as load_trace, build_tree, CUTOFF, LEAF
 
 
 def iterate_pieces(board):
@@ -442,6 +467,793 @@ class TestBoard(unittest.TestCase):
     moves = evaluate_all_possible_moves(self.board, minMaxArg=MinMaxArg(playAsWhite=True), maximumNumberOfMoves=6)
     self.assertEqual(len(moves), 6, "evaluate_all_possible_moves should respect requested amount of moves")
 
+  # ---------------------------------------------------------------------------
+  # Phase D – Caches & Performance
+  # ---------------------------------------------------------------------------
+
+  @colorize(color=RED) 
+  def test_D01_static_eval_cache(self):
+    table = HashTable(16)
+    self.assertIsNone(table.get("a"), "An empty table must not report any entries")
+    table.put("a", 1.0)
+    self.assertEqual(table.get("a"), 1.0, "Stored values must be returned by the table")
+    self.assertEqual((table.probes, table.hits, table.stores), (2, 1, 1), "HashTable must count probes, hits and stores")
+
+    for index in range(1000):
+      table.put(index, index)
+    self.assertEqual(len(table.slots), 16, "HashTable must never grow beyond its fixed size")
+
+    self.board.load_from_disk("tests/random1.board")
+    static_eval_cache.clear()
+    self.assertAlmostEqual(evaluate_cached(self.board), self.board.evaluate())
+    self.assertAlmostEqual(evaluate_cached(self.board), self.board.evaluate())
+    self.assertEqual(static_eval_cache.hits, 1, "Second evaluation of the same position must be a cache hit")
+
+    # set_cell keeps the Zobrist key of the placement up to date, so the same position reached by moves has the same key
+    self.board.reset()
+    for origin, target in (((0, 6), (2, 5)), ((7, 6), (5, 5)), ((2, 5), (4, 4)), ((6, 3), (4, 3)), ((4, 4), (6, 5))):
+      self.board.set_cell(target, self.board.get_cell(origin))
+    played = self.board.zobrist
+    self.board.rehash()
+    self.assertEqual(played, self.board.zobrist, "set_cell must keep the Zobrist key up to date")
+    self.assertEqual(played, Board.from_fen(self.board.to_fen()).zobrist)
+    self.assertEqual(played, Position.from_board(self.board).to_board().zobrist)
+    self.assertNotEqual(played, Board.from_fen(START_FEN).zobrist)
+
+
+  @colorize(color=RED) 
+  def test_D02_parallel_search_matches_sequential(self):
+    self.board.load_from_disk("tests/random2.board")
+    eval_cache.clear()
+    sequential = suggest_move(self.board)
+    eval_cache.clear()
+    parallel = suggest_move(self.board, workers=2)
+
+    self.assertIs(parallel.piece, sequential.piece, "Parallel search should pick the same piece as the sequential search")
+    self.assertEqual(tuple(parallel.cell), tuple(sequential.cell), "Parallel search should pick the same cell as the sequential search")
+    self.assertAlmostEqual(parallel.score, sequential.score)
+
+
+  @colorize(color=RED) 
+  def test_D03_shared_transposition_table(self):
+    table = SharedTranspositionTable(16)
+    try:
+      key = position_key("3" + self.board.hash())
+      self.assertIsNone(table.get(key), "An empty table must not report any entries")
+
+      table.put(key, 1.5, 42)
+      self.assertEqual(table.get(key), (1.5, 42), "Stored entries must be returned by the table")
+
+      # A second process attached to the same memory sees the entry
+      other = SharedTranspositionTable(16, name=table.name)
+      self.assertEqual(other.get(key), (1.5, 42), "Entries must be visible to every attached table")
+
+      # Overwrite only the score as a torn write would do, the entry must no longer verify
+      SharedTranspositionTable.ENTRY.pack_into(table.buffer, (key & table.mask) * SharedTranspositionTable.ENTRY.size, key ^ double_bits(1.5) ^ 42, 2.5, 42)
+      self.assertIsNone(table.get(key), "Corrupted entries must be reported as misses")
+      other.close()
+    finally:
+      table.close()
+
+
+  @colorize(color=RED) 
+  def test_D04_position_snapshot(self):
+    self.board.load_from_disk("tests/random1.board")
+    position = Position.from_board(self.board, white=False)
+
+    restored = position.to_board()
+    self.assertEqual(restored.hash(), self.board.hash(), "Position must round-trip to an identical board")
+    self.assertEqual(Position.from_board(restored, white=False), position, "Positions of identical boards must be equal")
+    self.assertNotEqual(Position.from_board(restored, white=True).key, position.key, "The key must include the color to move")
+    self.assertEqual(len({position, Position.from_board(restored, white=False)}), 1, "Positions must be hashable")
+
+    data = pickle.dumps(position)
+    self.assertLess(len(data), 200, "Positions must be tiny to pickle")
+    self.assertEqual(pickle.loads(data), position)
+
+
+  @colorize(color=RED) 
+  def test_D05_background_search(self):
+    self.board.load_from_disk("tests/random2.board")
+    beforeHash = self.board.hash()
+    eval_cache.clear()
+    expected = suggest_move(self.board)
+    eval_cache.clear()
+
+    progress = []
+    search = start_search(self.board, on_progress=lambda move, searched, total: progress.append(searched))
+    move = search.result(timeout=60)
+
+    self.assertIs(move.piece, expected.piece, "Background search should pick the same piece as suggest_move")
+    self.assertEqual(tuple(move.cell), tuple(expected.cell), "Background search should pick the same cell as suggest_move")
+    self.assertEqual(progress, list(range(1, len(progress) + 1)), "Progress must be reported after every root move")
+    self.assertGreater(len(progress), 0)
+    for name in ("nodes", "leaf_evaluations", "cache_probes", "cache_hits", "cache_stores"):
+      self.assertEqual(getattr(move.stats, name), getattr(expected.stats, name), f"Background search must count {name} as suggest_move")
+
+    # The root is looked up in the cache and the tablebases like every other node
+    cached = start_search(self.board).result(timeout=60)
+    self.assertEqual((cached.stats.nodes, cached.stats.cache_hits), (0, 1), "Cached results must be counted")
+    self.assertEqual(beforeHash, self.board.hash(), "Background search must not alter the board")
+
+    # The arguments of the caller are kept, only the stop event is replaced
+    eval_cache.clear()
+    stats = engine.SearchStats()
+    tracer = SearchTracer(capacity=1000)
+    move = start_search(self.board, MinMaxArg(depth=2, stats=stats, tracer=tracer)).result(timeout=60)
+    self.assertIs(move.stats, stats, "The statistics of the caller must be used")
+    self.assertGreater(stats.nodes, 0)
+    self.assertGreater(tracer.count, 0, "The tracer of the caller must be used")
+
+    eval_cache.clear()
+    search = start_search(self.board)
+    search.cancel()
+    with self.assertRaises(engine.SearchCancelled):
+      search.result(timeout=60)
+    self.assertTrue(search.done(), "A cancelled search must be done")
+
+    # The node limit of the caller ends the search the same way
+    eval_cache.clear()
+    with self.assertRaises(engine.SearchCancelled):
+      start_search(self.board, MinMaxArg(depth=3, max_nodes=5)).result(timeout=60)
+
+
+  @colorize(color=RED) 
+  def test_D06_pondering_fills_cache(self):
+    eval_cache.clear()
+    self.board.load_from_disk("tests/random2.board")
+    ponder = Ponderer(self.board, MinMaxArg(depth=2))
+    self.assertTrue(ponder.finished.wait(timeout=60), "Pondering must end after all answers were searched")
+
+    answer = evaluate_all_possible_moves(self.board, MinMaxArg(playAsWhite=False), maximumNumberOfMoves=None)[-1]
+    self.board.set_cell(answer.cell, answer.piece)
+
+    key = "2" + self.board.hash() + "-w"
+    self.assertIn(key, eval_cache, "Every answer of the opponent must be pondered")
+
+    cached = eval_cache[key]
+    move = ponder.search(self.board).result(timeout=60)
+    self.assertEqual(tuple(move.cell), tuple(cached.cell), "The search after pondering must be answered from the cache")
+    self.assertEqual(move.score, cached.score, "The search after pondering must be answered from the cache")
+
+
+  @colorize(color=RED) 
+  def test_D07_perft(self):
+    self.assertEqual(perft(self.board, 1, True), 20, "There are 20 moves in the start position")
+    self.assertEqual(perft(self.board, 2, True), 400, "There are 400 positions after two plies from the start position")
+
+    beforeHash = self.board.hash()
+    counts = divide(self.board, 2, True)
+    self.assertEqual(len(counts), 20, "divide must report every root move")
+    self.assertEqual(sum(counts.values()), 400, "divide must sum up to the perft count")
+    self.assertEqual(beforeHash, self.board.hash(), "perft must not alter board configuration after its return")
+
+    with open("tests/perft.json", "rt") as f:
+      reference = json.load(f)
+
+    for name in ["tests/knight.board", "tests/pawn.board", "tests/rook.board"]:
+      self.board.load_from_disk(name)
+      self.assertEqual(perft(self.board, 2, True), reference[f"{name} w 2"], f"perft count of {name} does not match the reference")
+
+
+  @colorize(color=RED) 
+  def test_D08_bench_compare(self):
+    report = bench.run(2, positions=["tests/rook.board"])
+    self.assertEqual(report["positions"][0]["position"], "tests/rook.board")
+    self.assertGreater(report["nodes"], 0, "The benchmark must count the searched nodes")
+    self.assertEqual(bench.compare(report, report, 0.25), [], "A report must not regress against itself")
+
+    slower = json.loads(json.dumps(report))
+    slower["nps"] = report["nps"] / 2
+    slower["positions"][0]["move"] = "a1a2"
+    self.assertEqual(len(bench.compare(slower, report, 0.25)), 2, "Changed moves and slowdowns must be reported")
+
+
+  @colorize(color=RED) 
+  def test_D09_microbench(self):
+    record = microbench.run(repeat=2, warmup=0, minimum_time=0.001, only="is_valid_cell")
+    self.assertEqual(list(record["results"]), ["Board.is_valid_cell"], "Only the filtered benchmarks must run")
+    self.assertGreater(record["results"]["Board.is_valid_cell"]["min"], 0)
+
+    slower = json.loads(json.dumps(record))
+    slower["results"]["Board.is_valid_cell"]["min"] *= 2
+    rows = microbench.compare(record, slower, 0.1)
+    self.assertTrue(rows[0][4], "A slowdown beyond the threshold must be flagged")
+    self.assertFalse(microbench.compare(record, record, 0.1)[0][4], "Identical runs must not be flagged")
+
+
+  @colorize(color=RED) 
+  def test_D10_search_stats(self):
+    self.board.load_from_disk("tests/rook.board")
+    eval_cache.clear()
+    first = suggest_move(self.board, minMaxArg=MinMaxArg(depth=3))
+    stats = first.stats
+
+    self.assertEqual(stats.nodes_per_depth[3], 1, "The root must be counted once")
+    self.assertEqual(stats.nodes, sum(stats.nodes_per_depth.values()), "Nodes per depth must sum up to the nodes")
+    self.assertGreater(stats.leaf_evaluations, 0)
+    self.assertGreater(stats.legality_checks, 0)
+    self.assertEqual(stats.cache_probes, stats.cache_hits + stats.cache_stores, "Every cache probe is either a hit or followed by a store")
+    self.assertIsNotNone(stats.effective_branching_factor())
+
+    second = suggest_move(self.board, minMaxArg=MinMaxArg(depth=3))
+    self.assertIsNot(second.stats, stats, "Every search must get its own statistics")
+    self.assertEqual((second.stats.nodes, second.stats.cache_hits), (0, 1), "A repeated search must be answered from the cache")
+
+
+  @colorize(color=RED) 
+  def test_D11_profiling(self):
+    original = Board.evaluate
+    self.board.load_from_disk("tests/rook.board")
+    eval_cache.clear()
+    static_eval_cache.clear()
+
+    with tempfile.TemporaryDirectory() as directory:
+      suggest_move(self.board, minMaxArg=MinMaxArg(depth=2, profile=directory))
+      files = sorted(os.listdir(directory))
+      self.assertEqual(len(files), 2, "Profiling must write one pstats and one sections file per search")
+
+      with open(os.path.join(directory, files[1 if files[1].endswith(".json") else 0]), "rt") as f:
+        sections = json.load(f)
+      self.assertGreater(sections["evaluation"]["calls"], 0, "Evaluation must be timed as a section")
+
+      # Worker processes are not profiled, so profiling a parallel search is refused
+      with self.assertRaises(ValueError):
+        suggest_move(self.board, workers=2, minMaxArg=MinMaxArg(depth=2, profile=directory))
+      self.assertEqual(len(os.listdir(directory)), 2)
+
+    self.assertIs(Board.evaluate, original, "Profiling must restore the original methods")
+
+    # Only the profiled thread is timed, a search running in the background does not show up in its sections
+    timer = profiling.SectionTimer()
+    with profiling.instrument(timer):
+      background = threading.Thread(target=Board.from_fen(START_FEN).evaluate)
+      background.start()
+      background.join()
+      self.board.evaluate()
+    self.assertEqual(timer.calls["evaluation"], 1, "Calls of other threads must not be timed")
+
+
+  @colorize(color=RED) 
+  def test_D12_telemetry(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, "telemetry.jsonl")
+      writer = TelemetryWriter(path, flush_interval=0.01)
+      for index in range(3):
+        writer.record({"time": 0.5, "nodes": 100, "depth": 3, "score": 0.0, "cache_hits": index, "cache_probes": 10,
+                       "cache_entries": 10 * index, "eval_cache_occupancy": 0.1})
+      writer.close()
+
+      records = list(read_records(path))
+      self.assertEqual(len(records), 3, "Every record must be written once the writer is closed")
+
+      text = to_prometheus(records)
+      self.assertIn("mchess_moves_total 3\n", text)
+      self.assertIn("mchess_nodes_total 300\n", text)
+      self.assertIn("mchess_cache_entries 20\n", text)
+
+
+  @colorize(color=RED) 
+  def test_D13_tracing(self):
+    self.board.load_from_disk("tests/rook.board")
+    eval_cache.clear()
+    static_eval_cache.clear()
+
+    tracer = SearchTracer(capacity=4096)
+    move = suggest_move(self.board, minMaxArg=MinMaxArg(depth=3, tracer=tracer))
+    records = tracer.records()
+    self.assertEqual(records[-1][0], 0, "The root must be recorded last")
+    self.assertEqual(records[-1][4], move.score)
+    self.assertTrue(any(record[5] & LEAF for record in records), "Statically evaluated moves must be recorded as leaves")
+    self.assertTrue(any(record[5] & CUTOFF for record in records), "Cutoffs must be flagged")
+
+    roots = build_tree(records)
+    self.assertEqual(len(roots), 1)
+    self.assertGreater(len(roots[0][1]), 0)
+
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, "search.trace")
+      tracer.save(path)
+      self.assertEqual(load_trace(path).records(), records, "A saved trace must load unchanged")
+
+
+  @colorize(color=RED) 
+  def test_D14_fen(self):
+    self.board.reset()
+    self.assertEqual(self.board.to_fen(), START_FEN)
+    self.assertEqual(Board.from_fen(START_FEN).hash(), self.board.hash())
+
+    for name in ["tests/random1.board", "tests/random2.board", "tests/pawn.board"]:
+      self.board.load_from_disk(name)
+      self.board.white_to_move = False
+      fen = self.board.to_fen()
+      board = Board.from_fen(fen)
+      self.assertEqual(board.hash(), self.board.hash(), f"{name} must round-trip through FEN")
+      self.assertFalse(board.white_to_move, "Side to move must round-trip through FEN")
+      self.assertEqual(board.to_fen(), fen)
+
+      # The loaded pieces must be fully usable
+      for piece in board.iterate_cells_with_pieces(True):
+        self.assertIs(board.get_cell(piece.cell), piece)
+
+    fen = "8/8/8/4k3/8/8/4P3/4K3 b - e3 12 40"
+    self.assertEqual(Board.from_fen(fen).to_fen(), fen)
+    self.assertEqual(Board.from_fen("8/8/8/4k3/8/8/4P3/4K3").to_fen(), "8/8/8/4k3/8/8/4P3/4K3 w - - 0 1")
+
+    for fen in ["8/8/8/8/8/8/8 w - - 0 1", "9/8/8/8/8/8/8/8", "8/8/8/8/8/8/8/7x", "8/8/8/8/8/8/8/8 x", "8/8/8/8/8/8/8/ppppppppp"]:
+      with self.assertRaises(ValueError, msg=fen):
+        Board.from_fen(fen)
+
+
+  @colorize(color=RED) 
+  def test_D15_binary_positions(self):
+    boards = []
+    for name in ["tests/random1.board", "tests/random2.board", "tests/rook.board"]:
+      board = Board()
+      board.load_from_disk(name)
+      boards.append(board)
+    boards[1].white_to_move = False
+
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, "positions.bin")
+      with PositionWriter(path, batch_size=2) as writer:
+        for index, board in enumerate(boards):
+          writer.write(board, score=index * 1.5 if index else None)
+
+      # Appending keeps the existing records
+      with PositionWriter(path) as writer:
+        writer.write(Position.from_board(boards[0], white=False), score=-3.0)
+
+      self.assertEqual(os.path.getsize(path), PositionFile.HEADER.size + 4 * PositionFile.RECORD.size, "Records must be fixed-width")
+
+      with PositionReader(path) as reader:
+        self.assertEqual(len(reader), 4)
+        self.assertEqual(reader[0], (Position.from_board(boards[0]), None))
+        self.assertEqual(reader[1], (Position.from_board(boards[1]), 1.5))
+        self.assertEqual(reader[-1], (Position.from_board(boards[0], white=False), -3.0))
+        self.assertEqual(len(reader.record(2)), PositionFile.RECORD.size)
+
+        for index, board in enumerate(boards):
+          decoded = reader.board(index)
+          self.assertEqual(decoded.hash(), board.hash(), "Records must decode into an identical board")
+          self.assertEqual(decoded.white_to_move, board.white_to_move, "Side to move must be stored")
+          self.assertEqual(decoded.evaluate(), board.evaluate())
+
+        with self.assertRaises(IndexError):
+          reader.record(4)
+
+      # A record view held across closing the reader stays valid
+      with PositionReader(path) as reader:
+        record = reader.record(1)
+      self.assertTrue(reader.file.closed, "The file must be closed even while record views are alive")
+      self.assertEqual(PositionFile.decode(record), (Position.from_board(boards[1]), 1.5))
+      del record
+
+      with open(path, "wb") as f:
+        f.write(b"not a position file")
+      with self.assertRaises(ValueError):
+        PositionReader(path)
+
+
+  @colorize(color=RED) 
+  def test_D16_batch_analysis(self):
+    fens = ["8/8/2R3K1/8/8/8/8/2k5 w - - 0 1", "not a fen", "8/8/2R3K1/8/8/8/8/2k5 b - - 0 1", "8/8/8/4k3/8/8/4P3/4K3 w - - 0 1"]
+    positions = list(analyse.read_fen_lines("fens", fens))
+    self.assertEqual([name for name, _ in positions], ["fens:1", "fens:3", "fens:4"], "Invalid lines must be skipped")
+
+    results = list(analyse.analyse(positions, depth=1, workers=2, ordered=False))
+    self.assertEqual(sorted(result["index"] for result in results), [0, 1, 2])
+
+    with tempfile.TemporaryDirectory() as directory:
+      output = os.path.join(directory, "results.jsonl")
+      argv = ["-", "-o", output, "-d", "1", "-w", "1", "--checkpoint-every", "1"]
+      analyse.main(argv, stdin=io.StringIO("\n".join(fens)))
+
+      with open(output, "rt") as f:
+        lines = f.readlines()
+      self.assertEqual([json.loads(line)["id"] for line in lines], ["stdin:1", "stdin:3", "stdin:4"], "Results must be written in input order")
+      self.assertEqual(json.loads(lines[0])["move"], "c6c1")
+
+      # Simulate a job interrupted after the first result, with a second result written after the checkpoint
+      checkpoint = analyse.Checkpoint(output + ".checkpoint", {"sources": ["-"], "depth": 1})
+      checkpoint.done = 1
+      checkpoint.save(len(lines[0]))
+      with open(output, "at") as f:
+        f.write('{"partial": ')
+
+      analyse.main(argv, stdin=io.StringIO("\n".join(fens)))
+      with open(output, "rt") as f:
+        resumed = [json.loads(line) for line in f]
+      self.assertEqual(resumed[0], json.loads(lines[0]), "Results covered by the checkpoint must be kept")
+      self.assertEqual([(result["index"], result["move"]) for result in resumed], [(0, "c6c1"), (1, json.loads(lines[1])["move"]), (2, json.loads(lines[2])["move"])],
+                       "A resumed job must analyse only the unfinished positions")
+
+
+  @colorize(color=RED) 
+  def test_D17_pgn_replay(self):
+    text = """[Event "Italian"]
+[Result "*"]
+
+1. e4 e5 2. Nf3 {develops} Nc6 3. Bc4 (3. Bb5 a6) Bc5 $1 4. O-O Nf6 *
+
+[Event "Promotion"]
+[Result "1-0"]
+
+1. e4 Nf6 2. e5 d5 3. exd6 e5 4. dxc7 Bc5 5. cxd8=Q+ Kxd8 6. Nf3 1-0
+
+[Event "Broken"]
+
+1. e4 e5 2. Ke3 *
+"""
+    games = list(pgn.read_games(io.StringIO(text)))
+    self.assertEqual([len(game.moves) for game in games], [8, 11, 3], "Comments, variations, NAGs and move numbers must be dropped")
+    self.assertEqual(games[1].result, "1-0")
+
+    board = Board()
+    errors = []
+    replayed = list(pgn.replay(games, board, errors))
+    self.assertEqual(len(replayed), 9 + 12 + 3, "Every position up to an illegal move must be yielded")
+    self.assertEqual([game.headers["Event"] for game, error in errors], ["Broken"])
+
+    fens = {}
+    for game, ply, position in pgn.replay(games[:2], board):
+      fens[game.headers["Event"], ply] = board.to_fen()
+      self.assertEqual(position, Position.from_board(board))
+
+    self.assertEqual(fens["Italian", 7], "r1bqk1nr/pppp1ppp/2n5/2b1p3/2B1P3/5N2/PPPP1PPP/RNBQ1RK1 b kq - 5 4", "Castling must move king and rook")
+    self.assertEqual(fens["Promotion", 4], "rnbqkb1r/ppp1pppp/5n2/3pP3/8/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 3")
+    self.assertEqual(fens["Promotion", 5], "rnbqkb1r/ppp1pppp/3P1n2/8/8/8/PPPP1PPP/RNBQKBNR b KQkq - 0 3", "En passant must remove the pawn")
+    self.assertEqual(fens["Promotion", 9], "rnbQk2r/pp3ppp/5n2/2b1p3/8/8/PPPP1PPP/RNBQKBNR b KQkq - 0 5", "Promotion must replace the pawn")
+    self.assertEqual(fens["Promotion", 11], "rnbk3r/pp3ppp/5n2/2b1p3/8/5N2/PPPP1PPP/RNBQKB1R b KQ - 1 6")
+
+    board.load_fen(fens["Italian", 7])
+    with self.assertRaises(pgn.IllegalMoveError):
+      pgn.play_move(board, "Nd5")
+
+
+  @colorize(color=RED) 
+  def test_D18_match(self):
+    adjudication = match.Adjudication(resign_score=10.0, resign_moves=2, max_plies=12)
+    self.assertEqual(adjudication.judge([1.0, 12.0, 11.0, 15.0, 20.0], 5), "1-0")
+    self.assertIsNone(adjudication.judge([1.0, 12.0, -11.0, 15.0, 20.0], 5), "Both engines must agree before a game is adjudicated")
+
+    summary, games = match.run_match({"depth": 1}, {"depth": 2}, openings=[match.OPENINGS[1]], workers=2, adjudication=adjudication)
+    self.assertEqual(summary["games"], 2, "Every opening must be played with both colors")
+    self.assertEqual(sorted(game["a_white"] for game in games), [False, True])
+    self.assertEqual(summary["wins"] + summary["draws"] + summary["losses"], 2)
+    for game in games:
+      self.assertLessEqual(len(game["moves"]), 12)
+      self.assertIn(game["result"], ["1-0", "0-1", "1/2-1/2"])
+
+    summary = match.summarize([{"result": "1-0", "a_white": True, "moves": ["e2e4"], "white_moves": 1, "times": {"white": 1.0, "black": 0.0}},
+                               {"result": "1-0", "a_white": False, "moves": ["e2e4", "e7e5"], "white_moves": 1, "times": {"white": 2.0, "black": 4.0}}], 60.0)
+    self.assertEqual((summary["wins"], summary["losses"], summary["score"], summary["elo"]), (1, 1, 0.5, 0.0))
+    self.assertLess(summary["elo_low"], 0.0)
+    self.assertGreater(summary["elo_high"], 0.0)
+    self.assertEqual(summary["games_per_minute"], 2.0)
+
+    # Openings may be given as piece placement only, WHITE is to move then
+    game = match.play_game("8/8/2R3K1/8/8/8/8/3k4", {"depth": 1}, {"depth": 1}, match.Adjudication(max_plies=4))
+    self.assertEqual(game["white_moves"], (len(game["moves"]) + 1) // 2)
+    self.assertEqual((summary["time_per_move_a"], summary["time_per_move_b"]), (2.5, 2.0))
+
+    # Fixed node and parallel configurations play the move of the deepest search within the limit
+    self.assertEqual(match.parse_engine("depth=3,max_nodes=500,workers=2"), {"depth": 3, "max_nodes": 500, "workers": 2})
+    board = Board.from_fen("8/8/2R3K1/8/8/8/8/3k4")
+    move = match.engine_move(board, {"depth": 3, "max_nodes": 20})
+    self.assertLessEqual(move.stats.nodes, 20)
+    self.assertEqual(max(move.stats.nodes_per_depth), 2, "The depth 3 search needs more nodes than are left")
+    self.assertIsNotNone(match.engine_move(board, {"max_nodes": 1}).piece, "The engine must move on any node limit")
+    game = match.play_game("8/8/2R3K1/8/8/8/8/3k4", {"depth": 2, "workers": 2}, {"depth": 2, "max_nodes": 200}, match.Adjudication(max_plies=4))
+    self.assertEqual(len(game["moves"]), 4)
+    self.assertIsNone(match.engine.executor, "The worker of a game must be able to exit")
+
+
+  @colorize(color=RED) 
+  def test_D19_uci(self):
+    soft, hard = uci.allocate_time(60.0, 0.0)
+    self.assertAlmostEqual(soft, (60.0 - uci.MOVE_OVERHEAD) / uci.SUDDEN_DEATH_MOVES)
+    self.assertLessEqual(soft, hard)
+    self.assertLess(hard, 60.0 * 0.5, "A single move must never use most of the remaining time")
+    self.assertGreater(uci.allocate_time(60.0, 2.0)[0], soft, "The increment must be used")
+    self.assertLess(uci.allocate_time(0.5, 10.0)[1], 0.5, "A large increment must not overstep the remaining time")
+    self.assertGreater(uci.allocate_time(10.0, 0.0, moves_to_go=1)[0], 5.0, "The last move before the time control may use most of the time")
+    self.assertEqual(uci.allocate_time(move_time=1.0), (1.0 - uci.MOVE_OVERHEAD, 1.0 - uci.MOVE_OVERHEAD))
+
+    output = io.StringIO()
+    engine = uci.UCIEngine(output)
+    engine.handle("uci")
+    engine.handle("position startpos moves e2e4 d7d5 e4d5 c7c5 d5c6 b8c6 g1f3 g8f6 f1b5 e7e6 e1g1")
+    self.assertEqual(engine.board.to_fen(), "r1bqkb1r/pp3ppp/2n1pn2/1B6/8/5N2/PPPP1PPP/RNBQ1RK1 b kq - 1 6",
+                     "Moves must be applied including en passant and castling")
+
+    engine.handle("ucinewgame")
+    engine.handle("position fen 8/8/2R3K1/8/8/8/8/2k5 w - - 0 1")
+    engine.handle("go depth 2")
+    engine.handle("isready")
+    engine.wait()
+    lines = output.getvalue().splitlines()
+    self.assertIn("uciok", lines)
+    self.assertIn("readyok", lines)
+    self.assertTrue(any(line.startswith("info depth 2 ") and " pv c6c1" in line for line in lines), "Every depth must report an info line with the PV")
+    self.assertEqual(lines[-1], "bestmove c6c1")
+
+    # Mates are reported in moves, from the point of view of the color to move
+    engine.handle("position fen k7/8/1K6/8/8/8/7Q/8 w - - 0 1")
+    engine.handle("go depth 2")
+    engine.wait()
+    self.assertIn("info depth 2 score mate 1 ", output.getvalue())
+    line = [((1, 7), (7, 7)), ((7, 0), (6, 0)), ((7, 7), (6, 7))]
+    self.assertEqual(uci.format_score(-9999994.0, False, line[:2]), "mate 1", "Captured kings must be reported as mate")
+    self.assertEqual(uci.format_score(uci.engine.MATE_SCORE, False, line[:2]), "mate -1")
+    self.assertEqual(uci.format_score(uci.engine.MATE_SCORE, True, line[:3]), "mate 2")
+    self.assertEqual(uci.format_score(tablebase.TABLEBASE_WIN - 3, True, line[:1]), "mate 2", "Plies to mate of the tables must be added")
+    self.assertEqual(uci.format_score(1.5, False, line), "cp -150")
+
+    # Stopping an infinite search must answer right away with a legal move
+    engine.handle("position startpos")
+    engine.handle("go infinite")
+    time.sleep(0.3)
+    start = time.perf_counter()
+    engine.handle("stop")
+    self.assertLess(time.perf_counter() - start, 0.2, "stop must be handled within milliseconds")
+    self.assertRegex(output.getvalue().splitlines()[-1], "^bestmove [a-h][1-8][a-h][1-8]$")
+
+    # The time limits of a pondering search count from "ponderhit", not from "go ponder"
+    engine.handle("position startpos")
+    engine.handle("go ponder wtime 3000 btime 3000")
+    time.sleep(0.2)
+    started = engine.limits.started
+    engine.handle("ponderhit")
+    self.assertGreaterEqual(engine.limits.started - started, 0.2, "ponderhit must restart the clock of the search")
+    engine.wait()
+    self.assertRegex(output.getvalue().splitlines()[-1], "^bestmove [a-h][1-8][a-h][1-8]$")
+
+    engine.handle("ucinewgame")
+    engine.handle("go nodes 30")
+    engine.wait()
+    info = [line for line in output.getvalue().splitlines() if line.startswith("info depth") and " pv " in line]
+    self.assertLessEqual(int(info[-1].split(" nodes ")[1].split()[0]), 30, "The node limit must be kept")
+
+
+  @colorize(color=RED) 
+  def test_D20_analysis_service(self):
+    rook = "8/8/2R3K1/8/8/8/8/2k5 w - - 0 1"
+
+    async def scenario():
+      analysis = service.AnalysisService(workers=1, batch_delay=0.01, max_pending=2)
+      await analysis.start()
+      server = await asyncio.start_server(analysis.handle_connection, "127.0.0.1", 0)
+      try:
+        first, second, other = await asyncio.gather(analysis.analyse({"fen": rook, "depth": 2}),
+                                                    analysis.analyse({"fen": rook.replace(" 0 1", " 7 30"), "depth": 2}),
+                                                    analysis.analyse({"fen": START_FEN, "depth": 1}))
+        self.assertEqual(first, second, "Identical concurrent requests must share one search")
+        self.assertEqual(first["move"], "c6c1")
+        self.assertEqual(analysis.counters["deduplicated"], 1)
+        self.assertEqual((analysis.counters["searched"], analysis.counters["batches"]), (2, 1), "Both positions must be searched in one batch")
+
+        self.assertEqual((await analysis.route("POST", "/analyse", b'{"fen": "bad"}'))[0], "400 Bad Request")
+        self.assertEqual((await analysis.route("POST", "/analyse", b'{"fen": "8/8/8/8/8/8/8/K6k", "depth": 9}'))[0], "400 Bad Request")
+        self.assertEqual((await analysis.route("GET", "/", b""))[0], "404 Not Found")
+
+        port = server.sockets[0].getsockname()[1]
+        report = await service.load_test("127.0.0.1", port, None, 4, 2, [rook], 2)
+        self.assertEqual(report["statuses"], {"200": 4}, "Requests must be answered over HTTP")
+
+        # Once the queue is full, requests are rejected instead of piling up
+        analysis.batcher.cancel()
+        waiting = [asyncio.ensure_future(analysis.analyse({"fen": rook, "depth": depth})) for depth in (3, 4)]
+        await asyncio.sleep(0)
+        with self.assertRaises(service.Busy):
+          await analysis.analyse({"fen": START_FEN, "depth": 3})
+        for task in waiting:
+          task.cancel()
+      finally:
+        server.close()
+        await analysis.stop()
+
+    asyncio.run(scenario())
+
+
+  @colorize(color=RED) 
+  def test_D21_opening_book(self):
+    text = """[Event "A"]
+
+1. e4 e5 2. Nf3 Nc6 *
+
+[Event "B"]
+
+1. e4 c5 2. Nf3 *
+
+[Event "C"]
+
+1. d4 d5 *
+"""
+    counts = book.collect_moves(pgn.read_games(io.StringIO(text)), plies=3)
+    self.assertEqual(sum(counts.values()), 3 + 3 + 2, "Only the first plies of every game must be counted")
+
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, "book.bin")
+      self.assertEqual(book.write_book(path, counts), 7)
+
+      with book.OpeningBook(path) as opening:
+        start = Board.from_fen(START_FEN)
+        self.assertEqual(opening.lookup(Position.from_board(start).key), [((1, 4), (3, 4), 2), ((1, 3), (3, 3), 1)], "The most played move must come first")
+        self.assertEqual(opening.lookup(Position.from_board(start, False).key), [], "The side to move is part of the key")
+        piece, target = opening.choose(start)
+        self.assertEqual((cell_to_string(piece.cell), cell_to_string(target)), ("e2", "e4"))
+
+      engine.enable_book(path)
+      try:
+        move = suggest_move(start, minMaxArg=MinMaxArg(depth=3, playAsWhite=True))
+        self.assertEqual((cell_to_string(move.piece.cell), cell_to_string(move.cell)), ("e2", "e4"))
+        self.assertEqual((move.stats.nodes, move.stats.book_hits), (0, 1), "Book moves must be played without searching")
+
+        handle = start_search(start, MinMaxArg(depth=3, playAsWhite=True))
+        move = handle.result(timeout=30)
+        self.assertIs(move.piece, start.get_cell((1, 4)), "Book moves must be translated to the pieces of the board")
+        self.assertEqual(cell_to_string(move.cell), "e4")
+        self.assertEqual((move.stats.nodes, move.stats.book_hits), (0, 1), "Background searches must play book moves too")
+
+        move = suggest_move(Board.from_fen("8/8/2R3K1/8/8/8/8/2k5 w - - 0 1"), minMaxArg=MinMaxArg(depth=1, playAsWhite=True))
+        self.assertGreater(move.stats.nodes, 0, "Positions not in the book must be searched")
+      finally:
+        engine.enable_book(None)
+
+
+  @colorize(color=RED) 
+  def test_D22_tablebase(self):
+    with tempfile.TemporaryDirectory() as directory:
+      tablebase.generate_all(directory, ["KQK"])
+      tables = tablebase.Tablebases(directory)
+      try:
+        mate = Board.from_fen("k7/8/1K6/8/8/8/7Q/8 w - - 0 1")
+        self.assertEqual(tables.probe(mate, True), tablebase.TABLEBASE_WIN - 1, "Mate in one ply must be found")
+        self.assertEqual(tables.probe(Board.from_fen("8/7q/8/8/8/1k6/8/K7 b - - 0 1"), False), 1 - tablebase.TABLEBASE_WIN,
+                         "Tables must be mirrored when BLACK is the strong side")
+        self.assertEqual(tables.probe(Board.from_fen("k7/2Q5/1K6/8/8/8/8/8 b - - 0 1"), False), 0.0, "Stalemate must be a draw")
+        self.assertEqual(tables.probe(Board.from_fen("k7/8/1K6/8/8/8/8/7B w - - 0 1"), True), 0.0, "A bishop can not mate")
+        self.assertIsNone(tables.probe(Board.from_fen("k7/8/1K6/8/8/8/8/7R w - - 0 1"), True), "Missing tables must not be probed")
+
+        piece, cell, score = tables.probe_move(mate, True)
+        self.assertEqual((cell_to_string(piece.cell), cell_to_string(cell)), ("h2", "h8"))
+      finally:
+        tables.close()
+
+      version = engine.search_version()
+      engine.enable_tablebases(directory)
+      try:
+        move = suggest_move(mate, minMaxArg=MinMaxArg(depth=3, playAsWhite=True))
+        self.assertEqual(cell_to_string(move.cell), "h8")
+        self.assertEqual((move.stats.nodes, move.stats.tablebase_hits), (1, 1), "The search must not recurse into table positions")
+        eval_cache.clear()
+        move = start_search(mate, MinMaxArg(depth=3, playAsWhite=True)).result(timeout=30)
+        self.assertEqual((cell_to_string(move.cell), move.stats.nodes, move.stats.tablebase_hits), ("h8", 1, 1),
+                         "Background searches must probe the tables at the root")
+        withTables = engine.search_version()
+        self.assertNotEqual(withTables, version, "Results stored without the tables must not be served")
+
+        tablebase.generate_all(directory, ["KRK"])
+        self.assertNotEqual(engine.search_version(), withTables, "Results stored with other tables must not be served")
+      finally:
+        engine.enable_tablebases(None)
+      self.assertEqual(engine.search_version(), version)
+
+
+  @colorize(color=RED) 
+  def test_D23_disk_cache(self):
+    board = Board.from_fen("r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3")
+
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, "search.cache")
+      try:
+        engine.enable_disk_cache(path)
+        engine.disk_cache.loaded.wait()
+        eval_cache.clear()
+        searched = suggest_move(board, minMaxArg=MinMaxArg(depth=3, playAsWhite=True))
+        engine.enable_disk_cache(None)
+        self.assertGreater(os.path.getsize(path), diskcache.DiskCacheFile.HEADER.size, "Results must be written on close")
+
+        # A new session is answered from the file
+        eval_cache.clear()
+        engine.enable_disk_cache(path)
+        engine.disk_cache.loaded.wait()
+        cached = suggest_move(board, minMaxArg=MinMaxArg(depth=3, playAsWhite=True))
+        self.assertEqual((cached.stats.nodes, cached.stats.disk_hits), (0, 1))
+        self.assertEqual((cell_to_string(cached.piece.cell), cell_to_string(cached.cell), cached.score),
+                         (cell_to_string(searched.piece.cell), cell_to_string(searched.cell), searched.score))
+      finally:
+        engine.enable_disk_cache(None)
+        eval_cache.clear()
+
+      # Any change to the move generation and legality code of board.py yields a new version
+      version = engine.search_version()
+      getsource = engine.inspect.getsource
+      with unittest.mock.patch.object(engine.inspect, "getsource", lambda module: getsource(module) + ("#" if module.__name__ == "board" else "")):
+        self.assertNotEqual(engine.search_version(), version, "Results of another legality check must not be served")
+
+      # Results of another version of the search are never served
+      stale = diskcache.DiskCache(path, engine.search_version() ^ 1)
+      stale.loaded.wait()
+      self.assertEqual(stale.entries, {})
+      stale.close()
+      self.assertEqual(os.path.getsize(path), diskcache.DiskCacheFile.HEADER.size, "A file of another version must be discarded")
+
+      # Results that keep arriving faster than the flush interval are still written in time
+      busy = diskcache.DiskCache(path, 1, flush_interval=0.05)
+      busy.loaded.wait()
+      deadline = time.monotonic() + 0.5
+      key = 0
+      while time.monotonic() < deadline:
+        key += 1
+        busy.put(key, 3, 0.0, diskcache.NO_MOVE)
+        time.sleep(0.01)
+      written = os.path.getsize(path)
+      busy.close()
+      self.assertGreater(written, diskcache.DiskCacheFile.HEADER.size, "Results must be written while new ones arrive")
+
+
+  @colorize(color=RED) 
+  def test_D24_multipv(self):
+    board = Board.from_fen("r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3")
+    fen = board.to_fen()
+
+    eval_cache.clear()
+    single = suggest_move(board, minMaxArg=MinMaxArg(depth=3, playAsWhite=True))
+    eval_cache.clear()
+    lines = analyse_lines(board, 4, MinMaxArg(depth=3, playAsWhite=True))
+
+    self.assertEqual(board.to_fen(), fen, "The board must be left unchanged")
+    self.assertEqual(len(lines), 4)
+    self.assertEqual(lines[0].stats.nodes, single.stats.nodes, "All lines must come from a single search")
+    self.assertEqual((lines[0].piece, cell_to_string(lines[0].cell), lines[0].score), (single.piece, cell_to_string(single.cell), single.score))
+    self.assertEqual([line.score for line in lines], sorted((line.score for line in lines), reverse=True))
+    for line in lines:
+      self.assertEqual(len(line.pv), 3, "Every line must reach the search depth")
+      self.assertEqual(line.pv[0], ((int(line.piece.cell[0]), int(line.piece.cell[1])), (int(line.cell[0]), int(line.cell[1]))),
+                       "Every line must start with its move")
+
+    legal = sum(len(piece.get_valid_cells()) for piece in board.iterate_cells_with_pieces(True))
+    self.assertEqual(len(analyse_lines(board, 40, MinMaxArg(depth=1, playAsWhite=True))), legal, "All legal root moves must be available")
+    eval_cache.clear()
+
+
+  @colorize(color=RED) 
+  def test_D25_principal_variation_reuse(self):
+    board = Board.from_fen("r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3")
+    eval_cache.clear()
+    engine.remember_pv(board, True, [])
+
+    move = suggest_move(board, minMaxArg=MinMaxArg(depth=3, playAsWhite=True))
+    self.assertEqual(len(move.pv), 3, "The whole line must be returned")
+    self.assertEqual(move.pv[0], ((int(move.piece.cell[0]), int(move.piece.cell[1])), (int(move.cell[0]), int(move.cell[1]))))
+
+    # The opponent plays the predicted answer
+    for origin, target in move.pv[:2]:
+      pgn.apply_move(board, origin, target)
+    self.assertEqual(engine.pv_table[Position.from_board(board).key], move.pv[2:])
+
+    # While the opponent thinks, the predicted answer is pondered first, here the one otherwise pondered last
+    board = Board.from_fen("r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3")
+    pgn.apply_move(board, *move.pv[0])
+    last = evaluate_all_possible_moves(board, MinMaxArg(depth=2, playAsWhite=False), maximumNumberOfMoves=None)[-1]
+    predicted = ((int(last.piece.cell[0]), int(last.piece.cell[1])), (int(last.cell[0]), int(last.cell[1])))
+    engine.remember_pv(board, False, [predicted])
+    eval_cache.clear()
+    ponderer = Ponderer(board, MinMaxArg(depth=3, playAsWhite=True))
+    deadline = time.monotonic() + 30
+    while ponderer.pondered == 0 and not ponderer.finished.is_set() and time.monotonic() < deadline:
+      time.sleep(0.001)
+    ponderer.cancel()
+    ponderer.finished.wait()
+
+    # Once it is played, the search is answered from the pondered result
+    pgn.apply_move(board, *predicted)
+    reply = suggest_move(board, minMaxArg=MinMaxArg(depth=3, playAsWhite=True))
+    self.assertEqual(reply.stats.nodes, 0, "The predicted answer must be pondered first")
+    eval_cache.clear()
+
 
 if __name__ == "__main__":
   unittest.main()
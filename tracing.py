@@ -0,0 +1,167 @@
+import argparse
+import sys
+from struct import Struct
+from util import cell_to_string
+
+
+# Flags of a trace record
+CUTOFF = 1
+CACHE_HIT = 2
+LEAF = 4
+
+# Encoded move of records without a move (e.g. the root of a lost game)
+NO_MOVE = 0xFFFF
+
+# ply, move (origin cell index << 6 | target cell index), alpha, beta, score, flags
+RECORD = Struct("<bHdddB")
+HEADER = Struct("<QQ")
+
+
+def encode_move(piece, cell):
+    """
+    Encodes the move of a piece into a cell as 16 bit integer, see :py:data:`RECORD`
+    """
+    if piece is None:
+        return NO_MOVE
+
+    row, col = piece.cell
+    targetRow, targetCol = cell
+    return int(row * 8 + col) << 6 | int(targetRow * 8 + targetCol)
+
+
+def move_to_string(code):
+    if code == NO_MOVE:
+        return "--"
+
+    origin, target = code >> 6, code & 63
+    return cell_to_string((origin // 8, origin % 8)) + cell_to_string((target // 8, target % 8))
+
+
+class SearchTracer:
+    """
+    Records the nodes of a search as fixed-width records into a preallocated ring buffer.
+    Once the buffer is full, the oldest records are overwritten, so tracing never allocates memory during a search.
+
+    A node is recorded once its score is known, so the records are in post-order: the children of a node come before the node itself.
+    """
+    def __init__(self, capacity=2**16):
+        """
+        Constructor.
+
+        :param capacity: Number of records the ring buffer holds
+        """
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.count = 0
+        self.root_depth = 0
+
+    def begin(self, depth):
+        """
+        Starts tracing a new search with the given depth. Earlier records are kept until they are overwritten.
+        """
+        self.root_depth = depth
+
+    def record(self, depth, move, alpha, beta, score, flags=0):
+        """
+        Records one node.
+
+        :param depth: Remaining search depth of the node, turned into the ply from the root
+        :param move: Encoded move leading to this node, see :py:func:`encode_move`
+        """
+        RECORD.pack_into(self.buffer, (self.count % self.capacity) * RECORD.size,
+                         self.root_depth - depth, move, alpha, beta, score, flags)
+        self.count += 1
+
+    def records(self):
+        """
+        Returns the recorded nodes still in the buffer, oldest first, as tuples (ply, move, alpha, beta, score, flags)
+        """
+        available = min(self.count, self.capacity)
+        first = self.count - available
+        return [RECORD.unpack_from(self.buffer, (index % self.capacity) * RECORD.size) for index in range(first, self.count)]
+
+    def save(self, path):
+        """
+        Writes the ring buffer to a file, see :py:func:`load`
+        """
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(self.capacity, self.count))
+            f.write(self.buffer)
+
+
+def load(path):
+    """
+    Reads a ring buffer written by :py:meth:`SearchTracer.save`
+    """
+    with open(path, "rb") as f:
+        capacity, count = HEADER.unpack(f.read(HEADER.size))
+        tracer = SearchTracer(capacity)
+        tracer.count = count
+        f.readinto(tracer.buffer)
+
+    return tracer
+
+
+def build_tree(records):
+    """
+    Turns post-order records into a tree.
+
+    :return: List of root nodes, each node a tuple (record, children)
+    """
+    pending = {}
+    for record in records:
+        ply = record[0]
+        node = (record, pending.pop(ply + 1, []))
+        pending.setdefault(ply, []).append(node)
+
+    # Records overwritten by the ring buffer leave nodes without parents behind, show them as roots as well
+    roots = []
+    for ply in sorted(pending):
+        roots.extend(pending[ply])
+
+    return roots
+
+
+def render_tree(roots, max_ply=None):
+    """
+    Renders a tree of :py:func:`build_tree` as text lines
+    """
+    lines = []
+
+    def render(node):
+        (ply, move, alpha, beta, score, flags), children = node
+        if max_ply is not None and ply > max_ply:
+            return
+
+        marks = ""
+        if flags & CUTOFF:
+            marks += " CUTOFF"
+        if flags & CACHE_HIT:
+            marks += " HIT"
+        if flags & LEAF:
+            marks += " LEAF"
+
+        lines.append(f"{'  ' * ply}{move_to_string(move)} {score:.2f} [{alpha:.2f}, {beta:.2f}]{marks}")
+        for child in children:
+            render(child)
+
+    for root in roots:
+        render(root)
+
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Renders a search trace written by SearchTracer.save as tree.")
+    parser.add_argument("file", help="trace file")
+    parser.add_argument("--max-ply", type=int, help="do not render nodes deeper than this ply")
+    args = parser.parse_args(argv)
+
+    for line in render_tree(build_tree(load(args.file).records()), args.max_ply):
+        print(line)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+import sys
+import threading
+import time
+import engine
+from board import Board, START_FEN
+from engine import MinMaxArg, SearchStats, SearchCancelled, minMax_progress
+from pgn import apply_move, SAN_PIECES
+from position import Position
+from util import cell_to_string
+
+
+NAME = "mchess"
+AUTHOR = "mchess developers"
+
+# Deepest search started by "go infinite" or when only a time limit is given
+MAX_DEPTH = 32
+
+# Time reserved per move for the communication with the GUI, in seconds
+MOVE_OVERHEAD = 0.03
+
+# Number of moves the remaining time is spread over in sudden-death time controls (no "movestogo")
+SUDDEN_DEATH_MOVES = 30
+
+# Factor the search time grows by from one depth to the next, used until two depths were measured
+DEFAULT_GROWTH = 8.0
+
+
+def allocate_time(time_left=None, increment=0.0, moves_to_go=None, move_time=None):
+    """
+    Decides how long to search for the next move.
+
+    The remaining time is spread evenly over the moves to go (or SUDDEN_DEATH_MOVES without "movestogo") and most of
+    the increment is added, since it is credited again after the move. The hard limit allows a search to overrun this
+    share when a depth is almost complete, but never uses more than a fraction of the remaining time.
+
+    :param time_left: Remaining time on the clock in seconds, None if the time is not limited
+    :param increment: Increment per move in seconds
+    :param moves_to_go: Moves until the next time control, None for sudden death
+    :param move_time: Exact time to search in seconds ("go movetime")
+    :return: Tuple (soft, hard) in seconds. No new depth is started after the soft limit, the search is aborted at
+             the hard limit. Both are None if the time is not limited.
+    """
+    if move_time is not None:
+        limit = max(move_time - MOVE_OVERHEAD, 0.001)
+        return limit, limit
+
+    if time_left is None:
+        return None, None
+
+    usable = max(time_left - MOVE_OVERHEAD, 0.001)
+    moves = max(moves_to_go or SUDDEN_DEATH_MOVES, 1)
+
+    hard = min(usable, (usable / moves + increment) * 4.0, usable * (0.9 if moves == 1 else 0.4))
+    soft = min(usable / moves + 0.8 * increment, hard)
+    return soft, hard
+
+
+def parse_move(text):
+    """
+    Parses a move in UCI long algebraic notation, e.g. "e2e4" or "e7e8q"
+
+    :return: Tuple (origin, target, promotion piece class or None)
+    """
+    origin = (int(text[1]) - 1, ord(text[0]) - ord("a"))
+    target = (int(text[3]) - 1, ord(text[2]) - ord("a"))
+    promotion = SAN_PIECES[text[4].upper()] if len(text) > 4 else None
+    return origin, target, promotion
+
+
+def format_move(origin, target):
+    return cell_to_string(origin) + cell_to_string(target)
+
+
+def format_score(score, white, line):
+    """
+    Formats the score of a search as "cp N" or, for mates, "mate N" with N in moves. Both are given from the point of
+    view of the color to move, a negative mate means it is mated.
+
+    :param score: Score of the search, from WHITE's point of view
+    :param white: True if WHITE is to move
+    :param line: The principal variation of the search, see :py:func:`engine.search_pv`
+    """
+    relative = score if white else -score
+    plies = engine.mate_plies(score, line)
+    if plies is None:
+        return f"cp {int(round(relative * 100))}"
+
+    moves = (plies + 1) // 2
+    return f"mate {moves if relative > 0 else -moves}"
+
+
+class Limits:
+    """
+    Limits of one search as given by the "go" command
+    """
+    def __init__(self, depth=MAX_DEPTH, nodes=None, soft=None, hard=None, infinite=False):
+        self.depth = depth
+        self.nodes = nodes
+        self.soft = soft
+        self.hard = hard
+        self.infinite = infinite
+
+        # The time limits count from here, or from "ponderhit" for a search started with "go ponder"
+        self.started = time.perf_counter()
+
+    @classmethod
+    def parse(cls, args, white):
+        """
+        Parses the arguments of the "go" command, times are given in milliseconds
+
+        :param args: The arguments after "go"
+        :param white: True if WHITE is to move, selects the clock to use
+        """
+        values = {}
+        flags = set()
+        tokens = iter(args)
+        for token in tokens:
+            if token in ("infinite", "ponder"):
+                flags.add(token)
+            elif token == "searchmoves":
+                break
+            else:
+                values[token] = next(tokens, None)
+
+        def seconds(name):
+            return int(values[name]) / 1000.0 if values.get(name) is not None else None
+
+        side = "w" if white else "b"
+        soft, hard = allocate_time(seconds(side + "time"), seconds(side + "inc") or 0.0,
+                                   int(values["movestogo"]) if "movestogo" in values else None, seconds("movetime"))
+
+        limits = cls(int(values.get("depth", MAX_DEPTH)), int(values["nodes"]) if "nodes" in values else None, soft, hard, bool(flags))
+        return limits
+
+
+class UCIEngine:
+    """
+    Speaks the UCI protocol: reads commands line by line and writes the answers to the output.
+    Searches run in a background thread, so "stop" is handled while the engine is thinking.
+    """
+    def __init__(self, output=None):
+        self.output = output if output is not None else sys.stdout
+        self.lock = threading.Lock()
+        self.board = Board()
+        self.board.reset()
+        self.thread = None
+        self.stop = threading.Event()
+        self.timer = None
+        self.limits = None
+
+    def send(self, line):
+        with self.lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def handle(self, line):
+        """
+        Handles one command
+
+        :return: False once the engine should quit, True otherwise
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+
+        command, args = tokens[0], tokens[1:]
+
+        if command == "uci":
+            self.send(f"id name {NAME}")
+            self.send(f"id author {AUTHOR}")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.wait()
+            engine.eval_cache.clear()
+        elif command == "position":
+            self.wait()
+            self.position(args)
+        elif command == "go":
+            self.wait()
+            self.go(args)
+        elif command == "stop":
+            self.stop.set()
+            self.wait()
+        elif command == "ponderhit":
+            # The predicted move was played, the search goes on with the normal time limit
+            limits = self.limits
+            if limits is not None:
+                limits.started = time.perf_counter()
+                limits.infinite = False
+                self.arm_timer(limits.hard)
+        elif command == "quit":
+            self.stop.set()
+            self.wait()
+            return False
+
+        return True
+
+    def position(self, args):
+        """
+        Handles "position [startpos | fen FEN] [moves MOVE...]"
+        """
+        moves = args.index("moves") if "moves" in args else len(args)
+
+        if args and args[0] == "fen":
+            self.board.load_fen(" ".join(args[1:moves]))
+        else:
+            self.board.load_fen(START_FEN)
+
+        for text in args[moves + 1:]:
+            origin, target, promotion = parse_move(text)
+            apply_move(self.board, origin, target, promotion)
+
+        self.board.check_cache.clear()
+
+    def go(self, args):
+        """
+        Handles "go", starts the search in the background
+        """
+        self.limits = Limits.parse(args, self.board.white_to_move)
+        self.stop = threading.Event()
+        position = Position.from_board(self.board)
+
+        self.thread = threading.Thread(target=self.think, args=(position, self.limits, self.stop), daemon=True)
+        self.thread.start()
+        if not self.limits.infinite:
+            self.arm_timer(self.limits.hard)
+
+    def arm_timer(self, seconds):
+        if seconds is None:
+            return
+
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = threading.Timer(seconds, self.stop.set)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def wait(self):
+        """
+        Waits for the running search to end. An infinite search is stopped first.
+        """
+        if self.thread is None:
+            return
+
+        if self.limits.infinite:
+            self.stop.set()
+        self.thread.join()
+        self.thread = None
+        if self.timer is not None:
+            self.timer.cancel()
+
+    def think(self, position, limits, stop):
+        """
+        Iterative deepening: searches depth 1, 2, ... until a limit is reached and sends an "info" line after every
+        depth. Runs in the search thread and ends with the "bestmove" line.
+        """
+        board = position.to_board()
+        stats = SearchStats()
+        start = time.perf_counter()
+        best = None
+        durations = []
+
+        # Positions of the opening book are played without searching, unless the GUI asked to analyse
+        bookMove = engine.opening_book.choose(board, position.white) if engine.opening_book is not None and not limits.infinite else None
+        if bookMove is not None:
+            self.send(f"bestmove {format_move(bookMove[0].cell, bookMove[1])}")
+            return
+
+        def on_progress(move, searched, total):
+            if move.piece is not None:
+                self.send(f"info depth {depth} currmove {format_move(move.piece.cell, move.cell)} currmovenumber {searched} "
+                          f"nodes {stats.nodes} nps {int(stats.nodes / max(time.perf_counter() - start, 1e-9))}")
+
+        for depth in range(1, limits.depth + 1):
+            minMaxArg = MinMaxArg(depth, position.white, stop, stats, max_nodes=limits.nodes)
+            board.stats = stats
+            iteration = time.perf_counter()
+
+            try:
+                move = minMax_progress(board, minMaxArg, on_progress)
+            except SearchCancelled:
+                break
+
+            elapsed = time.perf_counter() - start
+            durations.append(time.perf_counter() - iteration)
+
+            if move.piece is None:
+                break
+
+            best = format_move(move.piece.cell, move.cell)
+            line = engine.search_pv(board, minMaxArg, move)
+            pv = [format_move(origin, target) for origin, target in line]
+            self.send(f"info depth {depth} score {format_score(move.score, position.white, line)} "
+                      f"nodes {stats.nodes} nps {int(stats.nodes / max(elapsed, 1e-9))} time {int(elapsed * 1000)} "
+                      f"pv {' '.join(pv)}")
+
+            # Do not start a depth that can not finish in time, the time spent pondering does not count
+            if limits.soft is not None and not limits.infinite:
+                used = time.perf_counter() - limits.started
+                growth = durations[-1] / durations[-2] if len(durations) > 1 and durations[-2] > 0 else DEFAULT_GROWTH
+                if used >= limits.soft or used + durations[-1] * growth > limits.hard:
+                    break
+
+        # An infinite search reports its result only when stopped
+        while limits.infinite and not stop.is_set():
+            stop.wait(0.01)
+
+        if best is None:
+            # Not even depth 1 was finished in time, play any legal move
+            best = next((format_move(piece.cell, cell) for piece in board.iterate_cells_with_pieces(position.white)
+                         for cell in piece.get_valid_cells()), "0000")
+
+        self.send(f"bestmove {best}")
+
+    def run(self, lines=None):
+        """
+        Reads commands until "quit" or the end of the input
+        """
+        for line in lines if lines is not None else sys.stdin:
+            if not self.handle(line):
+                return
+
+        self.stop.set()
+        self.wait()
+
+
+def main():
+    UCIEngine().run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
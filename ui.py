@@ -1,7 +1,7 @@
 import pygame
 import numpy as np
 from pieces import Piece, Pawn, Rook, Bishop, Queen, King, Knight
-from engine import suggest_move, suggest_random_move
+from engine import suggest_random_move, start_search, Ponderer
 
 
 class UIState:
@@ -11,6 +11,8 @@ class UIState:
         self.selected_cell = None
         self.valid_cells = None
         self.score = 0.0
+        self.thinking = False
+        self.best_move = None
 
         pass
 
@@ -134,6 +136,27 @@ def draw_checker_pattern(screen, uiState):
             pygame.draw.line(screen, (255, 0, 0), (xFrom, yFrom), (xTo, yTo), 3)
 
 
+def draw_search_state(screen, font, uiState):
+    if not uiState.thinking:
+        return
+
+    # Arrow for the best move found so far
+    if uiState.best_move is not None and uiState.best_move.piece is not None:
+        row, col = uiState.best_move.piece.cell
+        xFrom = col * 100 + 50
+        yFrom = 700 - row * 100 + 50
+        row, col = uiState.best_move.cell
+        xTo = col * 100 + 50
+        yTo = 700 - row * 100 + 50
+        pygame.draw.line(screen, (0, 0, 255), (xFrom, yFrom), (xTo, yTo), 5)
+        pygame.draw.circle(screen, (0, 0, 255), (xTo, yTo), 8)
+
+    # Thinking indicator with animated dots
+    dots = "." * (1 + pygame.time.get_ticks() // 300 % 3)
+    text = font.render("Thinking" + dots, True, (0, 0, 255))
+    screen.blit(text, (10, 10))
+
+
 def draw_board(screen, sprites, board):
     for row in range(8):
         for col in range(8):
@@ -173,26 +196,42 @@ def run_game(board, manual=False):
     # Game loop
     running = True
     uiState = UIState()
+    clock = pygame.time.Clock()
+    font = pygame.font.SysFont(None, 36)
 
     nextMove = None
     whitesTurn = True
+    search = None
+    ponder = None
 
     while running:
+        # The engine searches in the background, so the window keeps redrawing and processing events
         if nextMove is None and not manual:
-            nextMove = suggest_move(board)
-            # nextMove = suggest_random_move(board)
-            print("Next Move is ", nextMove)
-            board.set_cell(nextMove.cell, nextMove.piece)
-            uiState.score = nextMove.score
-            displayScore = np.tanh(uiState.score / 8.0) * 4.0
-            print(f"Current Evaluation: {+displayScore:.2f}")
-            whitesTurn = False
- 
+            if search is None:
+                search = start_search(board)
+            elif search.done():
+                nextMove = search.result()
+                search = None
+                # nextMove = suggest_random_move(board)
+                print("Next Move is ", nextMove)
+                board.set_cell(nextMove.cell, nextMove.piece)
+                uiState.score = nextMove.score
+                displayScore = np.tanh(uiState.score / 8.0) * 4.0
+                print(f"Current Evaluation: {+displayScore:.2f}")
+                whitesTurn = False
+
+                # Think about the answer while the human is thinking about the move
+                ponder = Ponderer(board)
+
+        uiState.thinking = search is not None
+        uiState.best_move = search.best_move if search is not None else None
+
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
 
-            if event.type == pygame.MOUSEBUTTONDOWN:
+            # The board must not change while the engine is thinking
+            if event.type == pygame.MOUSEBUTTONDOWN and search is None:
                 piece = board.get_cell(uiState.mouse_over_cell)
                 if piece and piece.white == whitesTurn:
                     uiState.dragging = True
@@ -217,15 +256,29 @@ def run_game(board, manual=False):
                             nextMove = None
                             whitesTurn = not whitesTurn
 
+                            # Continue with the pondered search, it knows this position already
+                            if ponder is not None and not manual:
+                                search = ponder.search(board)
+                                ponder = None
+
                 uiState.valid_cells = None
 
         draw_checker_pattern(screen, uiState)
         draw_board(screen, sprites, board)
+        draw_search_state(screen, font, uiState)
 
         uiState = get_cell_under_mouse(uiState)
 
         # Flip the display
         pygame.display.flip()
 
+        # Keep a steady frame rate and leave the remaining time to the search thread
+        clock.tick(60)
+
+    if search is not None:
+        search.cancel()
+    if ponder is not None:
+        ponder.cancel()
+
     # Quit Pygame
     pygame.quit()